@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for vmware_python_sdk_samples, run as python -m modules"""
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Import time benchmark, guards the lazy imports of the package.
+
+Every case is imported in a fresh interpreter, repeat times. The gate is
+the list of modules a case must not load, e.g. importing VMWARE must not
+pull in pyVmomi. The best wall time is compared against a budget as well,
+loose by default so shared CI hosts do not flake, --budget-scale below 1
+tightens it on a quiet machine. Exits non zero on a regression, so it can
+run in CI:
+
+    python -m vmware_python_sdk_samples.benchmarks.import_time
+    python -m vmware_python_sdk_samples.benchmarks.import_time --json out.json
+    python -m vmware_python_sdk_samples.benchmarks.import_time --budget-scale 0.2
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+# Modules that are expensive to import and only needed to talk to vCenter.
+HEAVY_MODULES = ["pyVim", "pyVmomi", "colorlog", "ssl"]
+
+# Milliseconds an import may take. Importing pyVmomi alone takes about
+# 100 ms, the lazy imports stay well below on a quiet machine.
+DEFAULT_BUDGET_MS = 100
+
+# (name, statement, budget in milliseconds, modules that must stay unloaded)
+CASES = [
+    (
+        "package",
+        "import vmware_python_sdk_samples.src",
+        DEFAULT_BUDGET_MS,
+        HEAVY_MODULES,
+    ),
+    (
+        "constants",
+        "from vmware_python_sdk_samples.src import VMWARE",
+        DEFAULT_BUDGET_MS,
+        HEAVY_MODULES,
+    ),
+    (
+        "logger",
+        "from vmware_python_sdk_samples.src import CustomLogger",
+        DEFAULT_BUDGET_MS,
+        HEAVY_MODULES,
+    ),
+]
+
+DEFAULT_REPEAT = 5
+
+_PROBE = """
+import json, sys, time
+start = time.time()
+exec({statement!r})
+elapsed = time.time() - start
+loaded = [m for m in {modules!r} if m in sys.modules]
+print(json.dumps({{"seconds": elapsed, "loaded": loaded}}))
+"""
+
+
+def measure(statement, modules, repeat=DEFAULT_REPEAT):
+    """
+    Import statement in fresh interpreters
+    Args:
+        statement (str) : import statement to time
+        modules (list) : module names to check for after the import
+        repeat (int) : number of interpreters to start
+    Returns:
+        (dict) best and all timings in milliseconds and the modules of
+        modules that were loaded
+    """
+    timings = []
+    loaded = set()
+    for _ in range(repeat):
+        output = subprocess.check_output(
+            [sys.executable, "-c", _PROBE.format(statement=statement, modules=modules)]
+        )
+        result = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+        timings.append(result["seconds"] * 1000)
+        loaded.update(result["loaded"])
+    return {"best_ms": min(timings), "timings_ms": timings, "loaded": sorted(loaded)}
+
+
+def run(repeat=DEFAULT_REPEAT, budget_scale=1.0):
+    """
+    Run every case
+    Args:
+        repeat (int) : interpreters started per case
+        budget_scale (float) : factor applied to every budget, above 1 for
+                    slow hosts, below 1 to tighten them
+    Returns:
+        (list) a result dict per case, with "ok" telling whether it passed
+    """
+    results = []
+    for name, statement, budget_ms, forbidden in CASES:
+        result = measure(statement, forbidden, repeat)
+        budget = budget_ms * budget_scale
+        result.update(
+            {
+                "name": name,
+                "statement": statement,
+                "budget_ms": budget,
+                "ok": result["best_ms"] <= budget and not result["loaded"],
+            }
+        )
+        results.append(result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument(
+        "--budget-scale",
+        type=float,
+        default=1.0,
+        help="multiply every budget, e.g. 2 on slow hosts or 0.2 to tighten",
+    )
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    results = run(args.repeat, args.budget_scale)
+    for result in results:
+        print(
+            "{0:<4} {1:<10} {2:8.2f} ms (budget {3:.0f} ms){4}".format(
+                "ok" if result["ok"] else "FAIL",
+                result["name"],
+                result["best_ms"],
+                result["budget_ms"],
+                " loaded: " + ", ".join(result["loaded"]) if result["loaded"] else "",
+            )
+        )
+    if args.json:
+        with open(args.json, "w") as fd:
+            json.dump(results, fd, indent=2)
+    return 0 if all(result["ok"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
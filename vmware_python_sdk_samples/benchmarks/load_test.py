@@ -0,0 +1,565 @@
+# -*- coding: utf-8 -*-
+"""
+Load test of concurrent VMware clients against the fake vCenter.
+
+Every worker is an orchestrator with its own VMware connection that runs a
+weighted mix of power, reconfigure, disk add, NIC add and delete operations
+through the public VMware methods until the duration is over. The test is
+repeated for every concurrency level and reports throughput and p50/p95/p99
+latency per operation, and the level where latency rises sharply, the first
+one whose p95 is knee-factor times the p95 of the lowest level.
+
+Workers are threads by default, --processes runs them as processes so the
+clients do not share the interpreter, and the GIL, with the fake vCenter:
+
+    python -m vmware_python_sdk_samples.benchmarks.load_test
+    python -m vmware_python_sdk_samples.benchmarks.load_test --processes \\
+        --concurrency 1,4,16,64 --mix power=1,reconfigure=3 --json load.json
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import random
+import sys
+import threading
+import time
+
+from ..fake_vcenter import FakeVCenter, generate_inventory
+from ..fake_vcenter.inventory import NetworkEntry, VirtualMachineEntry
+from ..src.constants import VMWARE
+from ..src.vmware import VMware
+
+DEFAULT_VMS = 10000
+DEFAULT_NETWORKS = 20
+DEFAULT_CONCURRENCY = [1, 2, 4, 8, 16, 32]
+# seconds every concurrency level runs
+DEFAULT_DURATION = 10.0
+# seconds the fake vCenter delays every request, a stand-in for the network
+# and for vCenter itself
+DEFAULT_LATENCY = 0.005
+DEFAULT_MIX = "power=30,reconfigure=40,disk=10,nic=10,delete=10"
+# p95 of a level over the p95 of the lowest level that counts as saturated
+DEFAULT_KNEE_FACTOR = 2.0
+# share of the vms set aside for delete operations
+DELETE_SHARE = 0.5
+# seconds workers may take to connect
+CONNECT_TIMEOUT = 120
+
+DATACENTER = "Datacenter-1"
+USERNAME = "loadtest"
+PASSWORD = "loadtest"
+
+
+class _Exhausted(Exception):
+    """The worker has no vms left to delete"""
+
+    pass
+
+
+class _WorkerState(object):
+    """vms and networks a worker operates on"""
+
+    def __init__(self, job):
+        self.vms = job["vms"]
+        self.deletable = list(job["deletable"])
+        self.networks = job["networks"]
+        self.rng = random.Random(job["seed"])
+        self.powered_on = {}
+        self._next = 0
+
+    def vm(self):
+        # round robin, so disks and NICs are spread over the vms
+        vm_id = self.vms[self._next % len(self.vms)]
+        self._next += 1
+        return vm_id
+
+    def network(self):
+        return self.rng.choice(self.networks)
+
+
+def _power(vmware, state):
+    vm_id = state.vm()
+    powered_on = state.powered_on.get(vm_id, False)
+    operation = (
+        VMWARE.OPERATIONS.POWER_OFF if powered_on else VMWARE.OPERATIONS.POWER_ON
+    )
+    vmware.change_vm_power_state(DATACENTER, vm_id, operation)
+    state.powered_on[vm_id] = not powered_on
+
+
+def _reconfigure(vmware, state):
+    vmware.update(
+        DATACENTER,
+        state.vm(),
+        num_vcpu=state.rng.choice([2, 4, 8]),
+        memory=state.rng.choice([2048, 4096, 8192]),
+    )
+
+
+def _disk(vmware, state):
+    vmware.add_vdisk(DATACENTER, state.vm(), disk_size=1)
+
+
+def _nic(vmware, state):
+    vmware.add_virtual_network(
+        DATACENTER, state.vm(), state.network(), VMWARE.NETADAPTERS.VMXNET3
+    )
+
+
+def _delete(vmware, state):
+    if not state.deletable:
+        raise _Exhausted()
+    vmware.delete_vm(DATACENTER, state.deletable.pop())
+
+
+OPERATIONS = {
+    "power": _power,
+    "reconfigure": _reconfigure,
+    "disk": _disk,
+    "nic": _nic,
+    "delete": _delete,
+}
+
+
+def parse_mix(mix):
+    """
+    Parse an operation mix
+    Args:
+        mix (str) : comma separated operation=weight pairs, e.g. "power=1,nic=2"
+    Returns:
+        (list) (operation, weight) pairs
+    Raises: ValueError for unknown operations or bad weights
+    """
+    pairs = []
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(
+                "Unknown operation '{0}', valid operations are {1}".format(
+                    name, ", ".join(sorted(OPERATIONS))
+                )
+            )
+        weight = float(weight or 1)
+        if weight < 0:
+            raise ValueError("Weight of '{0}' is negative".format(name))
+        if weight:
+            pairs.append((name, weight))
+    if not pairs:
+        raise ValueError("The mix has no operation")
+    return pairs
+
+
+def run_worker(job, barrier):
+    """
+    Connect, wait for the other workers and run operations for the duration
+    Args:
+        job (dict) : host, port, vms, deletable vms, networks, mix, seed,
+                    duration and the VMware options of the worker
+        barrier (Barrier) : shared by the workers of a level, the clock
+                    starts once all are connected
+    Returns:
+        (dict) samples as [operation, start, seconds, error] lists, whether
+        the deletable vms ran out, error if the worker could not connect
+    """
+    result = {"samples": [], "exhausted": False, "error": None}
+    vmware = None
+    try:
+        vmware = VMware(
+            job["host"], USERNAME, PASSWORD, port=job["port"], **job["options"]
+        )
+    except Exception as ex:
+        result["error"] = "{0}: {1}".format(type(ex).__name__, ex)
+    barrier.wait(CONNECT_TIMEOUT)
+    if vmware is None:
+        return result
+
+    state = _WorkerState(job)
+    mix = list(job["mix"])
+    deadline = time.time() + job["duration"]
+    try:
+        while time.time() < deadline:
+            names, weights = zip(*mix)
+            name = state.rng.choices(names, weights)[0]
+            start = time.time()
+            error = None
+            try:
+                OPERATIONS[name](vmware, state)
+            except _Exhausted:
+                result["exhausted"] = True
+                mix = [pair for pair in mix if pair[0] != name]
+                if not mix:
+                    break
+                continue
+            except Exception as ex:
+                error = type(ex).__name__
+            result["samples"].append([name, start, time.time() - start, error])
+    finally:
+        vmware.disconnect()
+    return result
+
+
+def _process_worker(job, barrier, queue):
+    try:
+        queue.put(run_worker(job, barrier))
+    except Exception as ex:
+        queue.put({"samples": [], "exhausted": False, "error": repr(ex)})
+
+
+def _run_threads(jobs):
+    barrier = threading.Barrier(len(jobs))
+    results = [None] * len(jobs)
+
+    def target(index):
+        try:
+            results[index] = run_worker(jobs[index], barrier)
+        except Exception as ex:
+            results[index] = {"samples": [], "exhausted": False, "error": repr(ex)}
+
+    threads = [
+        threading.Thread(target=target, args=(index,), name="load-{0}".format(index))
+        for index in range(len(jobs))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def _run_processes(jobs):
+    # spawn, forked workers would inherit the threads of the fake vCenter
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(len(jobs))
+    queue = context.Queue()
+    processes = [
+        context.Process(target=_process_worker, args=(job, barrier, queue))
+        for job in jobs
+    ]
+    for process in processes:
+        process.start()
+    timeout = CONNECT_TIMEOUT + max(job["duration"] for job in jobs) * 2 + 60
+    results = [queue.get(timeout=timeout) for _ in jobs]
+    for process in processes:
+        process.join()
+    return results
+
+
+def percentile(values, percent):
+    """
+    Nearest rank percentile
+    Args:
+        values (list) : sorted samples
+        percent (float) : percentile, 0 - 100
+    Returns:
+        (float) the sample at the percentile, None without samples
+    """
+    if not values:
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+
+def _latency(seconds, elapsed):
+    seconds = sorted(seconds)
+    return {
+        "count": len(seconds),
+        "throughput": len(seconds) / elapsed if elapsed > 0 else None,
+        "mean": sum(seconds) / len(seconds) if seconds else None,
+        "p50": percentile(seconds, 50),
+        "p95": percentile(seconds, 95),
+        "p99": percentile(seconds, 99),
+        "max": seconds[-1] if seconds else None,
+    }
+
+
+def summarize(concurrency, results):
+    """
+    Aggregate the worker results of a level
+    Args:
+        concurrency (int) : number of workers
+        results (list) : run_worker results
+    Returns:
+        (dict) overall and per operation throughput and latencies, errors
+        by operation and type
+    """
+    samples = [sample for result in results for sample in result["samples"]]
+    elapsed = 0.0
+    if samples:
+        start = min(sample[1] for sample in samples)
+        elapsed = max(sample[1] + sample[2] for sample in samples) - start
+    level = _latency([sample[2] for sample in samples], elapsed)
+    level.update(
+        {
+            "concurrency": concurrency,
+            "elapsed_s": elapsed,
+            "errors": sum(1 for sample in samples if sample[3]),
+            "worker_errors": [r["error"] for r in results if r["error"]],
+            "deletes_exhausted": any(result["exhausted"] for result in results),
+            "operations": {},
+        }
+    )
+    for name in sorted(set(sample[0] for sample in samples)):
+        own = [sample for sample in samples if sample[0] == name]
+        operation = _latency([sample[2] for sample in own], elapsed)
+        errors = {}
+        for sample in own:
+            if sample[3]:
+                errors[sample[3]] = errors.get(sample[3], 0) + 1
+        operation["errors"] = errors
+        level["operations"][name] = operation
+    return level
+
+
+def find_saturation(levels, knee_factor=DEFAULT_KNEE_FACTOR):
+    """
+    Find where latency rises sharply
+    Args:
+        levels (list) : summarize() results, ascending concurrency
+        knee_factor (float) : p95 over the p95 of the lowest level that counts
+                    as saturated
+    Returns:
+        (dict) the saturated concurrency, None if no level reached it, the
+        reference p95 and the concurrency with the highest throughput
+    """
+    measured = [level for level in levels if level["p95"] is not None]
+    if not measured:
+        return {"concurrency": None, "baseline_p95": None, "peak_throughput": None}
+    baseline = measured[0]["p95"]
+    saturated = None
+    for level in measured[1:]:
+        if level["p95"] >= knee_factor * baseline:
+            saturated = level["concurrency"]
+            break
+    peak = max(measured, key=lambda level: level["throughput"] or 0)
+    return {
+        "concurrency": saturated,
+        "baseline_p95": baseline,
+        "knee_factor": knee_factor,
+        "peak_throughput": peak["throughput"],
+        "peak_throughput_concurrency": peak["concurrency"],
+    }
+
+
+def _allocate(inventory, levels, seed):
+    """
+    Shuffled vms of the datacenter, split into vms that are operated on and
+    a pool of deletable vms per level
+    """
+    vms = [
+        vm.instance_uuid
+        for vm in inventory.entries(VirtualMachineEntry)
+        if vm.datacenter.props["name"] == DATACENTER
+    ]
+    random.Random(seed).shuffle(vms)
+    split = int(len(vms) * DELETE_SHARE)
+    deletable, vms = vms[:split], vms[split:]
+    per_level = len(deletable) // max(len(levels), 1)
+    return vms, [
+        deletable[index * per_level : (index + 1) * per_level]
+        for index in range(len(levels))
+    ]
+
+
+def run(
+    vms=DEFAULT_VMS,
+    networks=DEFAULT_NETWORKS,
+    concurrency=DEFAULT_CONCURRENCY,
+    duration=DEFAULT_DURATION,
+    mix=DEFAULT_MIX,
+    processes=False,
+    latency=DEFAULT_LATENCY,
+    jitter=0.0,
+    task_duration=0.0,
+    options=None,
+    knee_factor=DEFAULT_KNEE_FACTOR,
+    seed=0,
+    progress=None,
+):
+    """
+    Run the load test at every concurrency level
+    Args:
+        vms (int) : vms of the inventory
+        networks (int) : standard networks of the inventory
+        concurrency (list) : numbers of workers, ascending
+        duration (float) : seconds every level runs
+        mix (str) : operation=weight pairs, see parse_mix()
+        processes (bool) : run workers as processes instead of threads
+        latency (float) : seconds the fake vCenter delays every request
+        jitter (float) : up to this many seconds are added to latency
+        task_duration (float) : seconds tasks of the fake vCenter run
+        options (dict) : keyword arguments of VMware, e.g. task_watcher
+        knee_factor (float) : see find_saturation()
+        seed (int) : seed of the inventory and of the workers
+        progress (callable) : called with every level as it is done
+    Returns:
+        (dict) "levels" as returned by summarize() and "saturation" as
+        returned by find_saturation()
+    """
+    pairs = parse_mix(mix)
+    concurrency = sorted(concurrency)
+    inventory = generate_inventory(vms=vms, networks=networks, seed=seed)
+    network_names = [
+        network.props["name"] for network in inventory.entries(NetworkEntry)
+    ]
+    operated, deletable = _allocate(inventory, concurrency, seed)
+
+    levels = []
+    fake = FakeVCenter(
+        inventory,
+        latency=latency,
+        jitter=jitter,
+        task_duration=task_duration,
+        username=USERNAME,
+        password=PASSWORD,
+    )
+    with fake:
+        for level_index, workers in enumerate(concurrency):
+            jobs = [
+                {
+                    "host": fake.host,
+                    "port": fake.port,
+                    "vms": operated[index::workers],
+                    "deletable": deletable[level_index][index::workers],
+                    "networks": network_names,
+                    "mix": pairs,
+                    "seed": seed * 100003 + level_index * 1009 + index,
+                    "duration": duration,
+                    "options": options or {},
+                }
+                for index in range(workers)
+            ]
+            results = _run_processes(jobs) if processes else _run_threads(jobs)
+            level = summarize(workers, results)
+            levels.append(level)
+            if progress is not None:
+                progress(level)
+    return {"levels": levels, "saturation": find_saturation(levels, knee_factor)}
+
+
+def _ms(seconds):
+    return "{0:8.1f}".format(seconds * 1000) if seconds is not None else "       -"
+
+
+def format_level(level):
+    """
+    Returns (str) report lines of a level, overall first, then per operation
+    """
+    lines = [
+        "{0:>5} workers {1:8.1f} ops/s  p50 {2} p95 {3} p99 {4} ms  "
+        "{5} errors{6}".format(
+            level["concurrency"],
+            level["throughput"] or 0,
+            _ms(level["p50"]),
+            _ms(level["p95"]),
+            _ms(level["p99"]),
+            level["errors"],
+            ", deletes ran out" if level["deletes_exhausted"] else "",
+        )
+    ]
+    for name, operation in sorted(level["operations"].items()):
+        lines.append(
+            "      {0:<13} {1:8.1f} ops/s  p50 {2} p95 {3} p99 {4} ms  "
+            "{5} errors".format(
+                name,
+                operation["throughput"] or 0,
+                _ms(operation["p50"]),
+                _ms(operation["p95"]),
+                _ms(operation["p99"]),
+                sum(operation["errors"].values()),
+            )
+        )
+    for error in level["worker_errors"]:
+        lines.append("      worker failed: " + error)
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--vms", type=int, default=DEFAULT_VMS)
+    parser.add_argument("--networks", type=int, default=DEFAULT_NETWORKS)
+    parser.add_argument(
+        "--concurrency",
+        default=",".join(str(level) for level in DEFAULT_CONCURRENCY),
+        help="comma separated numbers of workers, default %(default)s",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=DEFAULT_DURATION,
+        help="seconds per concurrency level",
+    )
+    parser.add_argument(
+        "--mix", default=DEFAULT_MIX, help="operation weights, default %(default)s"
+    )
+    parser.add_argument(
+        "--processes", action="store_true", help="run workers as processes"
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=DEFAULT_LATENCY,
+        help="seconds the fake vCenter delays every request",
+    )
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--task-duration", type=float, default=0.0)
+    parser.add_argument(
+        "--task-watcher", action="store_true", help="workers share a task filter"
+    )
+    parser.add_argument("--vm-index", action="store_true", help="workers index vms")
+    parser.add_argument("--knee-factor", type=float, default=DEFAULT_KNEE_FACTOR)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    def progress(level):
+        print(format_level(level))
+        sys.stdout.flush()
+
+    report = run(
+        vms=args.vms,
+        networks=args.networks,
+        concurrency=[int(level) for level in args.concurrency.split(",")],
+        duration=args.duration,
+        mix=args.mix,
+        processes=args.processes,
+        latency=args.latency,
+        jitter=args.jitter,
+        task_duration=args.task_duration,
+        options={"task_watcher": args.task_watcher, "vm_index": args.vm_index},
+        knee_factor=args.knee_factor,
+        seed=args.seed,
+        progress=progress,
+    )
+    saturation = report["saturation"]
+    if saturation["concurrency"] is None:
+        print(
+            "no saturation: p95 stayed below {0}x {1} ms".format(
+                args.knee_factor, _ms(saturation["baseline_p95"]).strip()
+            )
+        )
+    else:
+        print(
+            "saturated at {0} workers: p95 reached {1}x {2} ms".format(
+                saturation["concurrency"],
+                args.knee_factor,
+                _ms(saturation["baseline_p95"]).strip(),
+            )
+        )
+    if saturation["peak_throughput"] is not None:
+        print(
+            "peak throughput {0:.1f} ops/s at {1} workers".format(
+                saturation["peak_throughput"],
+                saturation["peak_throughput_concurrency"],
+            )
+        )
+    if args.json:
+        with open(args.json, "w") as fd:
+            json.dump(report, fd, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Record one VMware call against vCenter, replay it offline.
+
+record connects, runs the call and disconnects while a SoapRecorder writes
+the SOAP exchanges; the call and the connection details go into the header
+of the recording. replay runs the same call again with a SoapReplayer, so
+without network access, and reports the wall time, the round trips and the
+bytes of the call, with the recorded latencies, scaled, or none:
+
+    python -m vmware_python_sdk_samples.benchmarks.soap_replay record \\
+        --host vcenter --username user --password pass --out delete.soap.gz \\
+        delete_vm Datacenter-1 4210e1a2-0d5e-4c3f-9b8e-1f2a3b4c5d6e
+    python -m vmware_python_sdk_samples.benchmarks.soap_replay replay \\
+        delete.soap.gz --latency-scale 0 --repeat 10 --json replay.json
+
+Arguments of the call are parsed as JSON where they can be, e.g. 4 is an
+int, and passed as strings otherwise.
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+
+from ..src.vmware import VMware
+from ..src.vmware.instrumentation import (
+    InMemoryMetrics,
+    disable_instrumentation,
+    enable_instrumentation,
+)
+from ..src.vmware.transport import SoapRecorder, SoapReplayer
+
+
+def _argument(value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def record(path, host, username, password, port, method, args):
+    """
+    Record a VMware call
+    Args:
+        path (str) : recording to write
+        host (str) : vCenter host
+        username (str) : vCenter user
+        password (str) : password of username, not recorded
+        port (int) : vCenter port
+        method (str) : name of the public VMware method
+        args (list) : positional arguments of the method
+    Returns:
+        (int) recorded exchanges
+    """
+    meta = {
+        "host": host,
+        "port": port,
+        "username": username,
+        "method": method,
+        "args": args,
+    }
+    recorder = SoapRecorder(path, meta=meta)
+    with recorder:
+        vmware = VMware(host, username, password, port=port)
+        try:
+            getattr(vmware, method)(*args)
+        finally:
+            vmware.disconnect()
+    return recorder.exchanges
+
+
+def replay(path, latency_scale=1.0, strict=False):
+    """
+    Replay a recorded VMware call
+    Args:
+        path (str) : recording written by record()
+        latency_scale (float) : factor applied to the recorded latencies
+        strict (bool) : fail on requests that were answered already
+    Returns:
+        (dict) connect and call seconds, round trips and bytes of the call,
+        the replay counters of SoapReplayer.stats() and error if the call
+        raised
+    """
+    replayer = SoapReplayer(path, latency_scale=latency_scale, strict=strict)
+    meta = replayer.meta
+    metrics = InMemoryMetrics()
+    result = {"error": None}
+    with replayer:
+        start = time.time()
+        vmware = VMware(meta["host"], meta["username"], "", port=meta["port"])
+        result["connect_s"] = time.time() - start
+        enable_instrumentation(metrics)
+        start = time.time()
+        try:
+            getattr(vmware, meta["method"])(*meta["args"])
+        except Exception as ex:
+            result["error"] = "{0}: {1}".format(type(ex).__name__, ex)
+        finally:
+            result["call_s"] = time.time() - start
+            disable_instrumentation(metrics)
+            vmware.disconnect()
+    calls = metrics.stats()["vsphere"]
+    result.update(
+        {
+            "soap_calls": sum(totals["calls"] for totals in calls.values()),
+            "bytes_out": sum(totals["bytes_out"] for totals in calls.values()),
+            "bytes_in": sum(totals["bytes_in"] for totals in calls.values()),
+            "methods": dict((name, totals["calls"]) for name, totals in calls.items()),
+            "replay": replayer.stats(),
+        }
+    )
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    record_parser = commands.add_parser("record", help="record a call")
+    record_parser.add_argument("--host", required=True)
+    record_parser.add_argument("--port", type=int, default=443)
+    record_parser.add_argument("--username", required=True)
+    record_parser.add_argument("--password", required=True)
+    record_parser.add_argument("--out", required=True, help="recording to write")
+    record_parser.add_argument("method", help="public VMware method")
+    record_parser.add_argument("args", nargs="*", type=_argument)
+
+    replay_parser = commands.add_parser("replay", help="replay a recorded call")
+    replay_parser.add_argument("recording")
+    replay_parser.add_argument(
+        "--latency-scale",
+        type=float,
+        default=1.0,
+        help="factor of the recorded latencies, 0 replays without delays",
+    )
+    replay_parser.add_argument("--repeat", type=int, default=1)
+    replay_parser.add_argument(
+        "--strict", action="store_true", help="fail on repeated requests"
+    )
+    replay_parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        exchanges = record(
+            args.out,
+            args.host,
+            args.username,
+            args.password,
+            args.port,
+            args.method,
+            args.args,
+        )
+        print("recorded {0} exchanges to {1}".format(exchanges, args.out))
+        return 0
+
+    results = [
+        replay(args.recording, args.latency_scale, args.strict)
+        for _ in range(args.repeat)
+    ]
+    for result in results:
+        print(
+            "connect {0:8.2f} ms  call {1:8.2f} ms  {2} calls  {3:.1f} KB  "
+            "{4} replayed, {5} repeated, {6} unused{7}".format(
+                result["connect_s"] * 1000,
+                result["call_s"] * 1000,
+                result["soap_calls"],
+                (result["bytes_out"] + result["bytes_in"]) / 1024.0,
+                result["replay"]["replayed"],
+                result["replay"]["repeated"],
+                result["replay"]["unused"],
+                " ERROR " + result["error"] if result["error"] else "",
+            )
+        )
+    if len(results) > 1:
+        print(
+            "median call {0:.2f} ms".format(
+                statistics.median(result["call_s"] for result in results) * 1000
+            )
+        )
+    if args.json:
+        with open(args.json, "w") as fd:
+            json.dump(results, fd, indent=2)
+    return 1 if any(result["error"] for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,639 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the public VMware methods against the fake vCenter.
+
+For every inventory size a FakeVCenter is started in this process, every case
+then runs in a fresh interpreter that connects to it, so the peak RSS of a
+case is that of the client alone. A case calls its method repeat times, every
+time on vms no other case touched, and reports the wall time of the calls,
+the SOAP round trips and bytes they made, counted by the instrumentation of
+the vmware package, and the peak RSS of the client. Results can be saved as
+JSON and compared with the results of another branch:
+
+    python -m vmware_python_sdk_samples.benchmarks.vmware_methods
+    python -m vmware_python_sdk_samples.benchmarks.vmware_methods \\
+        --sizes 1000 --cases get_vm_in_dc,update --json branch.json
+    python -m vmware_python_sdk_samples.benchmarks.vmware_methods \\
+        --json branch.json --baseline master.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from pyVmomi import vim
+
+from ..fake_vcenter import FakeVCenter, generate_inventory
+from ..fake_vcenter.inventory import NetworkEntry, VirtualMachineEntry
+from ..src.constants import VMWARE
+from ..src.vmware import VMware, vmware_utils
+from ..src.vmware.instrumentation import (
+    MetricsSink,
+    disable_instrumentation,
+    enable_instrumentation,
+)
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+# standard networks, distributed portgroups and opaque networks of the
+# inventories, 10k networks in total
+DEFAULT_NETWORKS = 9800
+DEFAULT_PORTGROUPS = 100
+DEFAULT_OPAQUE_NETWORKS = 100
+DEFAULT_REPEAT = 5
+# vms per call of the bulk cases
+DEFAULT_BATCH = 20
+# seconds a case may run, including its connection
+DEFAULT_TIMEOUT = 900
+
+DATACENTER = "Datacenter-1"
+USERNAME = "benchmark"
+PASSWORD = "benchmark"
+
+_WORKER_MODULE = __package__ + ".vmware_methods"
+
+
+class Case(object):
+    """A benchmarked call of one method"""
+
+    def __init__(self, name, run, prepare=None, cleanup=None, pool="any", bulk=False):
+        """
+        Args:
+            name (str) : case name, the name of the measured method
+            run (callable) : the timed call, run(bench, call)
+            prepare (callable) : untimed, prepare(bench, call) before every
+                        call, may set call.state
+            cleanup (callable) : untimed, cleanup(bench, call) after every call
+            pool (str) : power state of the vms the case needs, "on", "off"
+                        or "any"
+            bulk (bool) : the case takes batch vms per call instead of one
+        """
+        self.name = name
+        self.run = run
+        self.prepare = prepare
+        self.cleanup = cleanup
+        self.pool = pool
+        self.bulk = bulk
+
+
+class _Call(object):
+    """Arguments of one timed call"""
+
+    def __init__(self, index, vms, network):
+        self.index = index
+        self.vms = vms
+        self.vm_id = vms[0]["uuid"]
+        self.network = network
+        self.state = None
+
+
+def _new_connection(bench, call):
+    call.state = bench.connect()
+
+
+def _disconnect(bench, call):
+    call.state.disconnect()
+
+
+def _config_spec(bench, call):
+    esx_vm = bench.vmware.get_vm_in_dc(DATACENTER, call.vm_id)
+    call.state = esx_vm, vim.vm.ConfigSpec(memoryMB=4096)
+
+
+def _vm_view(bench, call):
+    content = bench.vmware.si.content
+    call.state = content.viewManager.CreateContainerView(
+        content.rootFolder, [vim.VirtualMachine], True
+    )
+
+
+def _collect_properties(bench, call):
+    vmware_utils.collect_properties(
+        bench.vmware.si, call.state, vim.VirtualMachine, ["name", "runtime.powerState"]
+    )
+
+
+def _get_obj(bench, call):
+    vmware_utils.get_obj(
+        bench.vmware.si.content, [vim.VirtualMachine], call.vms[0]["name"]
+    )
+
+
+def _submit_task(bench, call):
+    esx_vm = bench.vmware.get_vm_in_dc(DATACENTER, call.vm_id)
+    call.state = esx_vm.ReconfigVM_Task(spec=vim.vm.ConfigSpec(memoryMB=4096))
+
+
+CASES = [
+    Case("connect", _new_connection, cleanup=_disconnect),
+    Case("disconnect", _disconnect, prepare=_new_connection),
+    Case(
+        "enable_vm_index",
+        lambda b, c: b.vmware.enable_vm_index(),
+        cleanup=lambda b, c: b.vmware.disable_vm_index(),
+    ),
+    Case(
+        "disable_vm_index",
+        lambda b, c: b.vmware.disable_vm_index(),
+        prepare=lambda b, c: b.vmware.enable_vm_index(),
+    ),
+    Case(
+        "vm_index_stats",
+        lambda b, c: b.vmware.vm_index_stats(),
+        prepare=lambda b, c: b.vmware.enable_vm_index(),
+    ),
+    Case(
+        "enable_task_watcher",
+        lambda b, c: b.vmware.enable_task_watcher(),
+        cleanup=lambda b, c: b.vmware.disable_task_watcher(),
+    ),
+    Case(
+        "disable_task_watcher",
+        lambda b, c: b.vmware.disable_task_watcher(),
+        prepare=lambda b, c: b.vmware.enable_task_watcher(),
+    ),
+    Case(
+        "enable_reconfig_coalescing",
+        lambda b, c: b.vmware.enable_reconfig_coalescing(),
+        cleanup=lambda b, c: b.vmware.disable_reconfig_coalescing(),
+    ),
+    Case(
+        "disable_reconfig_coalescing",
+        lambda b, c: b.vmware.disable_reconfig_coalescing(),
+        prepare=lambda b, c: b.vmware.enable_reconfig_coalescing(),
+    ),
+    Case("get_datacenter", lambda b, c: b.vmware.get_datacenter(DATACENTER)),
+    Case(
+        "invalidate_datacenter_cache",
+        lambda b, c: b.vmware.invalidate_datacenter_cache(DATACENTER),
+        prepare=lambda b, c: b.vmware.get_datacenter(DATACENTER),
+    ),
+    Case("get_vm_in_dc", lambda b, c: b.vmware.get_vm_in_dc(DATACENTER, c.vm_id)),
+    Case(
+        "get_vms_in_dc",
+        lambda b, c: b.vmware.get_vms_in_dc(DATACENTER, [vm["uuid"] for vm in c.vms]),
+        bulk=True,
+    ),
+    Case("get_network", lambda b, c: b.vmware.get_network(c.network)),
+    Case("add_vdisk", lambda b, c: b.vmware.add_vdisk(DATACENTER, c.vm_id, 1)),
+    Case(
+        "add_vdisks",
+        lambda b, c: b.vmware.add_vdisks(DATACENTER, c.vm_id, [{"disk_size": 1}] * 10),
+    ),
+    Case(
+        "add_virtual_network",
+        lambda b, c: b.vmware.add_virtual_network(
+            DATACENTER, c.vm_id, c.network, VMWARE.NETADAPTERS.VMXNET3
+        ),
+    ),
+    Case(
+        "update_vm_networks_in_nic",
+        lambda b, c: b.vmware.update_vm_networks_in_nic(DATACENTER, c.vm_id, c.network),
+    ),
+    Case("update_vcpu", lambda b, c: b.vmware.update_vcpu(DATACENTER, c.vm_id, 4)),
+    Case("update_core", lambda b, c: b.vmware.update_core(DATACENTER, c.vm_id, 2)),
+    Case(
+        "update_memory", lambda b, c: b.vmware.update_memory(DATACENTER, c.vm_id, 4096)
+    ),
+    Case(
+        "update_vcpu_core_memory",
+        lambda b, c: b.vmware.update_vcpu_core_memory(
+            DATACENTER, c.vm_id, num_vcpu=4, num_cores=2, memory=4096
+        ),
+    ),
+    Case(
+        "update_disk",
+        lambda b, c: b.vmware.update_disk(
+            DATACENTER, c.vm_id, controller_key=1000, disk_slot=0, disk_size=32
+        ),
+    ),
+    Case(
+        "update",
+        lambda b, c: b.vmware.update(DATACENTER, c.vm_id, num_vcpu=4, memory=4096),
+    ),
+    Case(
+        "update_vm",
+        lambda b, c: b.vmware.update_vm(*c.state),
+        prepare=_config_spec,
+    ),
+    Case(
+        "poweron_vm", lambda b, c: b.vmware.poweron_vm(DATACENTER, c.vm_id), pool="off"
+    ),
+    Case(
+        "poweroff_vm", lambda b, c: b.vmware.poweroff_vm(DATACENTER, c.vm_id), pool="on"
+    ),
+    Case("reboot_vm", lambda b, c: b.vmware.reboot_vm(DATACENTER, c.vm_id), pool="on"),
+    Case(
+        "suspend_vm", lambda b, c: b.vmware.suspend_vm(DATACENTER, c.vm_id), pool="on"
+    ),
+    Case(
+        "change_vm_power_state",
+        lambda b, c: b.vmware.change_vm_power_state(
+            DATACENTER, c.vm_id, VMWARE.OPERATIONS.POWER_ON
+        ),
+        pool="off",
+    ),
+    Case(
+        "change_power_state_bulk",
+        lambda b, c: b.vmware.change_power_state_bulk(
+            DATACENTER, [vm["uuid"] for vm in c.vms], VMWARE.OPERATIONS.POWER_ON
+        ),
+        pool="off",
+        bulk=True,
+    ),
+    Case("delete_vm", lambda b, c: b.vmware.delete_vm(DATACENTER, c.vm_id), pool="off"),
+    Case(
+        "collect_properties",
+        _collect_properties,
+        prepare=_vm_view,
+        cleanup=lambda b, c: c.state.Destroy(),
+    ),
+    Case("get_obj", _get_obj),
+    Case(
+        "wait_for_tasks",
+        lambda b, c: vmware_utils.wait_for_tasks(b.vmware.si, [c.state]),
+        prepare=_submit_task,
+    ),
+]
+
+_CASES_BY_NAME = dict((case.name, case) for case in CASES)
+
+
+def peak_rss_kb():
+    """
+    Returns (int) peak resident set size of this process in kilobytes
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _timings(seconds):
+    if not seconds:
+        return None
+    return {
+        "total": sum(seconds),
+        "min": min(seconds),
+        "median": statistics.median(seconds),
+        "max": max(seconds),
+        "calls": seconds,
+    }
+
+
+class _Bench(object):
+    """Worker side state of a case"""
+
+    def __init__(self, job):
+        self.host = job["host"]
+        self.port = job["port"]
+        self.vmware = None
+
+    def connect(self):
+        return VMware(self.host, USERNAME, PASSWORD, port=self.port)
+
+
+class _CaseMetrics(MetricsSink):
+    """Counts the round trips made while a timed call runs"""
+
+    def __init__(self):
+        self.active = False
+        self.calls = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.methods = {}
+        self._lock = threading.Lock()
+
+    def record_call(self, call):
+        if not self.active:
+            return
+        with self._lock:
+            self.calls += 1
+            self.bytes_out += call.bytes_out
+            self.bytes_in += call.bytes_in
+            self.methods[call.method] = self.methods.get(call.method, 0) + 1
+
+
+def run_case(job):
+    """
+    Run a case in this process, the worker side of run()
+    Args:
+        job (dict) : case name, host and port of the fake vCenter, vms as a
+                    list of per call lists of {"uuid", "name"} dicts and
+                    networks, one per call
+    Returns:
+        (dict) timings in seconds, round trips, bytes and peak RSS, error
+        is set if a call raised
+    """
+    case = _CASES_BY_NAME[job["case"]]
+    bench = _Bench(job)
+    metrics = enable_instrumentation(_CaseMetrics())
+    seconds = []
+    error = None
+    bench.vmware = bench.connect()
+    base_rss = peak_rss_kb()
+    try:
+        for index, vms in enumerate(job["vms"]):
+            call = _Call(index, vms, job["networks"][index])
+            if case.prepare is not None:
+                case.prepare(bench, call)
+            metrics.active = True
+            start = time.time()
+            try:
+                case.run(bench, call)
+            finally:
+                seconds.append(time.time() - start)
+                metrics.active = False
+            if case.cleanup is not None:
+                case.cleanup(bench, call)
+    except Exception as ex:
+        error = "{0}: {1}".format(type(ex).__name__, ex)
+    finally:
+        bench.vmware.disconnect()
+        disable_instrumentation(metrics)
+    return {
+        "wall_s": _timings(seconds),
+        "soap_calls": metrics.calls,
+        "bytes_out": metrics.bytes_out,
+        "bytes_in": metrics.bytes_in,
+        "methods": metrics.methods,
+        "base_rss_kb": base_rss,
+        "peak_rss_kb": peak_rss_kb(),
+        "error": error,
+    }
+
+
+def _vm_pools(inventory, seed):
+    """
+    Shuffled vms of the first datacenter by power state, cases pop the vms
+    they use so no vm is used twice
+    """
+    pools = {"on": [], "off": []}
+    for vm in inventory.entries(VirtualMachineEntry):
+        if vm.datacenter.props["name"] != DATACENTER:
+            continue
+        state = "on" if vm.power_state == "poweredOn" else "off"
+        pools[state].append({"uuid": vm.instance_uuid, "name": vm.props["name"]})
+    rng = random.Random(seed)
+    for pool in pools.values():
+        rng.shuffle(pool)
+    return pools
+
+
+def _take(pools, pool, count):
+    if pool == "any":
+        pool = max(pools, key=lambda name: len(pools[name]))
+    if len(pools[pool]) < count:
+        raise ValueError(
+            "Inventory has too few powered {0} vms left, use a larger size or "
+            "a smaller repeat".format(pool)
+        )
+    return [pools[pool].pop() for _ in range(count)]
+
+
+def _network_names(inventory, count, seed):
+    """
+    Returns count network names of the first datacenter, standard, portgroup
+    and opaque networks in turn
+    """
+    by_kind = {}
+    for network in inventory.entries(NetworkEntry):
+        by_kind.setdefault(type(network.ref).__name__, []).append(network.props["name"])
+    rng = random.Random(seed)
+    kinds = sorted(by_kind)
+    return [rng.choice(by_kind[kinds[index % len(kinds)]]) for index in range(count)]
+
+
+def _spawn(job, timeout):
+    env = dict(os.environ)
+    # the worker imports this package the way this process did
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env["PYTHONPATH"] = os.pathsep.join(
+        [root] + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else [])
+    )
+    try:
+        process = subprocess.run(
+            [sys.executable, "-m", _WORKER_MODULE, "--worker"],
+            input=json.dumps(job).encode("utf-8"),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=env,
+            timeout=timeout,
+        )
+    except subprocess.TimeoutExpired:
+        return {"error": "timed out after {0} seconds".format(timeout)}
+    if process.returncode != 0:
+        stderr = process.stderr.decode("utf-8", "replace").strip().splitlines()
+        return {"error": stderr[-1] if stderr else "worker failed"}
+    return json.loads(process.stdout.decode("utf-8").strip().splitlines()[-1])
+
+
+def run(
+    sizes=DEFAULT_SIZES,
+    networks=DEFAULT_NETWORKS,
+    portgroups=DEFAULT_PORTGROUPS,
+    opaque_networks=DEFAULT_OPAQUE_NETWORKS,
+    cases=None,
+    repeat=DEFAULT_REPEAT,
+    batch=DEFAULT_BATCH,
+    latency=0.0,
+    task_duration=0.0,
+    timeout=DEFAULT_TIMEOUT,
+    seed=0,
+    progress=None,
+):
+    """
+    Run cases against fake vCenters of every size
+    Args:
+        sizes (list) : numbers of vms of the inventories
+        networks (int) : standard networks of the inventories
+        portgroups (int) : distributed portgroups of the inventories
+        opaque_networks (int) : opaque networks of the inventories
+        cases (list) : names of the cases to run, all if None
+        repeat (int) : timed calls per case
+        batch (int) : vms per call of the bulk cases
+        latency (float) : seconds the fake vCenter delays every request
+        task_duration (float) : seconds tasks of the fake vCenter run
+        timeout (float) : seconds a case may take
+        seed (int) : seed of the inventories and of the vm selection
+        progress (callable) : called with every result as it is done
+    Returns:
+        (list) a result dict per size and case
+    """
+    selected = CASES
+    if cases:
+        unknown = set(cases) - set(_CASES_BY_NAME)
+        if unknown:
+            raise ValueError("Unknown cases: {0}".format(", ".join(sorted(unknown))))
+        selected = [case for case in CASES if case.name in cases]
+
+    results = []
+    for size in sizes:
+        start = time.time()
+        inventory = generate_inventory(
+            vms=size,
+            networks=networks,
+            portgroups=portgroups,
+            opaque_networks=opaque_networks,
+            seed=seed,
+        )
+        generated = time.time() - start
+        pools = _vm_pools(inventory, seed)
+        fake = FakeVCenter(
+            inventory,
+            latency=latency,
+            task_duration=task_duration,
+            username=USERNAME,
+            password=PASSWORD,
+        )
+        with fake:
+            for case in selected:
+                count = batch if case.bulk else 1
+                job = {
+                    "case": case.name,
+                    "host": fake.host,
+                    "port": fake.port,
+                    "vms": [_take(pools, case.pool, count) for _ in range(repeat)],
+                    "networks": _network_names(inventory, repeat, seed),
+                }
+                result = {
+                    "size": size,
+                    "networks": networks + portgroups + opaque_networks,
+                    "case": case.name,
+                    "repeat": repeat,
+                    "batch": count,
+                    "inventory_s": generated,
+                }
+                result.update(_spawn(job, timeout))
+                results.append(result)
+                if progress is not None:
+                    progress(result)
+    return results
+
+
+def _metadata(argv):
+    meta = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "argv": argv,
+    }
+    try:
+        meta["git"] = (
+            subprocess.check_output(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.DEVNULL,
+            )
+            .decode("utf-8")
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    return meta
+
+
+def _per_call(result, key):
+    if result.get("wall_s") is None:
+        return None
+    return float(result[key]) / len(result["wall_s"]["calls"])
+
+
+def format_result(result, baseline=None):
+    """
+    Returns (str) a report line of a result, with the change of the median
+    wall time and of the round trips against baseline if given
+    """
+    line = "{0:>7} {1:<28}".format(result["size"], result["case"])
+    if result.get("error") and result.get("wall_s") is None:
+        return line + " ERROR " + result["error"]
+    line += " {0:10.2f} ms {1:7.1f} calls {2:9.1f} KB {3:7.1f} MB rss".format(
+        result["wall_s"]["median"] * 1000,
+        _per_call(result, "soap_calls"),
+        _per_call(result, "bytes_in") / 1024 + _per_call(result, "bytes_out") / 1024,
+        result["peak_rss_kb"] / 1024.0,
+    )
+    if baseline is not None and baseline.get("wall_s") is not None:
+        line += "  {0:+7.1%} time {1:+6.1f} calls".format(
+            result["wall_s"]["median"] / max(baseline["wall_s"]["median"], 1e-9) - 1,
+            _per_call(result, "soap_calls") - _per_call(baseline, "soap_calls"),
+        )
+    if result.get("error"):
+        line += " ERROR " + result["error"]
+    return line
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--sizes",
+        default=",".join(str(size) for size in DEFAULT_SIZES),
+        help="comma separated numbers of vms, default %(default)s",
+    )
+    parser.add_argument("--networks", type=int, default=DEFAULT_NETWORKS)
+    parser.add_argument("--portgroups", type=int, default=DEFAULT_PORTGROUPS)
+    parser.add_argument("--opaque-networks", type=int, default=DEFAULT_OPAQUE_NETWORKS)
+    parser.add_argument("--cases", help="comma separated case names, default all")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added to every request"
+    )
+    parser.add_argument("--task-duration", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=DEFAULT_TIMEOUT)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="compare with results of this file")
+    parser.add_argument("--list", action="store_true", help="list the cases")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        print(json.dumps(run_case(json.load(sys.stdin))))
+        return 0
+    if args.list:
+        print("\n".join(case.name for case in CASES))
+        return 0
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as fd:
+            for result in json.load(fd)["results"]:
+                baseline[(result["size"], result["case"])] = result
+
+    def progress(result):
+        print(format_result(result, baseline.get((result["size"], result["case"]))))
+        sys.stdout.flush()
+
+    results = run(
+        sizes=[int(size) for size in args.sizes.split(",")],
+        networks=args.networks,
+        portgroups=args.portgroups,
+        opaque_networks=args.opaque_networks,
+        cases=args.cases.split(",") if args.cases else None,
+        repeat=args.repeat,
+        batch=args.batch,
+        latency=args.latency,
+        task_duration=args.task_duration,
+        timeout=args.timeout,
+        seed=args.seed,
+        progress=progress,
+    )
+    if args.json:
+        with open(args.json, "w") as fd:
+            json.dump(
+                {"meta": _metadata(argv or sys.argv[1:]), "results": results},
+                fd,
+                indent=2,
+            )
+    return 1 if any(result.get("error") for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for vCenter, to run VMware against synthetic inventories of
+1k to 100k vms without a real vCenter, e.g. for benchmarks:
+
+    from vmware_python_sdk_samples.fake_vcenter import (
+        FakeVCenter, generate_inventory
+    )
+
+    with FakeVCenter(generate_inventory(vms=10000), latency=0.002) as fake:
+        vmware = VMware(fake.host, "user", "pass", port=fake.port)
+
+It needs pyVmomi, and the openssl command line tool unless a certificate
+is passed in. Standalone:
+
+    python -m vmware_python_sdk_samples.fake_vcenter --vms 10000 --port 8443
+"""
+
+from .inventory import Inventory, generate_inventory
+from .server import FakeVCenter
+from .service import FakeService
+
+__all__ = ["FakeService", "FakeVCenter", "Inventory", "generate_inventory"]
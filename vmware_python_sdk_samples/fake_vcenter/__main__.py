@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Serve a synthetic inventory until interrupted"""
+
+import argparse
+import time
+
+from . import FakeVCenter, generate_inventory
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m vmware_python_sdk_samples.fake_vcenter",
+        description="Local stand-in for vCenter serving a synthetic inventory",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--vms", type=int, default=1000)
+    parser.add_argument("--datacenters", type=int, default=1)
+    parser.add_argument("--networks", type=int, default=4)
+    parser.add_argument("--portgroups", type=int, default=2)
+    parser.add_argument("--opaque-networks", type=int, default=2)
+    parser.add_argument("--powered-on", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added to every request"
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0.0, help="up to this many seconds more"
+    )
+    parser.add_argument(
+        "--task-duration", type=float, default=0.0, help="seconds a task runs"
+    )
+    parser.add_argument("--username", help="user accepted by Login, any if unset")
+    parser.add_argument("--password", help="password accepted by Login")
+    parser.add_argument("--certfile", help="TLS certificate, self signed if unset")
+    parser.add_argument("--keyfile", help="private key of --certfile")
+    args = parser.parse_args(argv)
+
+    inventory = generate_inventory(
+        vms=args.vms,
+        datacenters=args.datacenters,
+        networks=args.networks,
+        portgroups=args.portgroups,
+        opaque_networks=args.opaque_networks,
+        powered_on=args.powered_on,
+        seed=args.seed,
+    )
+    fake = FakeVCenter(
+        inventory,
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        task_duration=args.task_duration,
+        username=args.username,
+        password=args.password,
+        certfile=args.certfile,
+        keyfile=args.keyfile,
+    )
+    with fake:
+        print("Serving {0} vms on {1}, Ctrl-C to stop".format(args.vms, fake.url))
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
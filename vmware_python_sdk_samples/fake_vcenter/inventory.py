@@ -0,0 +1,1069 @@
+# -*- coding: utf-8 -*-
+"""In memory inventory of the fake vCenter and its synthetic generator"""
+
+import collections
+import copy
+import datetime
+import itertools
+import random
+import threading
+import uuid
+
+from pyVmomi import vim, vmodl, VmomiSupport
+from pyVmomi.VmomiSupport import DataObject
+
+# Changes remembered for incremental WaitForUpdatesEx, a filter that fell
+# further behind is compared against the whole inventory again.
+CHANGE_LOG_SIZE = 10000
+
+# Disk size of generated vms.
+DEFAULT_DISK_KB = 16 * 1024 * 1024
+
+# First key vCenter hands out to an added device, by device class.
+_DEVICE_KEY_BASE = [
+    (vim.vm.device.VirtualIDEController, 200),
+    (vim.vm.device.VirtualSCSIController, 1000),
+    (vim.vm.device.VirtualSATAController, 15000),
+    (vim.vm.device.VirtualDisk, 2000),
+    (vim.vm.device.VirtualEthernetCard, 4000),
+]
+_DEFAULT_DEVICE_KEY_BASE = 10000
+
+# Added devices vCenter plugs into the PCI controller when no controller is set.
+_PCI_DEVICES = (
+    vim.vm.device.VirtualEthernetCard,
+    vim.vm.device.VirtualSCSIController,
+    vim.vm.device.VirtualSATAController,
+)
+
+# Labels of added devices, numbered per device type.
+_DEVICE_LABELS = [
+    (vim.vm.device.VirtualDisk, "Hard disk"),
+    (vim.vm.device.VirtualEthernetCard, "Network adapter"),
+    (vim.vm.device.VirtualSCSIController, "SCSI controller"),
+    (vim.vm.device.VirtualSATAController, "SATA controller"),
+    (vim.vm.device.VirtualIDEController, "IDE"),
+]
+
+# Unit numbers usable on a controller, and the one taken by the controller.
+_CONTROLLER_UNITS = [
+    (vim.vm.device.VirtualIDEController, 2, None),
+    (vim.vm.device.VirtualSCSIController, 16, 7),
+    (vim.vm.device.VirtualSATAController, 30, None),
+    (vim.vm.device.VirtualPCIController, 32, None),
+]
+
+PropertyCollector = vmodl.query.PropertyCollector
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+_TYPE_NAME_ARRAY = VmomiSupport.GetVmodlType("vmodl.TypeName[]")
+
+
+def _mo_array(item_type, refs=()):
+    # properties of type anyType need typed arrays to be serialized
+    return item_type.Array(refs)
+
+
+def _invalid_device_spec(index, msg):
+    return vim.fault.InvalidDeviceSpec(
+        deviceIndex=index, property="virtualDeviceSpec.device", msg=msg
+    )
+
+
+def _next_device_key(devices, device):
+    base = _DEFAULT_DEVICE_KEY_BASE
+    for device_type, key_base in _DEVICE_KEY_BASE:
+        if isinstance(device, device_type):
+            base = key_base
+            break
+    key = base
+    while key in devices:
+        key += 1
+    return key
+
+
+def _label(device, devices):
+    # vCenter names added devices, e.g. "Hard disk 2"
+    if device.deviceInfo is not None and device.deviceInfo.label:
+        return
+    label = "Device"
+    for device_type, device_label in _DEVICE_LABELS:
+        if isinstance(device, device_type):
+            label = device_label
+            break
+    number = 1 + len([d for d in devices.values() if type(d) is type(device)])
+    summary = device.deviceInfo.summary if device.deviceInfo else None
+    device.deviceInfo = vim.Description(
+        label="{0} {1}".format(label, number), summary=summary or ""
+    )
+
+
+def _complete(obj):
+    """
+    Fill unset required fields of a client supplied data object with empty
+    values, so it can be serialized back to clients
+    """
+    for prop in obj._GetPropertyList():
+        value = getattr(obj, prop.name)
+        if isinstance(value, DataObject):
+            _complete(value)
+        elif value is None and not prop.flags & VmomiSupport.F_OPTIONAL:
+            if issubclass(prop.type, bool):
+                setattr(obj, prop.name, False)
+            elif issubclass(prop.type, int):
+                setattr(obj, prop.name, 0)
+            elif issubclass(prop.type, str) and not issubclass(
+                prop.type, VmomiSupport.Enum
+            ):
+                setattr(obj, prop.name, "")
+
+
+def _controller_units(controller):
+    for controller_type, units, reserved in _CONTROLLER_UNITS:
+        if isinstance(controller, controller_type):
+            return units, reserved
+    return 16, None
+
+
+def new_uuid(rng):
+    """
+    Returns a random uuid string
+    Args:
+        rng (random.Random) : source of randomness, for reproducible inventories
+    Returns:
+        (str) uuid
+    """
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+class Entry(object):
+    """
+    A managed object of the inventory.
+
+    Properties are kept in props, dotted property paths are resolved into
+    the data objects found there. version is bumped on every change, so
+    property collector filters can tell which objects to report again.
+    """
+
+    def __init__(self, ref, props=None, owner=None):
+        """
+        Build an entry
+        Args:
+            ref (vmodl.ManagedObject) : reference of the object
+            props (dict) : property name -> value
+            owner (str) : key of the session the object belongs to, None
+                        for inventory objects
+        """
+        self.ref = ref
+        self.props = props if props is not None else {}
+        self.owner = owner
+        self.version = 0
+
+    @property
+    def moid(self):
+        return self.ref._moId
+
+    def get(self, path):
+        """
+        Returns the value of a property path
+        Args:
+            path (str) : property path, e.g. "config.hardware.device"
+        Returns:
+            (object) value
+        Raises: KeyError if the property is not set
+        """
+        name, _, rest = path.partition(".")
+        value = self.get_property(name)
+        for attr in rest.split(".") if rest else ():
+            value = getattr(value, attr, None)
+            if value is None:
+                raise KeyError(path)
+        return value
+
+    def get_property(self, name):
+        """
+        Returns the value of a top level property
+        Args:
+            name (str) : property name
+        Returns:
+            (object) value
+        Raises: KeyError if the property is not set
+        """
+        value = self.props.get(name)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def property_names(self):
+        """
+        Returns the names of all properties, for PropertySpec.all
+        """
+        return list(self.props)
+
+    def children(self):
+        """
+        Returns the references contained in this entity, walked by container
+        views
+        """
+        return ()
+
+
+class FolderEntry(Entry):
+    """A folder, contains the entities of childEntity"""
+
+    def children(self):
+        return self.props["childEntity"]
+
+
+class DatacenterEntry(Entry):
+    """A datacenter, contains its four root folders"""
+
+    def children(self):
+        return [
+            self.props[name]
+            for name in ("vmFolder", "hostFolder", "datastoreFolder", "networkFolder")
+        ]
+
+
+class ContainerViewEntry(Entry):
+    """A container view, view is computed from the inventory when read"""
+
+    def __init__(self, ref, inventory, container, types, recursive, owner=None):
+        Entry.__init__(
+            self,
+            ref,
+            {
+                "container": container,
+                "type": _TYPE_NAME_ARRAY(types or ()),
+                "recursive": recursive,
+            },
+            owner=owner,
+        )
+        self.inventory = inventory
+        self.types = tuple(types or ())
+        self.container = container
+        self.recursive = recursive
+
+    def get_property(self, name):
+        if name == "view":
+            return _mo_array(
+                VmomiSupport.ManagedObject,
+                self.inventory.contents(self.container, self.types, self.recursive),
+            )
+        return Entry.get_property(self, name)
+
+    def property_names(self):
+        return Entry.property_names(self) + ["view"]
+
+
+class CollectorEntry(Entry):
+    """A property collector, its filters and unfinished paged results"""
+
+    def __init__(self, ref, owner=None):
+        Entry.__init__(
+            self, ref, {"filter": _mo_array(PropertyCollector.Filter)}, owner=owner
+        )
+        self.filters = []
+        self.results = {}
+        self.update_version = 0
+        self.waiting = 0
+        self.cancel_requested = False
+
+
+class FilterEntry(Entry):
+    """
+    A property collector filter, remembers what it reported per object so
+    WaitForUpdatesEx only sends what changed since
+    """
+
+    def __init__(self, ref, collector, spec, partial_updates, owner=None):
+        Entry.__init__(
+            self, ref, {"spec": spec, "partialUpdates": partial_updates}, owner=owner
+        )
+        self.collector = collector
+        self.spec = spec
+        self.reset()
+
+    def reset(self):
+        # moid -> (entry version, {path: value}, ref) as last reported
+        self.reported = collections.OrderedDict()
+        self.seq = None
+
+
+class VirtualMachineEntry(Entry):
+    """
+    A virtual machine.
+
+    config and runtime are built when read, and the devices of generated vms
+    only on first use, so inventories of 100k vms stay cheap to generate.
+    Frequently collected paths are answered without building config.
+    """
+
+    _PATHS = {
+        "config.name": lambda vm: vm.props["name"],
+        "config.instanceUuid": lambda vm: vm.instance_uuid,
+        "config.uuid": lambda vm: vm.bios_uuid,
+        "config.hardware.numCPU": lambda vm: vm.num_cpu,
+        "config.hardware.numCoresPerSocket": lambda vm: vm.num_cores,
+        "config.hardware.memoryMB": lambda vm: vm.memory_mb,
+        "config.hardware.device": lambda vm: vm.devices,
+        "runtime.powerState": lambda vm: vm.power_state,
+    }
+
+    def __init__(
+        self,
+        ref,
+        name,
+        parent,
+        datacenter,
+        instance_uuid,
+        bios_uuid,
+        power_state,
+        network,
+        num_cpu=2,
+        num_cores=1,
+        memory_mb=2048,
+    ):
+        Entry.__init__(
+            self,
+            ref,
+            {
+                "name": name,
+                "parent": parent,
+                "network": _mo_array(vim.Network, [network.ref]),
+            },
+        )
+        self.datacenter = datacenter
+        self.instance_uuid = instance_uuid
+        self.bios_uuid = bios_uuid
+        self.power_state = power_state
+        self.num_cpu = num_cpu
+        self.num_cores = num_cores
+        self.memory_mb = memory_mb
+        self._network = network
+        self._devices = None
+
+    @property
+    def devices(self):
+        if self._devices is None:
+            self._devices = self._default_devices()
+        return self._devices
+
+    @devices.setter
+    def devices(self, devices):
+        self._devices = _mo_array(vim.vm.device.VirtualDevice, devices)
+
+    def get(self, path):
+        getter = self._PATHS.get(path)
+        if getter is not None:
+            return getter(self)
+        return Entry.get(self, path)
+
+    def get_property(self, name):
+        if name == "config":
+            return self.config_info()
+        if name == "runtime":
+            return vim.vm.RuntimeInfo(
+                powerState=self.power_state,
+                connectionState="connected",
+                faultToleranceState="notConfigured",
+                toolsInstallerMounted=False,
+                numMksConnections=0,
+                recordReplayState="inactive",
+                onlineStandby=False,
+                consolidationNeeded=False,
+            )
+        return Entry.get_property(self, name)
+
+    def property_names(self):
+        return Entry.property_names(self) + ["config", "runtime"]
+
+    def reconfigure(self, spec):
+        """
+        Apply a config spec the way ReconfigVM_Task does: cpu, cores, memory
+        and device changes. Devices added with negative keys get real keys,
+        references to them from other devices of the spec are remapped.
+        Args:
+            spec (vim.vm.ConfigSpec) : requested changes
+        Returns:
+            None
+        Raises: vim.fault.InvalidDeviceSpec, nothing is changed then
+        """
+        devices = dict((device.key, device) for device in self.devices)
+        new_keys = {}
+        for index, change in enumerate(spec.deviceChange or []):
+            device = change.device
+            if change.operation == "remove":
+                if devices.pop(device.key, None) is None:
+                    raise _invalid_device_spec(
+                        index, "no device {0}".format(device.key)
+                    )
+                continue
+            if change.operation == "edit":
+                if device.key not in devices:
+                    raise _invalid_device_spec(
+                        index, "no device {0}".format(device.key)
+                    )
+                _complete(device)
+                devices[device.key] = device
+                continue
+            old_key = device.key
+            device.key = _next_device_key(devices, device)
+            if old_key is not None:
+                new_keys[old_key] = device.key
+            _label(device, devices)
+            _complete(device)
+            devices[device.key] = device
+
+        for device in devices.values():
+            if device.controllerKey in new_keys:
+                device.controllerKey = new_keys[device.controllerKey]
+        self._place_devices(devices, spec)
+
+        if spec.numCPUs:
+            self.num_cpu = spec.numCPUs
+        if spec.numCoresPerSocket:
+            self.num_cores = spec.numCoresPerSocket
+        if spec.memoryMB:
+            self.memory_mb = spec.memoryMB
+        self.devices = sorted(devices.values(), key=lambda device: device.key)
+
+    def _place_devices(self, devices, spec):
+        # index of added devices in the spec, for the fault
+        added = dict(
+            (change.device.key, index)
+            for index, change in enumerate(spec.deviceChange or [])
+            if change.operation == "add"
+        )
+        controllers = dict(
+            (key, device)
+            for key, device in devices.items()
+            if isinstance(device, vim.vm.device.VirtualController)
+        )
+        for key in added:
+            controller = controllers.get(key)
+            if controller is not None and controller.busNumber is None:
+                buses = set(
+                    c.busNumber
+                    for c in controllers.values()
+                    if _controller_units(c) == _controller_units(controller)
+                )
+                controller.busNumber = min(set(range(len(buses) + 1)) - buses)
+
+        members = dict((key, []) for key in controllers)
+        # devices already on the vm keep their slots, added ones fill gaps
+        for device in sorted(devices.values(), key=lambda device: device.key in added):
+            index = added.get(device.key, -1)
+            if device.controllerKey is None:
+                if device.key not in added or not isinstance(device, _PCI_DEVICES):
+                    continue
+                device.controllerKey = 100
+            controller = controllers.get(device.controllerKey)
+            if controller is None:
+                raise _invalid_device_spec(
+                    index, "no controller {0}".format(device.controllerKey)
+                )
+            units, reserved = _controller_units(controller)
+            taken = set(devices[key].unitNumber for key in members[controller.key])
+            if device.unitNumber is None:
+                free = [u for u in range(units) if u != reserved and u not in taken]
+                if not free:
+                    raise _invalid_device_spec(
+                        index, "controller {0} is full".format(controller.key)
+                    )
+                device.unitNumber = free[0]
+            if (
+                device.unitNumber >= units
+                or device.unitNumber == reserved
+                or device.unitNumber in taken
+            ):
+                raise _invalid_device_spec(
+                    index,
+                    "unit {0} of controller {1} is not available".format(
+                        device.unitNumber, controller.key
+                    ),
+                )
+            members[controller.key].append(device.key)
+            if isinstance(device, vim.vm.device.VirtualDisk) and not getattr(
+                device.backing, "fileName", None
+            ):
+                device.backing.fileName = "[datastore1] {0}/{0}_{1}.vmdk".format(
+                    self.props["name"], device.key
+                )
+
+        for key, controller in controllers.items():
+            # collected device lists of earlier versions stay untouched
+            controller = devices[key] = copy.copy(controller)
+            controller.device = members[key]
+
+    def config_info(self):
+        """
+        Returns the vim.vm.ConfigInfo of the vm
+        """
+        hardware = vim.vm.VirtualHardware(
+            numCPU=self.num_cpu,
+            numCoresPerSocket=self.num_cores,
+            memoryMB=self.memory_mb,
+            device=self.devices,
+        )
+        name = self.props["name"]
+        return vim.vm.ConfigInfo(
+            changeVersion=str(self.version),
+            modified=_EPOCH,
+            name=name,
+            guestFullName="Other Linux (64-bit)",
+            guestId="otherLinux64Guest",
+            alternateGuestName="",
+            version="vmx-21",
+            uuid=self.bios_uuid,
+            instanceUuid=self.instance_uuid,
+            template=False,
+            files=vim.vm.FileInfo(vmPathName="[datastore1] {0}/{0}.vmx".format(name)),
+            flags=vim.vm.FlagInfo(),
+            defaultPowerOps=vim.vm.DefaultPowerOpInfo(),
+            hardware=hardware,
+        )
+
+    def _default_devices(self):
+        name = self.props["name"]
+        network = self._network
+        disk = vim.vm.device.VirtualDisk(
+            key=2000,
+            controllerKey=1000,
+            unitNumber=0,
+            capacityInKB=DEFAULT_DISK_KB,
+            deviceInfo=vim.Description(label="Hard disk 1", summary="16 GB"),
+            backing=vim.vm.device.VirtualDisk.FlatVer2BackingInfo(
+                fileName="[datastore1] {0}/{0}.vmdk".format(name),
+                diskMode="persistent",
+                thinProvisioned=True,
+            ),
+        )
+        nic = vim.vm.device.VirtualVmxnet3(
+            key=4000,
+            controllerKey=100,
+            unitNumber=7,
+            deviceInfo=vim.Description(
+                label="Network adapter 1", summary=network.props["name"]
+            ),
+            backing=network.nic_backing(),
+            connectable=vim.vm.device.VirtualDevice.ConnectInfo(
+                startConnected=True,
+                allowGuestControl=True,
+                connected=self.power_state == "poweredOn",
+                status="ok",
+            ),
+            wakeOnLanEnabled=True,
+            addressType="assigned",
+            macAddress="00:50:56:{0:02x}:{1:02x}:{2:02x}".format(
+                *bytearray(uuid.UUID(self.instance_uuid).bytes[-3:])
+            ),
+        )
+        controllers = [
+            vim.vm.device.VirtualPCIController(key=100, busNumber=0, device=[4000]),
+            vim.vm.device.VirtualIDEController(key=200, busNumber=0, device=[]),
+            vim.vm.device.VirtualIDEController(key=201, busNumber=1, device=[]),
+            vim.vm.device.ParaVirtualSCSIController(
+                key=1000,
+                busNumber=0,
+                controllerKey=100,
+                unitNumber=3,
+                sharedBus="noSharing",
+                device=[2000],
+            ),
+        ]
+        return _mo_array(vim.vm.device.VirtualDevice, controllers + [disk, nic])
+
+
+class NetworkEntry(Entry):
+    """A network a NIC can be backed by: standard, portgroup or opaque"""
+
+    def __init__(self, ref, props, switch=None):
+        Entry.__init__(self, ref, props)
+        self.switch = switch
+
+    def nic_backing(self):
+        """
+        Returns NIC backing connecting to this network
+        """
+        card = vim.vm.device.VirtualEthernetCard
+        if isinstance(self.ref, vim.OpaqueNetwork):
+            summary = self.props["summary"]
+            return card.OpaqueNetworkBackingInfo(
+                opaqueNetworkId=summary.opaqueNetworkId,
+                opaqueNetworkType=summary.opaqueNetworkType,
+            )
+        if isinstance(self.ref, vim.dvs.DistributedVirtualPortgroup):
+            return card.DistributedVirtualPortBackingInfo(
+                port=vim.dvs.PortConnection(
+                    switchUuid=self.switch.props["uuid"],
+                    portgroupKey=self.props["key"],
+                )
+            )
+        return card.NetworkBackingInfo(
+            network=self.ref, deviceName=self.props["name"], useAutoDetect=False
+        )
+
+
+class Inventory(object):
+    """
+    Inventory of the fake vCenter: entries by managed object id, the
+    service singletons and a log of changes for property collector filters.
+
+    Every read and write happens under lock, changed is notified after each
+    change so WaitForUpdatesEx calls can wake up.
+    """
+
+    def __init__(self, api_version=None, seed=None):
+        """
+        Build an inventory holding only the root folder and the service
+        singletons
+        Args:
+            api_version (str) : version id reported in AboutInfo, e.g. "9.1.1.0"
+            seed (int) : seed of the uuids handed out, random if None
+        """
+        self.rng = random.Random(seed)
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+        self.seq = 0
+        self.changes = collections.deque(maxlen=CHANGE_LOG_SIZE)
+        self._entries = {}
+        self._ids = collections.defaultdict(lambda: itertools.count(1))
+        self._vms_by_uuid = {}
+        self.datacenters = []
+
+        if api_version is None:
+            api_version = VmomiSupport.versionIdMap[
+                VmomiSupport.GetServiceVersions("vim25")[0]
+            ]
+        self.root_folder = self.add(
+            FolderEntry(
+                vim.Folder("group-d1"),
+                {
+                    "name": "Datacenters",
+                    "childEntity": _mo_array(vim.ManagedEntity),
+                },
+            )
+        )
+        self.content = vim.ServiceInstanceContent(
+            rootFolder=self.root_folder.ref,
+            propertyCollector=vmodl.query.PropertyCollector("propertyCollector"),
+            viewManager=vim.view.ViewManager("ViewManager"),
+            searchIndex=vim.SearchIndex("SearchIndex"),
+            sessionManager=vim.SessionManager("SessionManager"),
+            about=vim.AboutInfo(
+                name="VMware vCenter Server",
+                fullName="VMware vCenter Server {0} (fake)".format(api_version),
+                vendor="VMware, Inc.",
+                version=api_version,
+                build="0",
+                osType="linux-x64",
+                productLineId="vpx",
+                apiType="VirtualCenter",
+                apiVersion=api_version,
+                instanceUuid=new_uuid(self.rng),
+                licenseProductName="VMware VirtualCenter Server",
+                licenseProductVersion=api_version.split(".")[0] + ".0",
+            ),
+        )
+        self.add(
+            Entry(vim.ServiceInstance("ServiceInstance"), {"content": self.content})
+        )
+        self.add(CollectorEntry(self.content.propertyCollector))
+        for ref in (
+            self.content.viewManager,
+            self.content.searchIndex,
+            self.content.sessionManager,
+        ):
+            self.add(Entry(ref))
+
+    def next_id(self, prefix, separator="-"):
+        """
+        Returns a new managed object id
+        Args:
+            prefix (str) : id prefix, e.g. "vm"
+            separator (str) : put between prefix and number
+        Returns:
+            (str) id such as "vm-42"
+        """
+        return "{0}{1}{2}".format(prefix, separator, next(self._ids[prefix]))
+
+    def get(self, ref):
+        """
+        Returns the entry of a managed object
+        Args:
+            ref (vmodl.ManagedObject|str) : reference or managed object id
+        Returns:
+            (Entry) entry, None if the object does not exist
+        """
+        moid = ref if isinstance(ref, str) else getattr(ref, "_moId", None)
+        return self._entries.get(moid)
+
+    def add(self, entry, structural=True):
+        """
+        Add an entry
+        Args:
+            entry (Entry) : new managed object
+            structural (bool) : whether the object can show up in views
+        Returns:
+            (Entry) entry
+        """
+        with self.lock:
+            self._entries[entry.moid] = entry
+            self.touch(entry, structural)
+        return entry
+
+    def remove(self, entry):
+        """
+        Remove an entry, along with its place in the parent folder
+        Args:
+            entry (Entry) : managed object to remove
+        Returns:
+            None
+        """
+        with self.lock:
+            self._entries.pop(entry.moid, None)
+            parent = self.get(entry.props.get("parent"))
+            if isinstance(parent, FolderEntry):
+                children = parent.props["childEntity"]
+                parent.props["childEntity"] = _mo_array(
+                    vim.ManagedEntity, [c for c in children if c != entry.ref]
+                )
+                self.touch(parent, structural=True)
+            if isinstance(entry, VirtualMachineEntry):
+                self._vms_by_uuid.pop((entry.instance_uuid, True), None)
+                self._vms_by_uuid.pop((entry.bios_uuid, False), None)
+            self.touch(entry, structural=True)
+
+    def touch(self, entry, structural=False):
+        """
+        Record a change of an entry
+        Args:
+            entry (Entry) : changed managed object
+            structural (bool) : whether the change can alter the content of
+                        views, e.g. a child added to a folder
+        Returns:
+            None
+        """
+        with self.lock:
+            entry.version += 1
+            self.seq += 1
+            self.changes.append((self.seq, entry.moid, structural))
+            self.changed.notify_all()
+
+    def changes_since(self, seq):
+        """
+        Returns the changes recorded after seq
+        Args:
+            seq (int) : last change seen by the caller
+        Returns:
+            (list) (seq, moid, structural) tuples, None if the log no longer
+            reaches back to seq
+        """
+        if self.changes and self.changes[0][0] > seq + 1:
+            return None
+        return [change for change in self.changes if change[0] > seq]
+
+    def entries(self, entry_type=None):
+        """
+        Returns all entries, or those of entry_type
+        """
+        return [
+            entry
+            for entry in self._entries.values()
+            if entry_type is None or isinstance(entry, entry_type)
+        ]
+
+    def contents(self, container, types=(), recursive=True):
+        """
+        Returns the managed objects a container view of container shows
+        Args:
+            container (vmodl.ManagedObject) : folder or datacenter
+            types (tuple) : managed object types to include, all if empty
+            recursive (bool) : walk into contained folders and datacenters
+        Returns:
+            (list) references
+        """
+        refs = []
+        types = tuple(types)
+
+        def walk(entry):
+            for ref in entry.children():
+                child = self._entries.get(ref._moId)
+                if child is None:
+                    continue
+                if not types or isinstance(child.ref, types):
+                    refs.append(child.ref)
+                if recursive:
+                    walk(child)
+
+        entry = self.get(container)
+        if entry is not None:
+            walk(entry)
+        return refs
+
+    def find_vm(self, uuid_str, instance_uuid=True, datacenter=None):
+        """
+        Returns a vm by uuid, like SearchIndex.FindByUuid
+        Args:
+            uuid_str (str) : instance or bios uuid
+            instance_uuid (bool) : whether uuid_str is the instance uuid
+            datacenter (vmodl.ManagedObject) : limit the search to a datacenter
+        Returns:
+            (VirtualMachineEntry) vm, None if not found
+        """
+        vm = self._entries.get(
+            self._vms_by_uuid.get((uuid_str.lower(), bool(instance_uuid)))
+        )
+        if vm is None:
+            return None
+        if datacenter is not None and vm.datacenter.ref != datacenter:
+            return None
+        return vm
+
+    def add_datacenter(self, name):
+        """
+        Add a datacenter with empty vm, host, datastore and network folders
+        Args:
+            name (str) : datacenter name
+        Returns:
+            (DatacenterEntry) datacenter
+        """
+        with self.lock:
+            dc_ref = vim.Datacenter(self.next_id("datacenter"))
+            folders = {}
+            for prop, prefix, folder_name in (
+                ("vmFolder", "group-v", "vm"),
+                ("hostFolder", "group-h", "host"),
+                ("datastoreFolder", "group-s", "datastore"),
+                ("networkFolder", "group-n", "network"),
+            ):
+                folder = self.add(
+                    FolderEntry(
+                        vim.Folder(self.next_id(prefix, separator="")),
+                        {
+                            "name": folder_name,
+                            "parent": dc_ref,
+                            "childEntity": _mo_array(vim.ManagedEntity),
+                        },
+                    )
+                )
+                folders[prop] = folder.ref
+            props = {
+                "name": name,
+                "parent": self.root_folder.ref,
+                "network": _mo_array(vim.Network),
+                "datastore": _mo_array(vim.Datastore),
+            }
+            props.update(folders)
+            datacenter = DatacenterEntry(dc_ref, props)
+            self._add_child(self.root_folder, datacenter)
+            self.datacenters.append(datacenter)
+            return datacenter
+
+    def add_network(self, datacenter, name, kind="standard", switch=None):
+        """
+        Add a network to the network folder of a datacenter
+        Args:
+            datacenter (DatacenterEntry) : datacenter of the network
+            name (str) : network name
+            kind (str) : "standard", "portgroup" or "opaque"
+            switch (Entry) : distributed switch of a portgroup, created on
+                        demand if None
+        Returns:
+            (NetworkEntry) network
+        """
+        with self.lock:
+            if kind == "portgroup":
+                if switch is None:
+                    switch = self.add_switch(datacenter, "DSwitch")
+                moid = self.next_id("dvportgroup")
+                ref = vim.dvs.DistributedVirtualPortgroup(moid)
+                props = {
+                    "name": name,
+                    "key": moid,
+                    "config": vim.dvs.DistributedVirtualPortgroup.ConfigInfo(
+                        key=moid,
+                        name=name,
+                        numPorts=8,
+                        type="earlyBinding",
+                        policy=vim.dvs.DistributedVirtualPortgroup.PortgroupPolicy(
+                            blockOverrideAllowed=True,
+                            shapingOverrideAllowed=False,
+                            vendorConfigOverrideAllowed=False,
+                            livePortMovingAllowed=False,
+                            portConfigResetAtDisconnect=True,
+                        ),
+                        distributedVirtualSwitch=switch.ref,
+                    ),
+                }
+            elif kind == "opaque":
+                ref = vim.OpaqueNetwork(self.next_id("network-o"))
+                props = {
+                    "name": name,
+                    "summary": vim.OpaqueNetwork.Summary(
+                        network=ref,
+                        name=name,
+                        accessible=True,
+                        ipPoolName="",
+                        opaqueNetworkId=new_uuid(self.rng),
+                        opaqueNetworkType="nsx.LogicalSwitch",
+                    ),
+                }
+            else:
+                ref = vim.Network(self.next_id("network"))
+                props = {
+                    "name": name,
+                    "summary": vim.Network.Summary(
+                        network=ref, name=name, accessible=True, ipPoolName=""
+                    ),
+                }
+            props["parent"] = datacenter.props["networkFolder"]
+            network = NetworkEntry(ref, props, switch=switch)
+            self._add_child(self.get(props["parent"]), network)
+            datacenter.props["network"].append(ref)
+            self.touch(datacenter)
+            if switch is not None:
+                switch.props["portgroup"].append(ref)
+                self.touch(switch)
+            return network
+
+    def add_switch(self, datacenter, name):
+        """
+        Add a distributed virtual switch to the network folder of a datacenter
+        Args:
+            datacenter (DatacenterEntry) : datacenter of the switch
+            name (str) : switch name
+        Returns:
+            (Entry) switch
+        """
+        with self.lock:
+            switch = Entry(
+                vim.dvs.VmwareDistributedVirtualSwitch(self.next_id("dvs")),
+                {
+                    "name": name,
+                    "uuid": " ".join(
+                        "{0:02x}".format(b)
+                        for b in bytearray(uuid.UUID(new_uuid(self.rng)).bytes)
+                    ),
+                    "parent": datacenter.props["networkFolder"],
+                    "portgroup": _mo_array(vim.dvs.DistributedVirtualPortgroup),
+                },
+            )
+            self._add_child(self.get(switch.props["parent"]), switch)
+            return switch
+
+    def add_vm(
+        self,
+        datacenter,
+        name,
+        network,
+        power_state="poweredOff",
+        instance_uuid=None,
+        bios_uuid=None,
+        **hardware
+    ):
+        """
+        Add a vm to the vm folder of a datacenter
+        Args:
+            datacenter (DatacenterEntry) : datacenter of the vm
+            name (str) : vm name
+            network (NetworkEntry) : network of the first NIC
+            power_state (str) : runtime.powerState
+            instance_uuid (str) : config.instanceUuid, generated if None
+            bios_uuid (str) : config.uuid, generated if None
+            hardware : num_cpu, num_cores and memory_mb
+        Returns:
+            (VirtualMachineEntry) vm
+        """
+        with self.lock:
+            vm = VirtualMachineEntry(
+                vim.VirtualMachine(self.next_id("vm")),
+                name,
+                datacenter.props["vmFolder"],
+                datacenter,
+                (instance_uuid or new_uuid(self.rng)).lower(),
+                (bios_uuid or new_uuid(self.rng)).lower(),
+                vim.VirtualMachine.PowerState(power_state),
+                network,
+                **hardware
+            )
+            self._add_child(self.get(vm.props["parent"]), vm)
+            self._vms_by_uuid[(vm.instance_uuid, True)] = vm.moid
+            self._vms_by_uuid[(vm.bios_uuid, False)] = vm.moid
+            return vm
+
+    def _add_child(self, folder, entry):
+        folder.props["childEntity"].append(entry.ref)
+        self.add(entry)
+        self.touch(folder, structural=True)
+
+
+def generate_inventory(
+    vms=1000,
+    datacenters=1,
+    networks=4,
+    portgroups=2,
+    opaque_networks=2,
+    powered_on=0.5,
+    seed=0,
+):
+    """
+    Build a synthetic inventory, the same arguments always produce the same
+    names and uuids
+    Args:
+        vms (int) : number of vms, spread evenly over the datacenters
+        datacenters (int) : number of datacenters
+        networks (int) : standard networks per datacenter
+        portgroups (int) : distributed portgroups per datacenter, on one switch
+        opaque_networks (int) : opaque networks per datacenter
+        powered_on (float) : share of vms that are powered on
+        seed (int) : seed of the generator
+    Returns:
+        (Inventory) inventory, datacenters are called "Datacenter-1", ...,
+        vms "vm-000001", ... and networks "VM Network 1", "DPortGroup 1" and
+        "Opaque Network 1", ..., numbered across datacenters
+    """
+    inventory = Inventory(seed=seed)
+    rng = inventory.rng
+    numbers = collections.defaultdict(lambda: itertools.count(1))
+
+    def network_name(label):
+        return "{0} {1}".format(label, next(numbers[label]))
+
+    with inventory.lock:
+        vm_number = itertools.count(1)
+        for dc_index in range(datacenters):
+            datacenter = inventory.add_datacenter("Datacenter-{0}".format(dc_index + 1))
+            standard = [
+                inventory.add_network(datacenter, network_name("VM Network"))
+                for _ in range(max(networks, 1))
+            ]
+            if portgroups:
+                switch = inventory.add_switch(
+                    datacenter, "DSwitch-{0}".format(dc_index + 1)
+                )
+                for _ in range(portgroups):
+                    inventory.add_network(
+                        datacenter,
+                        network_name("DPortGroup"),
+                        kind="portgroup",
+                        switch=switch,
+                    )
+            for _ in range(opaque_networks):
+                inventory.add_network(
+                    datacenter, network_name("Opaque Network"), kind="opaque"
+                )
+
+            count = vms // datacenters + (1 if dc_index < vms % datacenters else 0)
+            for index in range(count):
+                inventory.add_vm(
+                    datacenter,
+                    "vm-{0:06d}".format(next(vm_number)),
+                    standard[index % len(standard)],
+                    power_state=(
+                        "poweredOn" if rng.random() < powered_on else "poweredOff"
+                    ),
+                )
+    return inventory
@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+"""HTTPS front end of the fake vCenter"""
+
+import collections
+import os
+import random
+import shutil
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pyVmomi import vmodl
+
+from . import soap
+from .inventory import generate_inventory
+from .service import Call, FakeService
+from ..src.logger import CustomLogger
+
+LOG = CustomLogger(__name__)
+
+# Name of the session cookie, as set by vCenter.
+SESSION_COOKIE = "vmware_soap_session"
+
+SERVICE_VERSIONS_PATH = "/sdk/vimServiceVersions.xml"
+
+
+class FakeVCenter(object):
+    """
+    A local stand-in for vCenter that SmartConnect, and so VMware, can log in
+    to. It serves the subset of the vSphere API this package uses from an
+    in memory Inventory:
+
+        * ServiceInstance, SessionManager login and logout
+        * ViewManager container and list views
+        * PropertyCollector RetrieveProperties(Ex), filters, WaitForUpdates(Ex)
+        * SearchIndex.FindByUuid
+        * vm reconfigure, power and destroy tasks, guest power operations
+        * standard, distributed and opaque networks
+
+    Every request is delayed by latency plus up to jitter seconds, tasks take
+    task_duration seconds. Usage:
+
+        with FakeVCenter(generate_inventory(vms=10000)) as fake:
+            vmware = VMware(fake.host, "user", "pass", port=fake.port)
+    """
+
+    def __init__(
+        self,
+        inventory=None,
+        host="127.0.0.1",
+        port=0,
+        latency=0.0,
+        jitter=0.0,
+        task_duration=0.0,
+        username=None,
+        password=None,
+        certfile=None,
+        keyfile=None,
+    ):
+        """
+        Build a fake vCenter, it listens once started
+        Args:
+            inventory (Inventory) : objects to serve, 1000 generated vms if None
+            host (str) : address to listen on
+            port (int) : port to listen on, a free one if 0
+            latency (float) : seconds every request is delayed
+            jitter (float) : up to this many seconds are added to latency
+            task_duration (float) : seconds a task runs, 0 completes tasks
+                        before the method returns
+            username (str) : user accepted by Login, any if None
+            password (str) : password accepted by Login, any if None
+            certfile (str) : TLS certificate, a self signed one if None
+            keyfile (str) : private key of certfile
+        """
+        self.inventory = inventory if inventory is not None else generate_inventory()
+        self.service = FakeService(
+            self.inventory,
+            task_duration=task_duration,
+            username=username,
+            password=password,
+        )
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.certfile = certfile
+        self.keyfile = keyfile
+        self.versions = soap.service_versions()
+        self.versions_xml = soap.service_versions_xml(self.versions)
+
+        self._server = None
+        self._thread = None
+        self._cert_dir = None
+        self._stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def url(self):
+        return "https://{0}:{1}/sdk".format(self.host, self.port)
+
+    def start(self):
+        """
+        Listen for requests on a background thread
+        Returns:
+            (FakeVCenter) self
+        """
+        certfile, keyfile = self.certfile, self.keyfile
+        if certfile is None:
+            self._cert_dir = tempfile.mkdtemp(prefix="fake-vcenter-")
+            certfile, keyfile = _self_signed_certificate(self._cert_dir, self.host)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+
+        self._server = ThreadingHTTPServer((self.host, self.port), _RequestHandler)
+        self._server.daemon_threads = True
+        # the handshake happens on first read, in the thread of the connection
+        self._server.socket = context.wrap_socket(
+            self._server.socket, server_side=True, do_handshake_on_connect=False
+        )
+        self._server.fake = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="fake-vcenter"
+        )
+        self._thread.daemon = True
+        self._thread.start()
+        LOG.info("Fake vCenter listening on %s", self.url)
+        return self
+
+    def stop(self):
+        """
+        Stop listening, cancel pending WaitForUpdates calls and running tasks
+        Returns:
+            None
+        """
+        self.service.stop()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if self._cert_dir is not None:
+            shutil.rmtree(self._cert_dir, ignore_errors=True)
+            self._cert_dir = None
+
+    def expire_sessions(self):
+        """
+        End every session, clients get NotAuthenticated on their next call
+        Returns:
+            None
+        """
+        self.service.expire_sessions()
+
+    def stats(self):
+        """
+        Returns request counters and counts of server side objects
+        Returns:
+            (dict) requests, bytes_in, bytes_out, requests per method, e.g.
+            "VirtualMachine.ReconfigVM_Task" or "VirtualMachine.config" for
+            a property fetch, and the object counts of FakeService.stats()
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats["methods"] = dict(self._methods)
+        stats.update(self.service.stats())
+        return stats
+
+    def reset_stats(self):
+        """
+        Zero the request counters
+        Returns:
+            None
+        """
+        with self._stats_lock:
+            self._stats = {"requests": 0, "bytes_in": 0, "bytes_out": 0}
+            self._methods = collections.Counter()
+
+    def handle(self, body, soap_action=None, cookie=None, client=None):
+        """
+        Answer one SOAP request
+        Args:
+            body (bytes) : request envelope
+            soap_action (str) : SOAPAction header, selects the api version
+            cookie (str) : Cookie header
+            client (str) : address of the client
+        Returns:
+            (tuple) http status, response envelope and the Set-Cookie
+            header, None unless a session was created
+        """
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+        version = soap.version_from_soap_action(soap_action, self.versions)
+        deserializer = soap.RequestDeserializer(version)
+        call = None
+        try:
+            method, mo, args = deserializer.deserialize(body)
+            call = Call(method, mo, args, self._session(cookie), client)
+            self._count(call, body)
+            with self.inventory.lock:
+                value = self.service.invoke(call)
+                result_type, flags = _result_info(deserializer.info, call)
+                payload = soap.serialize_response(
+                    method, result_type, flags, value, version
+                )
+            status = 200
+        except vmodl.MethodFault as fault:
+            status, payload = 500, soap.serialize_fault(fault, version)
+        except Exception as ex:
+            LOG.error("Fake vCenter request failed: %s", ex, exc_info=True)
+            fault = vmodl.RuntimeFault(msg=str(ex))
+            status, payload = 500, soap.serialize_fault(fault, version)
+
+        with self._stats_lock:
+            self._stats["bytes_out"] += len(payload)
+        set_cookie = None
+        if call is not None and call.new_session is not None:
+            set_cookie = '{0}="{1}"; Path=/; HttpOnly; Secure;'.format(
+                SESSION_COOKIE, call.new_session.key
+            )
+        return status, payload, set_cookie
+
+    def _session(self, cookie):
+        if not cookie:
+            return None
+        morsel = SimpleCookie(cookie).get(SESSION_COOKIE)
+        return self.service.session(morsel.value) if morsel is not None else None
+
+    def _count(self, call, body):
+        mo_type = getattr(type(call.mo), "_wsdlName", type(call.mo).__name__)
+        name = call.args.get("prop") if call.method == "Fetch" else call.method
+        with self._stats_lock:
+            self._stats["requests"] += 1
+            self._stats["bytes_in"] += len(body)
+            self._methods["{0}.{1}".format(mo_type, name)] += 1
+
+
+def _result_info(info, call):
+    """
+    Returns the declared result type and flags of a call, from the method
+    info or, for Fetch, from the property
+    """
+    if info is not None:
+        return info.result, info.resultFlags
+    try:
+        prop = type(call.mo)._GetPropertyInfo(call.args.get("prop"))
+    except AttributeError:
+        raise vmodl.fault.InvalidProperty(name=call.args.get("prop"))
+    return prop.type, prop.flags
+
+
+def _self_signed_certificate(directory, host):
+    """
+    Create a self signed certificate with the openssl command line tool
+    Args:
+        directory (str) : where to write the certificate and key
+        host (str) : common name of the certificate
+    Returns:
+        (tuple) paths of the certificate and the key
+    """
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    try:
+        subprocess.check_call(
+            [
+                "openssl",
+                "req",
+                "-x509",
+                "-newkey",
+                "rsa:2048",
+                "-nodes",
+                "-days",
+                "2",
+                "-subj",
+                "/CN={0}".format(host),
+                "-keyout",
+                keyfile,
+                "-out",
+                certfile,
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+    except (OSError, subprocess.CalledProcessError) as ex:
+        raise RuntimeError(
+            "Creating a certificate with openssl failed ({0}), pass certfile "
+            "and keyfile instead".format(ex)
+        )
+    return certfile, keyfile
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    # keep-alive, pyVmomi reuses its connections
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, do not wait for delayed acks
+    disable_nagle_algorithm = True
+    server_version = "FakeVCenter"
+
+    def do_GET(self):
+        if self.path.split("?")[0] == SERVICE_VERSIONS_PATH:
+            self._reply(200, self.server.fake.versions_xml)
+        else:
+            self._reply(404, b"")
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        status, payload, cookie = self.server.fake.handle(
+            body,
+            soap_action=self.headers.get("SOAPAction"),
+            cookie=self.headers.get("Cookie"),
+            client=self.client_address[0],
+        )
+        self._reply(status, payload, cookie)
+
+    def _reply(self, status, payload, cookie=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "text/xml; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        if cookie:
+            self.send_header("Set-Cookie", cookie)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, fmt, *args):
+        LOG.debug("Fake vCenter %s: " + fmt, self.client_address[0], *args)
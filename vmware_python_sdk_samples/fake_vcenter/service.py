@@ -0,0 +1,916 @@
+# -*- coding: utf-8 -*-
+"""vSphere methods served by the fake vCenter"""
+
+import collections
+import copy
+import datetime
+import heapq
+import itertools
+import threading
+import time
+import uuid
+
+from pyVmomi import vim, vmodl
+from pyVmomi.VmomiSupport import DataObject, ManagedObject
+
+from .inventory import (
+    CollectorEntry,
+    ContainerViewEntry,
+    DatacenterEntry,
+    Entry,
+    FilterEntry,
+    VirtualMachineEntry,
+    _mo_array,
+)
+from ..src.logger import CustomLogger
+
+LOG = CustomLogger(__name__)
+
+PropertyCollector = vmodl.query.PropertyCollector
+
+# Objects per RetrievePropertiesEx page when the client sets no maxObjects.
+DEFAULT_MAX_OBJECTS = 1000
+
+# Seconds finished tasks can still be looked up, like the recent tasks of
+# vCenter.
+DEFAULT_TASK_RETENTION = 600
+
+# Methods and properties that work without a logged in session.
+UNAUTHENTICATED_METHODS = ("RetrieveServiceContent", "Login")
+UNAUTHENTICATED_PROPERTIES = ("content", "currentSession")
+
+_POWERED_ON = vim.VirtualMachine.PowerState.poweredOn
+_POWERED_OFF = vim.VirtualMachine.PowerState.poweredOff
+_SUSPENDED = vim.VirtualMachine.PowerState.suspended
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _unchanged(old, new):
+    # data objects have no value equality, they are replaced when changed
+    return old is new or (not isinstance(new, DataObject) and old == new)
+
+
+class Call(object):
+    """
+    One method invocation: the method, its _this and arguments, and the
+    session it runs in. Login sets new_session, the server hands its cookie
+    to the client.
+    """
+
+    def __init__(self, method, mo, args, session=None, client=None):
+        self.method = method
+        self.mo = mo
+        self.args = args
+        self.session = session
+        self.client = client
+        self.new_session = None
+
+
+class Session(object):
+    """A logged in session and the views and collectors it created"""
+
+    def __init__(self, user_session):
+        self.user_session = user_session
+        self.objects = set()
+
+    @property
+    def key(self):
+        return self.user_session.key
+
+
+class _Scheduler(object):
+    """Runs callbacks after a delay, on a single daemon thread"""
+
+    def __init__(self):
+        self._queue = []
+        self._cond = threading.Condition()
+        self._counter = itertools.count()
+        self._thread = None
+        self._stopped = False
+
+    def call_later(self, delay, fn, *args):
+        with self._cond:
+            heapq.heappush(
+                self._queue, (time.time() + delay, next(self._counter), fn, args)
+            )
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="fake-vcenter-scheduler"
+                )
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._queue = []
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    if not self._queue:
+                        self._cond.wait()
+                        continue
+                    remaining = self._queue[0][0] - time.time()
+                    if remaining > 0:
+                        self._cond.wait(remaining)
+                        continue
+                    break
+                if self._stopped:
+                    return
+                _, _, fn, args = heapq.heappop(self._queue)
+            try:
+                fn(*args)
+            except Exception as ex:
+                LOG.error("Fake vCenter callback %s failed: %s", fn, ex)
+
+
+class FakeService(object):
+    """
+    The vSphere methods of the fake vCenter, working on an Inventory.
+
+    Tasks run for task_duration seconds, on a scheduler thread, before their
+    change is applied; with task_duration 0 they complete before the method
+    returns. Every handler runs with the inventory lock held.
+
+    Property paths in property_faults are reported in the missingSet of
+    RetrievePropertiesEx with their fault, like a property the user has no
+    permission to read.
+    """
+
+    def __init__(
+        self,
+        inventory,
+        task_duration=0.0,
+        username=None,
+        password=None,
+        task_retention=DEFAULT_TASK_RETENTION,
+    ):
+        """
+        Build the service
+        Args:
+            inventory (Inventory) : objects to serve
+            task_duration (float) : seconds a task runs
+            username (str) : user accepted by Login, any if None
+            password (str) : password accepted by Login, any if None
+            task_retention (float) : seconds finished tasks are kept
+        """
+        self.inventory = inventory
+        self.task_duration = task_duration
+        self.username = username
+        self.password = password
+        self.task_retention = task_retention
+        # property path -> vmodl.MethodFault reported instead of its value
+        self.property_faults = {}
+        self.sessions = {}
+        self._scheduler = _Scheduler()
+        self._tokens = itertools.count(1)
+
+        vm = VirtualMachineEntry
+        self._handlers = {
+            "RetrieveServiceContent": (Entry, self._retrieve_service_content),
+            "CurrentTime": (Entry, self._current_time),
+            "Login": (Entry, self._login),
+            "Logout": (Entry, self._logout),
+            "Fetch": (Entry, self._fetch),
+            "CreateContainerView": (Entry, self._create_container_view),
+            "CreateListView": (Entry, self._create_list_view),
+            "ModifyListView": (Entry, self._modify_list_view),
+            "DestroyView": (Entry, self._destroy_owned),
+            "CreatePropertyCollector": (Entry, self._create_property_collector),
+            "DestroyPropertyCollector": (CollectorEntry, self._destroy_owned),
+            "CreateFilter": (CollectorEntry, self._create_filter),
+            "DestroyPropertyFilter": (FilterEntry, self._destroy_owned),
+            "RetrieveProperties": (CollectorEntry, self._retrieve_properties),
+            "RetrievePropertiesEx": (CollectorEntry, self._retrieve_properties_ex),
+            "ContinueRetrievePropertiesEx": (CollectorEntry, self._continue_retrieve),
+            "CancelRetrievePropertiesEx": (CollectorEntry, self._cancel_retrieve),
+            "WaitForUpdatesEx": (CollectorEntry, self._wait_for_updates_ex),
+            "WaitForUpdates": (CollectorEntry, self._wait_for_updates),
+            "CheckForUpdates": (CollectorEntry, self._check_for_updates),
+            "CancelWaitForUpdates": (CollectorEntry, self._cancel_wait_for_updates),
+            "FindByUuid": (Entry, self._find_by_uuid),
+            "ReconfigVM_Task": (vm, self._reconfig_vm),
+            "PowerOnVM_Task": (
+                vm,
+                self._power_task(_POWERED_ON, (_POWERED_OFF, _SUSPENDED)),
+            ),
+            "PowerOffVM_Task": (
+                vm,
+                self._power_task(_POWERED_OFF, (_POWERED_ON, _SUSPENDED)),
+            ),
+            "ResetVM_Task": (vm, self._power_task(_POWERED_ON, (_POWERED_ON,))),
+            "SuspendVM_Task": (vm, self._power_task(_SUSPENDED, (_POWERED_ON,))),
+            "RebootGuest": (vm, self._guest_operation(None)),
+            "ShutdownGuest": (vm, self._guest_operation(_POWERED_OFF)),
+            "StandbyGuest": (vm, self._guest_operation(_SUSPENDED)),
+            "Destroy_Task": (vm, self._destroy_vm),
+            "CancelTask": (Entry, self._cancel_task),
+        }
+
+    def invoke(self, call):
+        """
+        Run a method, the caller holds the inventory lock
+        Args:
+            call (Call) : method invocation
+        Returns:
+            (object) result of the method
+        Raises: vmodl.MethodFault
+        """
+        handler = self._handlers.get(call.method)
+        if call.session is None and call.method not in UNAUTHENTICATED_METHODS:
+            if not (
+                call.method == "Fetch"
+                and call.args.get("prop") in UNAUTHENTICATED_PROPERTIES
+            ):
+                raise vim.fault.NotAuthenticated(
+                    object=call.mo, privilegeId="System.View"
+                )
+        entry = self.inventory.get(call.mo)
+        if entry is None:
+            raise vmodl.fault.ManagedObjectNotFound(obj=call.mo)
+        if handler is None or not isinstance(entry, handler[0]):
+            raise vmodl.fault.MethodNotFound(receiver=call.mo, method=call.method)
+        if call.session is not None:
+            call.session.user_session.lastActiveTime = _now()
+            call.session.user_session.callCount = (
+                call.session.user_session.callCount or 0
+            ) + 1
+        return handler[1](call, entry)
+
+    def session(self, key):
+        """
+        Returns the session for a session cookie value
+        Args:
+            key (str) : vmware_soap_session cookie value
+        Returns:
+            (Session) session, None if unknown or logged out
+        """
+        return self.sessions.get(key)
+
+    def expire_sessions(self):
+        """
+        Drop every session, as if they timed out on the server
+        Returns:
+            None
+        """
+        with self.inventory.lock:
+            for session in list(self.sessions.values()):
+                self._end_session(session)
+
+    def stop(self):
+        """
+        Stop running tasks and cancel pending WaitForUpdates calls
+        Returns:
+            None
+        """
+        self._scheduler.stop()
+        with self.inventory.lock:
+            for collector in self.inventory.entries(CollectorEntry):
+                collector.cancel_requested = bool(collector.waiting)
+            self.inventory.changed.notify_all()
+
+    def stats(self):
+        """
+        Returns counts of server side objects, to spot leaked views,
+        collectors and filters
+        Returns:
+            (dict) sessions, views, collectors, filters and tasks
+        """
+        with self.inventory.lock:
+            views = self.inventory.entries(ContainerViewEntry)
+            list_views = [
+                e
+                for e in self.inventory.entries()
+                if isinstance(e.ref, vim.view.ListView)
+            ]
+            return {
+                "sessions": len(self.sessions),
+                "views": len(views) + len(list_views),
+                "collectors": len(self.inventory.entries(CollectorEntry)),
+                "filters": len(self.inventory.entries(FilterEntry)),
+                "tasks": len(
+                    [e for e in self.inventory.entries() if isinstance(e.ref, vim.Task)]
+                ),
+            }
+
+    # ServiceInstance, SessionManager
+
+    def _retrieve_service_content(self, call, entry):
+        return self.inventory.content
+
+    def _current_time(self, call, entry):
+        return _now()
+
+    def _login(self, call, entry):
+        user = call.args.get("userName")
+        if (self.username is not None and user != self.username) or (
+            self.password is not None and call.args.get("password") != self.password
+        ):
+            raise vim.fault.InvalidLogin(
+                msg="Cannot complete login due to an incorrect user name or password."
+            )
+        now = _now()
+        session = Session(
+            vim.UserSession(
+                key=str(uuid.uuid4()),
+                userName=user,
+                fullName=user,
+                loginTime=now,
+                lastActiveTime=now,
+                locale=call.args.get("locale") or "en",
+                messageLocale=call.args.get("locale") or "en",
+                extensionSession=False,
+                ipAddress=call.client,
+                userAgent="pyVmomi",
+                callCount=0,
+            )
+        )
+        self.sessions[session.key] = session
+        call.new_session = session
+        return session.user_session
+
+    def _logout(self, call, entry):
+        self._end_session(call.session)
+
+    def _end_session(self, session):
+        self.sessions.pop(session.key, None)
+        for moid in list(session.objects):
+            owned = self.inventory.get(moid)
+            if owned is not None:
+                self._destroy(owned)
+
+    def _fetch(self, call, entry):
+        prop = call.args.get("prop")
+        if isinstance(entry.ref, vim.SessionManager) and prop == "currentSession":
+            return call.session.user_session if call.session else None
+        try:
+            return entry.get_property(prop)
+        except KeyError:
+            return None
+
+    # ViewManager and views
+
+    def _own(self, call, entry):
+        entry.owner = call.session.key
+        call.session.objects.add(entry.moid)
+        return self.inventory.add(entry, structural=False)
+
+    def _create_container_view(self, call, entry):
+        container = call.args.get("container")
+        if self.inventory.get(container) is None:
+            raise vmodl.fault.ManagedObjectNotFound(obj=container)
+        view = ContainerViewEntry(
+            vim.view.ContainerView(self.inventory.next_id("session[view]")),
+            self.inventory,
+            container,
+            call.args.get("type") or (),
+            bool(call.args.get("recursive")),
+        )
+        return self._own(call, view).ref
+
+    def _create_list_view(self, call, entry):
+        refs = [ref for ref in call.args.get("obj") or () if self.inventory.get(ref)]
+        view = Entry(
+            vim.view.ListView(self.inventory.next_id("session[view]")),
+            {"view": _mo_array(ManagedObject, refs)},
+        )
+        return self._own(call, view).ref
+
+    def _modify_list_view(self, call, entry):
+        if not isinstance(entry.ref, vim.view.ListView):
+            raise vmodl.fault.MethodNotFound(receiver=call.mo, method=call.method)
+        view = list(entry.props["view"])
+        unresolved = []
+        for ref in call.args.get("add") or ():
+            if self.inventory.get(ref) is None:
+                unresolved.append(ref)
+            elif ref not in view:
+                view.append(ref)
+        removed = call.args.get("remove") or ()
+        view = [ref for ref in view if ref not in removed]
+        entry.props["view"] = _mo_array(ManagedObject, view)
+        self.inventory.touch(entry, structural=True)
+        return _mo_array(ManagedObject, unresolved)
+
+    def _destroy_owned(self, call, entry):
+        if not isinstance(
+            entry.ref, (vim.view.View, PropertyCollector, PropertyCollector.Filter)
+        ):
+            raise vmodl.fault.MethodNotFound(receiver=call.mo, method=call.method)
+        self._destroy(entry)
+
+    def _destroy(self, entry):
+        if isinstance(entry, CollectorEntry):
+            for pcfilter in list(entry.filters):
+                self._destroy(pcfilter)
+            # wake up a WaitForUpdatesEx on the collector
+            entry.cancel_requested = bool(entry.waiting)
+        elif isinstance(entry, FilterEntry):
+            if entry in entry.collector.filters:
+                entry.collector.filters.remove(entry)
+        session = self.sessions.get(entry.owner)
+        if session is not None:
+            session.objects.discard(entry.moid)
+        self.inventory.remove(entry)
+
+    # PropertyCollector
+
+    def _create_property_collector(self, call, entry):
+        collector = CollectorEntry(
+            PropertyCollector(self.inventory.next_id("session[collector]"))
+        )
+        return self._own(call, collector).ref
+
+    def _create_filter(self, call, collector):
+        spec = call.args.get("spec")
+        # raises for unknown objects and selection specs
+        self._select(spec)
+        pcfilter = FilterEntry(
+            PropertyCollector.Filter(self.inventory.next_id("session[filter]")),
+            collector,
+            spec,
+            bool(call.args.get("partialUpdates")),
+        )
+        self._own(call, pcfilter)
+        collector.filters.append(pcfilter)
+        collector.props["filter"] = _mo_array(
+            PropertyCollector.Filter, [f.ref for f in collector.filters]
+        )
+        self.inventory.touch(collector)
+        return pcfilter.ref
+
+    def _retrieve_properties(self, call, collector):
+        contents = []
+        for spec in call.args.get("specSet") or ():
+            for entry in self._select(spec):
+                content = self._object_content(entry, spec.propSet)
+                if content is not None:
+                    contents.append(content)
+        return contents
+
+    def _retrieve_properties_ex(self, call, collector):
+        pending = collections.deque()
+        for spec in call.args.get("specSet") or ():
+            pending.extend((entry, spec.propSet) for entry in self._select(spec))
+        options = call.args.get("options")
+        max_objects = (options and options.maxObjects) or DEFAULT_MAX_OBJECTS
+        return self._result_page(collector, pending, max_objects)
+
+    def _continue_retrieve(self, call, collector):
+        pending, max_objects = self._pop_result(collector, call.args.get("token"))
+        return self._result_page(collector, pending, max_objects)
+
+    def _cancel_retrieve(self, call, collector):
+        self._pop_result(collector, call.args.get("token"))
+
+    def _pop_result(self, collector, token):
+        result = collector.results.pop(token, None)
+        if result is None:
+            raise vmodl.fault.InvalidArgument(invalidProperty="token")
+        return result
+
+    def _result_page(self, collector, pending, max_objects):
+        objects = []
+        while pending and len(objects) < max_objects:
+            entry, prop_specs = pending.popleft()
+            if self.inventory.get(entry.ref) is not entry:
+                continue
+            content = self._object_content(entry, prop_specs)
+            if content is not None:
+                objects.append(content)
+        token = None
+        if pending:
+            token = str(next(self._tokens))
+            collector.results[token] = (pending, max_objects)
+        if not objects and token is None:
+            return None
+        return PropertyCollector.RetrieveResult(token=token, objects=objects)
+
+    def _select(self, spec):
+        """
+        Returns the entries a filter spec selects, in traversal order
+        Raises: vmodl.fault.ManagedObjectNotFound, vmodl.fault.InvalidArgument
+        """
+        named = {}
+        seen = set()
+
+        def collect(selections):
+            for selection in selections or ():
+                if id(selection) in seen:
+                    continue
+                seen.add(id(selection))
+                if isinstance(selection, PropertyCollector.TraversalSpec):
+                    if selection.name:
+                        named.setdefault(selection.name, selection)
+                    collect(selection.selectSet)
+
+        for obj_spec in spec.objectSet or ():
+            collect(obj_spec.selectSet)
+
+        selected = collections.OrderedDict()
+        visited = set()
+
+        def traverse(entry, selections):
+            for selection in selections or ():
+                if not isinstance(selection, PropertyCollector.TraversalSpec):
+                    selection = named.get(selection.name)
+                    if selection is None:
+                        raise vmodl.fault.InvalidArgument(invalidProperty="selectSet")
+                if not isinstance(entry.ref, selection.type):
+                    continue
+                if (entry.moid, id(selection)) in visited:
+                    continue
+                visited.add((entry.moid, id(selection)))
+                try:
+                    value = entry.get(selection.path)
+                except KeyError:
+                    continue
+                for ref in value if isinstance(value, list) else [value]:
+                    child = self.inventory.get(ref)
+                    if child is None:
+                        continue
+                    if not selection.skip:
+                        selected.setdefault(child.moid, child)
+                    traverse(child, selection.selectSet)
+
+        for obj_spec in spec.objectSet or ():
+            entry = self.inventory.get(obj_spec.obj)
+            if entry is None:
+                raise vmodl.fault.ManagedObjectNotFound(obj=obj_spec.obj)
+            if not obj_spec.skip:
+                selected.setdefault(entry.moid, entry)
+            traverse(entry, obj_spec.selectSet)
+        return list(selected.values())
+
+    def _property_values(self, entry, prop_specs):
+        """
+        Returns the values of the properties prop_specs select on an entry,
+        None if no spec applies to its type
+        """
+        paths = self._selected_paths(entry, prop_specs)
+        if paths is None:
+            return None
+        values = collections.OrderedDict()
+        for path in paths:
+            if path in values or path in self.property_faults:
+                continue
+            try:
+                values[path] = entry.get(path)
+            except KeyError:
+                pass
+        return values
+
+    def _selected_paths(self, entry, prop_specs):
+        """
+        Returns the property paths prop_specs select on an entry, None if no
+        spec applies to its type
+        """
+        paths = None
+        for prop_spec in prop_specs or ():
+            if not isinstance(entry.ref, prop_spec.type):
+                continue
+            if paths is None:
+                paths = []
+            if prop_spec.all:
+                paths.extend(entry.property_names())
+            paths.extend(prop_spec.pathSet or ())
+        return paths
+
+    def _object_content(self, entry, prop_specs):
+        values = self._property_values(entry, prop_specs)
+        if values is None:
+            return None
+        faulted = [
+            path
+            for path in self._selected_paths(entry, prop_specs)
+            if path in self.property_faults
+        ]
+        return PropertyCollector.ObjectContent(
+            obj=entry.ref,
+            propSet=[
+                vmodl.DynamicProperty(name=name, val=val)
+                for name, val in values.items()
+            ],
+            missingSet=[
+                PropertyCollector.MissingProperty(
+                    path=path, fault=self.property_faults[path]
+                )
+                for path in sorted(set(faulted))
+            ],
+        )
+
+    def _wait_for_updates_ex(self, call, collector):
+        options = call.args.get("options")
+        max_wait = options.maxWaitSeconds if options is not None else None
+        return self._wait(collector, call.args.get("version"), max_wait)
+
+    def _wait_for_updates(self, call, collector):
+        return self._wait(collector, call.args.get("version"), None)
+
+    def _check_for_updates(self, call, collector):
+        return self._wait(collector, call.args.get("version"), 0)
+
+    def _cancel_wait_for_updates(self, call, collector):
+        if collector.waiting:
+            collector.cancel_requested = True
+            self.inventory.changed.notify_all()
+
+    def _wait(self, collector, version, max_wait):
+        if not version:
+            for pcfilter in collector.filters:
+                pcfilter.reset()
+        deadline = None if max_wait is None else time.time() + max_wait
+        collector.waiting += 1
+        try:
+            while True:
+                if collector.cancel_requested:
+                    collector.cancel_requested = False
+                    raise vmodl.fault.RequestCanceled()
+                filter_updates = []
+                for pcfilter in collector.filters:
+                    filter_update = self._filter_update(pcfilter)
+                    if filter_update is not None:
+                        filter_updates.append(filter_update)
+                if filter_updates:
+                    collector.update_version += 1
+                    return PropertyCollector.UpdateSet(
+                        version=str(collector.update_version),
+                        filterSet=filter_updates,
+                        truncated=False,
+                    )
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None
+                # releases the inventory lock while waiting
+                self.inventory.changed.wait(remaining)
+        finally:
+            collector.waiting -= 1
+
+    def _filter_update(self, pcfilter):
+        """
+        Returns what changed for a filter since its last report, None if
+        nothing did
+        """
+        inventory = self.inventory
+        changes = None
+        if pcfilter.seq is not None:
+            changes = inventory.changes_since(pcfilter.seq)
+            if changes is not None and not changes:
+                return None
+        seq = inventory.seq
+        prop_specs = pcfilter.spec.propSet
+
+        if changes is None or any(structural for _, _, structural in changes):
+            # membership may have changed, compare the whole selection
+            try:
+                candidates = self._select(pcfilter.spec)
+            except vmodl.MethodFault:
+                candidates = []
+            full = True
+        else:
+            changed = set(moid for _, moid, _ in changes)
+            candidates = [
+                inventory.get(moid) for moid in pcfilter.reported if moid in changed
+            ]
+            candidates = [entry for entry in candidates if entry is not None]
+            full = False
+
+        object_updates = []
+        current = set()
+        for entry in candidates:
+            reported = pcfilter.reported.get(entry.moid)
+            if reported is not None and reported[0] == entry.version:
+                current.add(entry.moid)
+                continue
+            values = self._property_values(entry, prop_specs)
+            if values is None:
+                continue
+            current.add(entry.moid)
+            if reported is None:
+                kind = "enter"
+                change_set = [
+                    PropertyCollector.Change(name=name, op="assign", val=val)
+                    for name, val in values.items()
+                ]
+            else:
+                kind = "modify"
+                change_set = [
+                    PropertyCollector.Change(name=name, op="assign", val=val)
+                    for name, val in values.items()
+                    if name not in reported[1] or not _unchanged(reported[1][name], val)
+                ]
+                change_set.extend(
+                    PropertyCollector.Change(name=name, op="remove")
+                    for name in reported[1]
+                    if name not in values
+                )
+            pcfilter.reported[entry.moid] = (entry.version, values, entry.ref)
+            if change_set:
+                object_updates.append(
+                    PropertyCollector.ObjectUpdate(
+                        kind=kind, obj=entry.ref, changeSet=change_set
+                    )
+                )
+        if full:
+            for moid in [m for m in pcfilter.reported if m not in current]:
+                ref = pcfilter.reported.pop(moid)[2]
+                object_updates.append(
+                    PropertyCollector.ObjectUpdate(kind="leave", obj=ref)
+                )
+        pcfilter.seq = seq
+        if not object_updates:
+            return None
+        return PropertyCollector.FilterUpdate(
+            filter=pcfilter.ref, objectSet=object_updates
+        )
+
+    # SearchIndex
+
+    def _find_by_uuid(self, call, entry):
+        datacenter = call.args.get("datacenter")
+        if datacenter is not None and not isinstance(
+            self.inventory.get(datacenter), DatacenterEntry
+        ):
+            raise vmodl.fault.ManagedObjectNotFound(obj=datacenter)
+        if not call.args.get("vmSearch"):
+            return None
+        vm = self.inventory.find_vm(
+            call.args.get("uuid"),
+            instance_uuid=bool(call.args.get("instanceUuid")),
+            datacenter=datacenter,
+        )
+        return vm.ref if vm is not None else None
+
+    # VirtualMachine
+
+    def _reconfig_vm(self, call, vm):
+        spec = call.args.get("spec")
+
+        def apply():
+            vm.reconfigure(spec)
+            self.inventory.touch(vm)
+
+        return self._start_task(call, vm, "VirtualMachine.reconfigure", apply)
+
+    def _power_task(self, target, allowed):
+        def handler(call, vm):
+            def apply():
+                if vm.power_state not in allowed:
+                    raise vim.fault.InvalidPowerState(
+                        requestedState=target,
+                        existingState=vm.power_state,
+                        msg="The attempted operation cannot be performed in the "
+                        "current state ({0}).".format(vm.power_state),
+                    )
+                vm.power_state = target
+                self.inventory.touch(vm)
+
+            return self._start_task(
+                call, vm, "VirtualMachine." + call.method.replace("VM_Task", ""), apply
+            )
+
+        return handler
+
+    def _guest_operation(self, target):
+        def handler(call, vm):
+            if vm.power_state != _POWERED_ON:
+                raise vim.fault.InvalidPowerState(
+                    requestedState=_POWERED_ON,
+                    existingState=vm.power_state,
+                    msg="The attempted operation cannot be performed in the "
+                    "current state ({0}).".format(vm.power_state),
+                )
+            if target is not None:
+                self._scheduler.call_later(
+                    self.task_duration, self._set_power_state, vm, target
+                )
+
+        return handler
+
+    def _set_power_state(self, vm, power_state):
+        with self.inventory.lock:
+            if self.inventory.get(vm.ref) is vm:
+                vm.power_state = power_state
+                self.inventory.touch(vm)
+
+    def _destroy_vm(self, call, vm):
+        def apply():
+            if vm.power_state == _POWERED_ON:
+                raise vim.fault.InvalidPowerState(
+                    requestedState=_POWERED_OFF,
+                    existingState=vm.power_state,
+                    msg="The attempted operation cannot be performed in the "
+                    "current state (Powered on).",
+                )
+            self.inventory.remove(vm)
+
+        return self._start_task(call, vm, "VirtualMachine.destroy", apply)
+
+    # Task
+
+    def _start_task(self, call, entity, description_id, apply):
+        """
+        Create a task that applies a change after task_duration seconds
+        Args:
+            call (Call) : method invocation creating the task
+            entity (Entry) : object the task works on
+            description_id (str) : e.g. "VirtualMachine.powerOn"
+            apply (callable) : makes the change, raises vmodl.MethodFault
+                        if the task fails
+        Returns:
+            (vim.Task) task
+        """
+        ref = vim.Task(self.inventory.next_id("task"))
+        now = _now()
+        info = vim.TaskInfo(
+            key=ref._moId,
+            task=ref,
+            descriptionId=description_id,
+            entity=entity.ref,
+            entityName=entity.props.get("name"),
+            state=vim.TaskInfo.State.running,
+            cancelled=False,
+            cancelable=True,
+            queueTime=now,
+            startTime=now,
+            eventChainId=int(ref._moId.split("-")[1]),
+            reason=vim.TaskReasonUser(userName=call.session.user_session.userName),
+            progress=0,
+        )
+        task = self.inventory.add(Entry(ref, {"info": info}), structural=False)
+        task.apply = apply
+        if self.task_duration > 0:
+            self._scheduler.call_later(
+                self.task_duration / 2.0, self._progress_task, task, 50
+            )
+            self._scheduler.call_later(self.task_duration, self._finish_task, task)
+        else:
+            self._finish_task(task)
+        return ref
+
+    def _progress_task(self, task, progress):
+        with self.inventory.lock:
+            info = task.props["info"]
+            if info.state != vim.TaskInfo.State.running:
+                return
+            self._update_task(task, progress=progress)
+
+    def _finish_task(self, task, fault=None):
+        with self.inventory.lock:
+            if task.props["info"].state != vim.TaskInfo.State.running:
+                return
+            if fault is None:
+                try:
+                    task.apply()
+                except vmodl.MethodFault as ex:
+                    fault = ex
+            if fault is None:
+                self._update_task(
+                    task,
+                    state=vim.TaskInfo.State.success,
+                    progress=None,
+                    cancelable=False,
+                    completeTime=_now(),
+                )
+            else:
+                self._update_task(
+                    task,
+                    state=vim.TaskInfo.State.error,
+                    error=fault,
+                    progress=None,
+                    cancelable=False,
+                    cancelled=isinstance(fault, vmodl.fault.RequestCanceled),
+                    completeTime=_now(),
+                )
+        if self.task_retention is not None:
+            self._scheduler.call_later(self.task_retention, self._forget_task, task)
+
+    def _update_task(self, task, **changes):
+        # a new TaskInfo, collected values of the old one stay untouched
+        info = copy.copy(task.props["info"])
+        for name, value in changes.items():
+            setattr(info, name, value)
+        task.props["info"] = info
+        self.inventory.touch(task)
+
+    def _forget_task(self, task):
+        with self.inventory.lock:
+            if self.inventory.get(task.ref) is task:
+                self.inventory.remove(task)
+
+    def _cancel_task(self, call, task):
+        if not isinstance(task.ref, vim.Task):
+            raise vmodl.fault.MethodNotFound(receiver=call.mo, method=call.method)
+        if task.props["info"].state != vim.TaskInfo.State.running:
+            raise vim.fault.InvalidState(msg="The task is not running.")
+        self._finish_task(
+            task,
+            fault=vmodl.fault.RequestCanceled(msg="The task was canceled by a user."),
+        )
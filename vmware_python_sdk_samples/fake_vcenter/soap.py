@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""Server side of the vSphere SOAP encoding, built on the pyVmomi serializers"""
+
+from pyVmomi import SoapAdapter, VmomiSupport
+from pyVmomi.VmomiSupport import ManagedObject, Object
+
+# Service namespace of every vSphere API version.
+VIM_SERVICE = "vim25"
+
+
+def service_versions():
+    """
+    Returns the vim25 versions known to pyVmomi
+    Returns:
+        (list) version names, newest first, e.g. "vim.version.v9_1_1_0"
+    """
+    return list(VmomiSupport.GetServiceVersions(VIM_SERVICE))
+
+
+def service_versions_xml(versions):
+    """
+    Build /sdk/vimServiceVersions.xml, SmartConnect picks the api version
+    from it
+    Args:
+        versions (list) : version names, newest first
+    Returns:
+        (bytes) xml document
+    """
+    version_ids = [VmomiSupport.versionIdMap[version] for version in versions]
+    return "".join(
+        [
+            SoapAdapter.XML_HEADER,
+            '\n<namespaces version="1.0"><namespace>',
+            "<name>urn:{0}</name>".format(VIM_SERVICE),
+            "<version>{0}</version><priorVersions>".format(version_ids[0]),
+            "".join("<version>{0}</version>".format(v) for v in version_ids[1:]),
+            "</priorVersions></namespace></namespaces>",
+        ]
+    ).encode("utf-8")
+
+
+def version_from_soap_action(soap_action, versions):
+    """
+    Returns the api version of a request from its SOAPAction header
+    Args:
+        soap_action (str) : header value, e.g. "urn:vim25/9.1.1.0"
+        versions (list) : supported version names, newest first
+    Returns:
+        (str) version name, the newest one if the header names none
+    """
+    version_id = (soap_action or "").strip('"').rpartition("/")[2]
+    for version in versions:
+        if VmomiSupport.versionIdMap[version] == version_id:
+            return version
+    return versions[0]
+
+
+class RequestDeserializer(SoapAdapter.ExpatDeserializerNSHandlers):
+    """
+    Parses a SOAP request envelope into the invoked method and its arguments.
+
+    The envelope is walked with expat, every parameter element is handed to
+    pyVmomi's SoapDeserializer so data objects, enums and managed object
+    references come out exactly as the client serialized them.
+    """
+
+    def __init__(self, version):
+        """
+        Build a deserializer for requests of an api version
+        Args:
+            version (str) : version name, e.g. "vim.version.v9_1_1_0"
+        """
+        SoapAdapter.ExpatDeserializerNSHandlers.__init__(self)
+        self.version = version
+        self._deserializer = SoapAdapter.SoapDeserializer(None, version)
+
+    def deserialize(self, data):
+        """
+        Parse a request
+        Args:
+            data (bytes) : SOAP envelope
+        Returns:
+            (tuple) wsdl method name, _this managed object and a dict of
+            the arguments by parameter name, info is set to the method info
+        """
+        self._depth = 0
+        self._params = {}
+        self.info = None
+        self._pending = None
+        self.method = None
+        self.mo = None
+        self.args = {}
+        self.parser = SoapAdapter.ParserCreate(namespace_separator=SoapAdapter.NS_SEP)
+        self.parser.buffer_text = True
+        SoapAdapter.SetHandlers(self.parser, SoapAdapter.GetHandlers(self))
+        self.parser.Parse(data, True)
+        self._harvest()
+        return self.method, self.mo, self.args
+
+    def StartElementHandler(self, tag, attr):
+        self._harvest()
+        self._depth += 1
+        ns, name = self._deserializer.SplitTag(tag)
+        if self._depth == 3:
+            # Envelope > Body > method
+            self.method = name
+            try:
+                self.info = VmomiSupport.GetWsdlMethod(ns, name).info
+                self._params = dict((param.name, param) for param in self.info.params)
+            except KeyError:
+                # Fetch, the property accessor, has no method info
+                self._params = {}
+        elif self._depth == 4:
+            if name == "_this":
+                param_type, is_list = ManagedObject, False
+            else:
+                param = self._params.get(name)
+                # the only parameter of Fetch is "prop"
+                param_type = param.type if param is not None else str
+                is_list = issubclass(param_type, list)
+                if is_list:
+                    param_type = param_type.Item
+            self._pending = (name, is_list)
+            self._deserializer.Deserialize(self.parser, param_type, False, self.nsMap)
+            self._deserializer.StartElementHandler(tag, attr)
+            # the deserializer took over the parser until the element's end
+            self._depth -= 1
+
+    def EndElementHandler(self, tag):
+        self._harvest()
+        self._depth -= 1
+
+    def CharacterDataHandler(self, data):
+        pass
+
+    def _harvest(self):
+        if self._pending is None:
+            return
+        name, is_list = self._pending
+        self._pending = None
+        value = self._deserializer.GetResult()
+        if name == "_this":
+            self.mo = value
+        elif is_list:
+            self.args.setdefault(name, []).append(value)
+        else:
+            self.args[name] = value
+
+
+def _ns_map(version):
+    ns = VmomiSupport.GetWsdlNamespace(version)
+    ns_map = SoapAdapter.SOAP_NSMAP.copy()
+    ns_map[ns] = ""
+    return ns, ns_map
+
+
+def _envelope(body):
+    return "".join(
+        [
+            SoapAdapter.XML_HEADER,
+            "\n",
+            SoapAdapter.SOAP_ENVELOPE_START,
+            SoapAdapter.SOAP_BODY_START,
+            body,
+            SoapAdapter.SOAP_BODY_END,
+            SoapAdapter.SOAP_ENVELOPE_END,
+        ]
+    ).encode("utf-8")
+
+
+def serialize_response(method, result_type, flags, value, version):
+    """
+    Build the response envelope of a method
+    Args:
+        method (str) : wsdl method name
+        result_type (type) : declared result type of the method
+        flags (int) : result flags of the method
+        value (object) : result, None for void methods and unset results
+        version (str) : api version of the request
+    Returns:
+        (bytes) SOAP envelope
+    """
+    ns, ns_map = _ns_map(version)
+    body = ""
+    if value is not None and result_type is not type(None):
+        info = Object(name="returnval", type=result_type, version=version, flags=flags)
+        body = SoapAdapter._SerializeToStr(value, info, version, ns_map)
+    return _envelope(
+        '<{0}Response xmlns="{1}">{2}</{0}Response>'.format(method, ns, body)
+    )
+
+
+def serialize_fault(fault, version):
+    """
+    Build the fault envelope for a vmodl.MethodFault
+    Args:
+        fault (vmodl.MethodFault) : fault raised by the method
+        version (str) : api version of the request
+    Returns:
+        (bytes) SOAP envelope
+    """
+    ns, ns_map = _ns_map(version)
+    tag = fault._wsdlName + "Fault"
+    info = Object(name=tag, type=object, version=version, flags=0)
+    detail = SoapAdapter.SerializeFaultDetail(fault, info, version, ns_map)
+    if isinstance(detail, bytes):
+        detail = detail.decode("utf-8")
+    # the client resolves the fault type in the namespace of the detail
+    detail = detail.replace("<" + tag, '<{0} xmlns="{1}"'.format(tag, ns), 1)
+    return _envelope(
+        "<soapenv:Fault><faultcode>ServerFaultCode</faultcode>"
+        "<faultstring>{0}</faultstring><detail>{1}</detail>"
+        "</soapenv:Fault>".format(SoapAdapter.XmlEscape(fault.msg or ""), detail)
+    )
@@ -1,3 +1,46 @@
-from .vmware import VMware, VMwareError
-from .constants import VMWARE
-from .logger import CustomLogger
+# -*- coding: utf-8 -*-
+"""
+Public names are imported on first access, so importing the package, or
+using only VMWARE constants or CustomLogger, does not load pyVmomi.
+"""
+
+import importlib
+
+# public name -> submodule that defines it
+_LAZY_ATTRS = {
+    "VMware": ".vmware",
+    "VMwareError": ".vmware",
+    "TaskTimeoutError": ".vmware",
+    "VMwarePool": ".vmware",
+    "enable_instrumentation": ".vmware",
+    "disable_instrumentation": ".vmware",
+    "InMemoryMetrics": ".vmware",
+    "MetricsSink": ".vmware",
+    "soap_budget": ".vmware",
+    "SoapBudgetExceeded": ".vmware",
+    "SoapRecorder": ".vmware",
+    "SoapReplayer": ".vmware",
+    "ReplayError": ".vmware",
+    "VMWARE": ".constants",
+    "CustomLogger": ".logger",
+    "enable_async_logging": ".logger",
+    "disable_async_logging": ".logger",
+}
+
+__all__ = sorted(_LAZY_ATTRS)
+
+
+def __getattr__(name):
+    module = _LAZY_ATTRS.get(name)
+    if module is None:
+        raise AttributeError(
+            "module {0!r} has no attribute {1!r}".format(__name__, name)
+        )
+    value = getattr(importlib.import_module(module, __name__), name)
+    # cache it, later lookups no longer go through __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -1,6 +1,6 @@
 # -*- coding: utf-8 -*-
 
-from classes import IterableConstants
+from .classes import IterableConstants
 
 
 class VMWARE(object):
@@ -17,6 +17,14 @@ class VMWARE(object):
         SHUTDOWN = "shutdown"
         STANDBY = "standby"
 
+    class TASKSTATUS(IterableConstants):
+        """Per vm outcome of bulk operations"""
+
+        SUCCESS = "success"
+        UNCHANGED = "unchanged"
+        FAILED = "failed"
+        NOT_FOUND = "not_found"
+
     class DISKADAPTER(IterableConstants):
         """VMware supported disk adapter types"""
 
@@ -34,6 +42,13 @@ class VMWARE(object):
         VMXNET2 = "vmxnet2"
         VMXNET3 = "vmxnet3"
 
+    class NETWORKKIND(IterableConstants):
+        """Kinds of networks a virtual NIC can be backed by"""
+
+        STANDARD = "standard"
+        OPAQUE = "opaque"
+        PORTGROUP = "portgroup"
+
     IDE_CONTROLLER_DEVICE_KEY_BASE = 200
     MAX_IDE_DEVICES_PER_CONTROLLER = 2
     MAX_IDE_DEVICES_PER_VM = 4
@@ -1,12 +1,30 @@
 # -*- coding: utf-8 -*-
 """Logger util which returns logger object"""
 
+import atexit
 import logging
-
-from colorlog import ColoredFormatter
+import logging.handlers
+import queue
+import threading
 
 DEFAULT_LOG_LEVEL = "INFO"
 
+# custom log levels
+RESPONSE = 5
+PAYLOAD = 6
+STATUS = 15
+URL = 16
+
+# Handlers and loggers are shared by every CustomLogger of the process, so
+# instantiating CustomLogger(name) again does not duplicate output.
+_lock = threading.RLock()
+_levels_registered = False
+_console_handler = None
+_queue_handler = None
+_queue_listener = None
+_atexit_registered = False
+_loggers = {}
+
 
 class CustomLogger(object):
     """
@@ -24,6 +42,11 @@ class CustomLogger(object):
         * LOG.error     - [ERROR]
         * LOG.critical  - [CRITICAL]
 
+    messages are %-formatted with their arguments only if the level is
+    enabled, e.g. LOG.debug("spec: %s", spec) instead of "..." % spec.
+    all CustomLogger share one console handler, enable_async_logging()
+    moves formatting and output to a background thread.
+
     """
 
     def __init__(self, name):
@@ -37,140 +60,171 @@ class CustomLogger(object):
            None
         """
 
-        # create custom levels
+        # create custom levels, once per process
         self.__add_custom_levels()
 
-        # create console and file handler
-        self._ch = logging.StreamHandler()
+        # create custom logger, the shared handler is attached only once
+        self._logger = _get_logger(name)
 
-        # add custom formatter to console handler
-        self.__add_custom_formatter()
+    def isEnabledFor(self, level):
+        """
+        check whether a message of level would be logged, to guard building
+        of expensive log arguments
 
-        # create custom logger
-        self._logger = logging.getLogger(name)
+        Args:
+            level(int|str): log level, e.g. logging.DEBUG or "PAYLOAD"
 
-        # add console to logger
-        self._logger.addHandler(self._ch)
+        Returns:
+            (bool) True if the message would be logged
+        """
 
-        # set level to log level
-        self._logger.setLevel(DEFAULT_LOG_LEVEL)
+        if not isinstance(level, int):
+            level = logging.getLevelName(level)
+        return self._logger.isEnabledFor(level)
 
-    def response(self, msg):
+    def response(self, msg, *args, **kwargs):
         """
         custom response log level
 
         Args:
-            msg(str): message to log
+            msg(str): message to log, %-formatted with args only if the
+                      level is enabled
+            *args: arguments for msg
+            **kwargs: keyword arguments of logging, e.g. exc_info
 
         Returns:
             None
         """
 
-        return self._logger.response(msg)
+        return self._logger.response(msg, *args, **kwargs)
 
-    def payload(self, msg):
+    def payload(self, msg, *args, **kwargs):
         """
         custom payload log level
 
         Args:
-            msg(str): message to log
+            msg(str): message to log, %-formatted with args only if the
+                      level is enabled
+            *args: arguments for msg
+            **kwargs: keyword arguments of logging, e.g. exc_info
 
         Returns:
             None
         """
 
-        return self._logger.payload(msg)
+        return self._logger.payload(msg, *args, **kwargs)
 
-    def debug(self, msg):
+    def debug(self, msg, *args, **kwargs):
         """
         custom debug log level
 
         Args:
-            msg(str): message to log
+            msg(str): message to log, %-formatted with args only if the
+                      level is enabled
+            *args: arguments for msg
+            **kwargs: keyword arguments of logging, e.g. exc_info
 
         Returns:
             None
         """
 
-        return self._logger.debug(msg)
+        return self._logger.debug(msg, *args, **kwargs)
 
-    def url(self, msg):
+    def url(self, msg, *args, **kwargs):
         """
         custom url log level
 
         Args:
-            msg(str): message to log
+            msg(str): message to log, %-formatted with args only if the
+                      level is enabled
+            *args: arguments for msg
+            **kwargs: keyword arguments of logging, e.g. exc_info
 
         Returns:
             None
         """
 
-        return self._logger.url(msg)
+        return self._logger.url(msg, *args, **kwargs)
 
-    def status(self, msg):
+    def status(self, msg, *args, **kwargs):
         """
         custom status log level
 
         Args:
-            msg(str): message to log
+            msg(str): message to log, %-formatted with args only if the
+                      level is enabled
+            *args: arguments for msg
+            **kwargs: keyword arguments of logging, e.g. exc_info
 
         Returns:
             None
         """
 
-        return self._logger.status(msg)
+        return self._logger.status(msg, *args, **kwargs)
 
-    def info(self, msg):
+    def info(self, msg, *args, **kwargs):
         """
         info log level
 
         Args:
-            msg(str): message to log
+            msg(str): message to log, %-formatted with args only if the
+                      level is enabled
+            *args: arguments for msg
+            **kwargs: keyword arguments of logging, e.g. exc_info
 
         Returns:
             None
         """
 
-        return self._logger.info(msg)
+        return self._logger.info(msg, *args, **kwargs)
 
-    def warning(self, msg):
+    def warning(self, msg, *args, **kwargs):
         """
         warning log level
 
         Args:
-            msg(str): message to log
+            msg(str): message to log, %-formatted with args only if the
+                      level is enabled
+            *args: arguments for msg
+            **kwargs: keyword arguments of logging, e.g. exc_info
 
         Returns:
             None
         """
 
-        return self._logger.warning(msg)
+        return self._logger.warning(msg, *args, **kwargs)
 
-    def error(self, msg):
+    def error(self, msg, *args, **kwargs):
         """
         error log level
 
         Args:
-            msg(str): message to log
+            msg(str): message to log, %-formatted with args only if the
+                      level is enabled
+            *args: arguments for msg
+            **kwargs: keyword arguments of logging, e.g. exc_info
 
         Returns:
             None
         """
 
-        return self._logger.error(msg)
+        return self._logger.error(msg, *args, **kwargs)
 
-    def critical(self, msg):
+    def critical(self, msg, *args, **kwargs):
         """
         error log level
 
         Args:
-            msg(str): message to log
+            msg(str): message to log, %-formatted with args only if the
+                      level is enabled
+            *args: arguments for msg
+            **kwargs: keyword arguments of logging, e.g. exc_info
 
         Returns:
             None
         """
 
-        return self._logger.critical(msg)
+        return self._logger.critical(msg, *args, **kwargs)
 
     def red(self, string):
         """
@@ -226,7 +280,8 @@ class CustomLogger(object):
 
     def __add_custom_levels(self):
         """
-        add new custom level RESPONSE, PAYLOAD, STATUS, URL to logging
+        add new custom level RESPONSE, PAYLOAD, STATUS, URL to logging,
+        logging.Logger is patched only by the first CustomLogger
 
         Args:
             None
@@ -235,10 +290,11 @@ class CustomLogger(object):
             None
         """
 
-        RESPONSE = 5
-        PAYLOAD = 6
-        STATUS = 15
-        URL = 16
+        global _levels_registered
+
+        # patching twice from two threads is harmless, the result is the same
+        if _levels_registered:
+            return
 
         levels = [
             (RESPONSE, "RESPONSE"),
@@ -252,11 +308,12 @@ class CustomLogger(object):
             logging.addLevelName(value, name)
             setattr(logging, name, value)
 
-        def response(self, *args, **kwargs):
+        def response(self, msg, *args, **kwargs):
             """
             new response log level
 
             Args:
+                msg(str): message to log
                 *args: variable arguments
                 **kwargs: variable keyword arguments
 
@@ -264,13 +321,15 @@ class CustomLogger(object):
                 None
             """
 
-            self.log(RESPONSE, *args, **kwargs)
+            if self.isEnabledFor(RESPONSE):
+                self._log(RESPONSE, msg, args, **kwargs)
 
-        def payload(self, *args, **kwargs):
+        def payload(self, msg, *args, **kwargs):
             """
             new payload log level
 
             Args:
+                msg(str): message to log
                 *args: variable arguments
                 **kwargs: variable keyword arguments
 
@@ -278,13 +337,15 @@ class CustomLogger(object):
                 None
             """
 
-            self.log(PAYLOAD, *args, **kwargs)
+            if self.isEnabledFor(PAYLOAD):
+                self._log(PAYLOAD, msg, args, **kwargs)
 
-        def url(self, *args, **kwargs):
+        def url(self, msg, *args, **kwargs):
             """
             new url log level
 
             Args:
+                msg(str): message to log
                 *args: variable arguments
                 **kwargs: variable keyword arguments
 
@@ -292,13 +353,15 @@ class CustomLogger(object):
                 None
             """
 
-            self.log(URL, *args, **kwargs)
+            if self.isEnabledFor(URL):
+                self._log(URL, msg, args, **kwargs)
 
-        def status(self, *args, **kwargs):
+        def status(self, msg, *args, **kwargs):
             """
             new status log level
 
             Args:
+                msg(str): message to log
                 *args: variable arguments
                 **kwargs: variable keyword arguments
 
@@ -306,24 +369,56 @@ class CustomLogger(object):
                 None
             """
 
-            self.log(STATUS, *args, **kwargs)
+            if self.isEnabledFor(STATUS):
+                self._log(STATUS, msg, args, **kwargs)
 
         logging.Logger.response = response
         logging.Logger.payload = payload
         logging.Logger.url = url
         logging.Logger.status = status
 
-    def __add_custom_formatter(self):
+        _levels_registered = True
+
+    def __color(self, string, color):
         """
-        add ColorFormatter with custom colors for each log level
+        set specified color string
 
         Args:
-            None
+            string(str): string to be color colded
+            color(str): color to be set
 
-        Returns
-            None
+        Returns:
+            ascii colored string
         """
 
+        if not isinstance(string, str):
+            string = str(string)
+        COLOR = "\033[0;{}".format(color)
+        NC = "\033[0m"
+        return COLOR + string + NC
+
+
+def _get_console_handler():
+    """
+    build the shared console handler with ColorFormatter and custom colors
+    for each log level, on first use
+
+    Args:
+        None
+
+    Returns:
+        (logging.StreamHandler) console handler
+    """
+
+    global _console_handler
+
+    with _lock:
+        if _console_handler is not None:
+            return _console_handler
+
+        # imported here so importing this module stays cheap
+        from colorlog import ColoredFormatter
+
         fmt = (
             "\n[%(asctime)s %(name)s "
             "[%(log_color)s%(levelname)s%(reset)s] %(message)s"
@@ -347,22 +442,90 @@ class CustomLogger(object):
         )
 
         # add formatter to console handler
-        self._ch.setFormatter(formatter)
+        _console_handler = logging.StreamHandler()
+        _console_handler.setFormatter(formatter)
+        return _console_handler
 
-    def __color(self, string, color):
-        """
-        set specified color string
 
-        Args:
-            string(str): string to be color colded
-            color(str): color to be set
+def _get_logger(name):
+    """
+    get logger with the active handler attached, exactly once per name
 
-        Returns:
-            ascii colored string
-        """
+    Args:
+        name(str): name of the module/logger
 
-        if not isinstance(string, str):
-            string = str(string)
-        COLOR = "\033[0;{}".format(color)
-        NC = "\033[0m"
-        return COLOR + string + NC
+    Returns:
+        (logging.Logger) logger
+    """
+
+    with _lock:
+        logger = _loggers.get(name)
+        if logger is None:
+            logger = logging.getLogger(name)
+            logger.addHandler(_queue_handler or _get_console_handler())
+            logger.setLevel(DEFAULT_LOG_LEVEL)
+            _loggers[name] = logger
+        return logger
+
+
+def _swap_handlers(old, new):
+    for logger in _loggers.values():
+        logger.removeHandler(old)
+        logger.addHandler(new)
+
+
+def enable_async_logging():
+    """
+    move formatting and writing of log records to a background thread.
+
+    Loggers then only put records on a queue, a QueueListener thread formats
+    them with the colored console formatter and writes them out. Pending
+    records are flushed by disable_async_logging(), which also runs at exit.
+
+    Args:
+        None
+
+    Returns:
+        None
+    """
+
+    global _queue_handler, _queue_listener, _atexit_registered
+
+    with _lock:
+        if _queue_listener is not None:
+            return
+        console_handler = _get_console_handler()
+        records = queue.Queue()
+        _queue_handler = logging.handlers.QueueHandler(records)
+        _queue_listener = logging.handlers.QueueListener(
+            records, console_handler, respect_handler_level=True
+        )
+        _queue_listener.start()
+        _swap_handlers(console_handler, _queue_handler)
+        if not _atexit_registered:
+            atexit.register(disable_async_logging)
+            _atexit_registered = True
+
+
+def disable_async_logging():
+    """
+    log synchronously again, after writing out queued records
+
+    Args:
+        None
+
+    Returns:
+        None
+    """
+
+    global _queue_handler, _queue_listener
+
+    with _lock:
+        if _queue_listener is None:
+            return
+        _swap_handlers(_queue_handler, _get_console_handler())
+        listener = _queue_listener
+        _queue_handler = _queue_listener = None
+
+    # stop() handles every record queued so far before it returns
+    listener.stop()
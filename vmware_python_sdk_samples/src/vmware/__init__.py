@@ -1 +1,44 @@
-from .vmware import VMware, VMwareError
+# -*- coding: utf-8 -*-
+"""
+Public names are imported on first access, see the package __init__.
+"""
+
+import importlib
+
+# public name -> submodule that defines it
+_LAZY_ATTRS = {
+    "VMware": ".vmware",
+    "VMwareError": ".vmware",
+    "TaskTimeoutError": ".vmware",
+    "ReconfigConflictError": ".coalescer",
+    "VMwarePool": ".pool",
+    "TaskHandle": ".task_watcher",
+    "wait_all": ".task_watcher",
+    "enable_instrumentation": ".instrumentation",
+    "disable_instrumentation": ".instrumentation",
+    "InMemoryMetrics": ".instrumentation",
+    "MetricsSink": ".instrumentation",
+    "soap_budget": ".instrumentation",
+    "SoapBudgetExceeded": ".instrumentation",
+    "SoapRecorder": ".transport",
+    "SoapReplayer": ".transport",
+    "ReplayError": ".transport",
+}
+
+__all__ = sorted(_LAZY_ATTRS)
+
+
+def __getattr__(name):
+    module = _LAZY_ATTRS.get(name)
+    if module is None:
+        raise AttributeError(
+            "module {0!r} has no attribute {1!r}".format(__name__, name)
+        )
+    value = getattr(importlib.import_module(module, __name__), name)
+    # cache it, later lookups no longer go through __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
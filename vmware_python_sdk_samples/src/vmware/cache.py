@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Small in-process caches used by the vmware helpers"""
+
+import threading
+import time
+
+
+class TTLCache(object):
+    """
+    Thread safe key/value cache where every entry expires after a fixed ttl.
+
+    A ttl of None keeps entries until they are explicitly invalidated, a ttl
+    of 0 disables caching altogether.
+    """
+
+    def __init__(self, ttl=None):
+        """
+        Build an empty cache
+        Args:
+            ttl (int|float): seconds an entry stays valid
+        """
+        self.ttl = ttl
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Return cached value for key
+        Args:
+            key (hashable): cache key
+            default (object): value returned on a miss or an expired entry
+        Returns:
+            cached value or default
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key, value):
+        """
+        Store value for key
+        Args:
+            key (hashable): cache key
+            value (object): value to cache
+        Returns:
+            None
+        """
+        if self.ttl == 0:
+            return
+        expires_at = None
+        if self.ttl is not None:
+            expires_at = time.time() + self.ttl
+        with self._lock:
+            self._data[key] = (value, expires_at)
+
+    def invalidate(self, key=None):
+        """
+        Drop a single entry, or every entry when key is None
+        Args:
+            key (hashable): cache key to drop
+        Returns:
+            None
+        """
+        with self._lock:
+            if key is None:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
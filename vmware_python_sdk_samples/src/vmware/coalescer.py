@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+"""Coalescing of concurrent reconfigure requests for the same vm"""
+
+import copy
+import functools
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+from .disk_slots import DiskSlots
+from .disk_slots import controller_adapter
+from ..logger import CustomLogger
+from pyVmomi import vim
+
+LOG = CustomLogger(__name__)
+
+# Seconds fragments for one vm are collected before they are submitted.
+DEFAULT_COALESCE_WINDOW = 0.05
+
+
+class ReconfigConflictError(Exception):
+    """A config spec fragment conflicts with one queued before it"""
+
+    pass
+
+
+class _VMBatches(object):
+    __slots__ = ("vm", "pending", "timer", "running")
+
+    def __init__(self, vm):
+        self.vm = vm
+        self.pending = []
+        self.timer = None
+        self.running = False
+
+
+class ReconfigCoalescer(object):
+    """
+    Merges config spec fragments for the same vm into one ReconfigVM_Task.
+
+    Fragments submitted for a vm within window seconds of the first one are
+    merged into a single spec and submitted as one task, whose outcome is
+    fanned out to the future of every fragment. While a task for a vm is
+    running, new fragments wait for the next batch so vCenter does not
+    reject them with TaskInProgress.
+
+    Fragments are merged in arrival order. A fragment that sets a field to
+    a different value than an earlier fragment of the batch, or touches a
+    device an earlier fragment already edits or removes, is rejected with
+    ReconfigConflictError and the earlier fragment is kept.
+
+    Fragments are built from the same snapshot of the devices, so two that
+    add disks or controllers pick the same unit or bus. The devices of the
+    later fragment are then moved to free slots, allocated with DiskSlots
+    from the devices read_devices returns. Without read_devices, or without
+    a free slot left, the fragment is rejected with ReconfigConflictError.
+    """
+
+    def __init__(self, watcher, window=DEFAULT_COALESCE_WINDOW, read_devices=None):
+        """
+        Build a coalescer
+        Args:
+            watcher (TaskWatcher) : watcher following the submitted tasks
+            window (float) : seconds fragments are collected per vm
+            read_devices (callable) : returns config.hardware.device of a vm,
+                        only called for batches with colliding slots
+        """
+        self.watcher = watcher
+        self.window = window
+        self.read_devices = read_devices
+        self.submitted_fragments = 0
+        self.submitted_tasks = 0
+        self._vms = {}
+        self._lock = threading.Lock()
+        # notified whenever a vm has no batch left
+        self._idle = threading.Condition(self._lock)
+        self._closed = False
+
+    def submit(self, vm, spec):
+        """
+        Queue a config spec fragment for vm
+        Args:
+            vm (vim.VirtualMachine) : vm to reconfigure
+            spec (vim.vm.ConfigSpec) : fragment to apply
+        Returns:
+            (concurrent.futures.Future) resolved with True once the merged
+            task succeeded, failed with the task fault or ReconfigConflictError
+        Raises: RuntimeError if the coalescer is closed
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Reconfig coalescer is closed")
+            key = str(vm)
+            batches = self._vms.get(key)
+            if batches is None:
+                batches = self._vms[key] = _VMBatches(vm)
+            batches.pending.append((spec, future))
+            self.submitted_fragments += 1
+            if batches.timer is None and not batches.running:
+                batches.timer = threading.Timer(self.window, self._flush, (key,))
+                batches.timer.daemon = True
+                batches.timer.start()
+        return future
+
+    def close(self, timeout=None):
+        """
+        Stop taking fragments, submit the pending batches right away and
+        wait for their tasks, so no timer fires after the watcher stopped
+        Args:
+            timeout (float) : seconds to wait for the batches, None to wait
+                        until they are done
+        Returns:
+            (bool) True if every batch is done, False on timeout
+        """
+        deadline = None if timeout is None else time.time() + timeout
+
+        def _remaining():
+            if deadline is None:
+                return None
+            return max(0, deadline - time.time())
+
+        with self._lock:
+            self._closed = True
+            timers = [
+                batches.timer
+                for batches in self._vms.values()
+                if batches.timer is not None
+            ]
+        for timer in timers:
+            timer.cancel()
+        # a timer that fired already flushes its batch, wait for it
+        for timer in timers:
+            timer.join(_remaining())
+
+        with self._lock:
+            keys = [
+                key
+                for key, batches in self._vms.items()
+                if batches.pending and batches.timer is not None
+            ]
+            for key in keys:
+                self._vms[key].timer = None
+        for key in keys:
+            self._flush(key)
+
+        with self._lock:
+            return self._idle.wait_for(lambda: not self._vms, _remaining())
+
+    def stats(self):
+        """
+        Returns coalescing counters
+        Returns:
+            (dict) submitted fragments, submitted tasks and vms with a batch
+        """
+        with self._lock:
+            return {
+                "fragments": self.submitted_fragments,
+                "tasks": self.submitted_tasks,
+                "vms": len(self._vms),
+            }
+
+    def _flush(self, key):
+        with self._lock:
+            batches = self._vms[key]
+            batches.timer = None
+            fragments, batches.pending = batches.pending, []
+            if not fragments:
+                self._forget(key)
+                return
+            batches.running = True
+            self.submitted_tasks += 1
+
+        accepted = []
+        merged = vim.vm.ConfigSpec()
+        read_devices = None
+        if self.read_devices is not None:
+            read_devices = functools.partial(self.read_devices, batches.vm)
+        merger = _SpecMerger(merged, read_devices)
+        for spec, future in fragments:
+            try:
+                merger.merge(spec)
+            except ReconfigConflictError as ex:
+                future.set_exception(ex)
+                continue
+            accepted.append(future)
+
+        if not accepted:
+            self._done(key)
+            return
+        try:
+            task = batches.vm.ReconfigVM_Task(merged)
+        except Exception as ex:
+            LOG.error("Coalesced reconfigure of %s failed: %s", key, ex)
+            for future in accepted:
+                future.set_exception(ex)
+            self._done(key)
+            return
+
+        def _fan_out(task_future):
+            ex = task_future.exception()
+            for future in accepted:
+                if ex is None:
+                    future.set_result(True)
+                else:
+                    future.set_exception(ex)
+            self._done(key)
+
+        self.watcher.watch(task).add_done_callback(_fan_out)
+
+    def _done(self, key):
+        with self._lock:
+            batches = self._vms[key]
+            batches.running = False
+            if not batches.pending:
+                self._forget(key)
+                return
+        # fragments queued while the task ran go out right away
+        self._flush(key)
+
+    def _forget(self, key):
+        # called with the lock held
+        del self._vms[key]
+        if not self._vms:
+            self._idle.notify_all()
+
+
+class _SpecMerger(object):
+    """Folds config spec fragments into one spec, rejecting conflicts"""
+
+    def __init__(self, merged, read_devices=None):
+        """
+        Args:
+            merged (vim.vm.ConfigSpec) : spec the fragments are merged into
+            read_devices (callable) : returns the current devices of the vm,
+                        to move added devices off slots taken by an earlier
+                        fragment, such collisions are rejected if None
+        """
+        self.merged = merged
+        self.read_devices = read_devices
+        self._devices = None
+        self._touched_devices = {}
+        # (controller key, unit) and (adapter, bus) taken by added devices
+        self._units = set()
+        self._buses = set()
+        self._new_keys = itertools.count(-1, -1)
+
+    def merge(self, spec):
+        # validate everything first so a rejected fragment leaves no trace
+        scalars = []
+        lists = []
+        for prop in spec._GetPropertyList():
+            name = prop.name
+            value = getattr(spec, name)
+            if value is None or (isinstance(value, list) and not value):
+                continue
+            if name == "deviceChange":
+                continue
+            if isinstance(value, list):
+                lists.append((name, value))
+                self._check_list(name, value)
+            else:
+                current = getattr(self.merged, name)
+                if current is not None and current != value:
+                    raise ReconfigConflictError(
+                        "Conflicting values for {0}: {1!r} and {2!r}".format(
+                            name, current, value
+                        )
+                    )
+                scalars.append((name, value))
+
+        for change in spec.deviceChange:
+            key = change.device.key if change.device else None
+            if key is not None and key > 0 and key in self._touched_devices:
+                raise ReconfigConflictError(
+                    "Device {0} is changed by more than one request".format(key)
+                )
+
+        # keys and slots are rewritten on copies, a rejected fragment goes
+        # back to its caller as it came
+        changes = self._remap_keys(
+            [self._copy_change(change) for change in spec.deviceChange]
+        )
+        changes = self._place_added_devices(changes)
+
+        for name, value in scalars:
+            setattr(self.merged, name, value)
+        for name, value in lists:
+            getattr(self.merged, name).extend(value)
+        for change in changes:
+            device = change.device
+            if device is not None and device.key is not None and device.key > 0:
+                self._touched_devices[device.key] = change
+            if change.operation == "add":
+                self._take(device)
+            self.merged.deviceChange.append(change)
+
+    def _check_list(self, name, value):
+        # entries with a key, e.g. extraConfig options, conflict on the key
+        current = dict(
+            (item.key, item)
+            for item in getattr(self.merged, name)
+            if getattr(item, "key", None) is not None
+        )
+        for item in value:
+            other = current.get(getattr(item, "key", None))
+            if other is not None and getattr(other, "value", other) != getattr(
+                item, "value", item
+            ):
+                raise ReconfigConflictError(
+                    "Conflicting values for {0} {1}".format(name, item.key)
+                )
+
+    @staticmethod
+    def _copy_change(change):
+        change = copy.copy(change)
+        if change.device is not None:
+            change.device = copy.copy(change.device)
+        return change
+
+    def _remap_keys(self, changes):
+        # devices added by different fragments may reuse temporary keys,
+        # give every new device a key that is unique within the merged spec
+        remap = {}
+        for change in changes:
+            device = change.device
+            if device is not None and device.key is not None and device.key < 0:
+                remap[device.key] = next(self._new_keys)
+        for change in changes:
+            device = change.device
+            if device is None:
+                continue
+            if device.key is None or device.key <= 0:
+                if device.key in remap:
+                    device.key = remap[device.key]
+                else:
+                    device.key = next(self._new_keys)
+            if device.controllerKey in remap:
+                device.controllerKey = remap[device.controllerKey]
+        return list(changes)
+
+    @staticmethod
+    def _slot(device):
+        """
+        Returns the slot an added device takes, (adapter, bus) for a disk
+        controller, (controller key, unit) for a device on a controller that
+        exists, None for devices on added controllers or placed by vCenter
+        """
+        if device is None:
+            return None
+        adapter = controller_adapter(device)
+        if adapter is not None:
+            if device.busNumber is None:
+                return None
+            return (adapter, device.busNumber)
+        if isinstance(device, vim.vm.device.VirtualController):
+            return None
+        if device.controllerKey is None or device.unitNumber is None:
+            return None
+        if device.controllerKey < 0:
+            # keys of added controllers are unique within the merged spec
+            return None
+        return (device.controllerKey, device.unitNumber)
+
+    def _taken(self, device):
+        slot = self._slot(device)
+        return slot is not None and (slot in self._units or slot in self._buses)
+
+    def _take(self, device):
+        slot = self._slot(device)
+        if slot is None:
+            return
+        if controller_adapter(device) is not None:
+            self._buses.add(slot)
+        else:
+            self._units.add(slot)
+
+    def _place_added_devices(self, changes):
+        """
+        Move added devices off the units and buses earlier fragments took
+        Args:
+            changes (list) : device changes of a fragment, keys remapped
+        Returns:
+            (list) the changes to merge, with specs of added controllers
+        Raises: ReconfigConflictError if the devices can not be moved
+        """
+        added = [
+            change.device
+            for change in changes
+            if change.operation == "add" and change.device is not None
+        ]
+        # devices are compared by identity, data objects compare by value
+        moved_controllers = dict(
+            (id(device), device)
+            for device in added
+            if controller_adapter(device) is not None and self._taken(device)
+        )
+        dropped = dict(
+            (device.key, controller_adapter(device))
+            for device in moved_controllers.values()
+        )
+        moved = dict(
+            (id(device), device)
+            for device in added
+            if id(device) not in moved_controllers
+            and (self._taken(device) or device.controllerKey in dropped)
+        )
+        if not moved_controllers and not moved:
+            return changes
+        if self.read_devices is None:
+            raise ReconfigConflictError(
+                "Devices are added to slots another request takes already"
+            )
+
+        if self._devices is None:
+            self._devices = list(self.read_devices() or [])
+        pending = [
+            change.device
+            for change in list(self.merged.deviceChange) + changes
+            if change.operation == "add"
+            and change.device is not None
+            and id(change.device) not in moved_controllers
+            and id(change.device) not in moved
+        ]
+        slots = DiskSlots(self._devices + pending, self._new_keys)
+        for device in moved.values():
+            adapter = slots.adapter_of(device.controllerKey) or dropped.get(
+                device.controllerKey
+            )
+            slot = slots.allocate(adapter) if adapter is not None else None
+            if slot is None:
+                raise ReconfigConflictError(
+                    "No free slot left for device {0}".format(device.key)
+                )
+            device.controllerKey, device.unitNumber = slot
+        kept = [
+            change
+            for change in changes
+            if change.device is None or id(change.device) not in moved_controllers
+        ]
+        # added controllers go first, the moved devices refer to their keys
+        return slots.controller_specs + kept
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""Free disk slots of a vm, per controller"""
+
+import itertools
+
+from ..constants import VMWARE
+from pyVmomi import vim
+
+# Controllers added once the existing ones of an adapter are full. pyVmomi
+# creates vim types on first attribute access, hence the builders. A vm has
+# its IDE controllers from the start, they cannot be added.
+_NEW_CONTROLLER_BUILDERS = {
+    VMWARE.DISKADAPTER.SCSI: lambda: vim.vm.device.ParaVirtualSCSIController(),
+    VMWARE.DISKADAPTER.SATA: lambda: vim.vm.device.VirtualAHCIController(),
+}
+
+# Controller types per adapter, for controllers that are still to be added
+# and have no key of the adapter's range yet
+_CONTROLLER_TYPES = {
+    VMWARE.DISKADAPTER.SCSI: lambda: vim.vm.device.VirtualSCSIController,
+    VMWARE.DISKADAPTER.SATA: lambda: vim.vm.device.VirtualSATAController,
+    VMWARE.DISKADAPTER.IDE: lambda: vim.vm.device.VirtualIDEController,
+}
+
+
+def controller_adapter(device):
+    """
+    Returns the adapter of a disk controller
+    Args:
+        device (vim.vm.device.VirtualDevice) : device of a vm, or one added
+                    by a pending spec with a temporary negative key
+    Returns:
+        (str) one of VMWARE.DISKADAPTER, None if device is no disk controller
+    """
+    if not isinstance(device, vim.vm.device.VirtualController):
+        return None
+    if device.key is not None and device.key < 0:
+        for adapter, controller_type in _CONTROLLER_TYPES.items():
+            if isinstance(device, controller_type()):
+                return adapter
+        return None
+    for adapter, limits in VMWARE.CONTROLLER_DEVICE.items():
+        base = limits["controllerDeviceKeyBase"]
+        if base <= device.key < base + limits["maxController"]:
+            return adapter
+    return None
+
+
+class _Controller(object):
+    """Bitmap of the units taken on one disk controller"""
+
+    __slots__ = ("key", "bus", "units", "used")
+
+    def __init__(self, key, bus, units, reserved=None):
+        self.key = key
+        self.bus = bus
+        self.units = units
+        self.used = 0
+        if reserved is not None:
+            self.take(reserved)
+
+    def take(self, unit):
+        self.used |= 1 << unit
+
+    def take_free(self):
+        """
+        Take the lowest free unit
+        Returns: (int) unit number, None if the controller is full
+        """
+        for unit in range(self.units):
+            if not self.used & (1 << unit):
+                self.take(unit)
+                return unit
+        return None
+
+
+class DiskSlots(object):
+    """
+    Free unit numbers on the SCSI, SATA and IDE controllers of a vm.
+
+    A single pass over the devices of the vm finds the controllers by their
+    key, controllerDeviceKeyBase up to maxController keys above it, and marks
+    the units of the devices attached to them. Devices of a pending spec,
+    with temporary negative keys, can be passed along and count as taken.
+    Slots are handed out lowest bus and unit first. Once all controllers of an
+    adapter are full a new one is added while maxController allows it, the
+    specs adding controllers are kept in controller_specs. maxDevicesPerVm
+    bounds the devices per adapter.
+    """
+
+    def __init__(self, devices, new_keys=None):
+        """
+        Scan the devices of a vm
+        Args:
+            devices (list) : config.hardware.device of the vm, and the
+                        devices a pending spec adds
+            new_keys (iterator) : temporary keys of added controllers
+        """
+        self.new_keys = new_keys if new_keys is not None else itertools.count(-1, -1)
+        self.controller_specs = []
+        self._controllers = dict((adapter, []) for adapter in VMWARE.CONTROLLER_DEVICE)
+        self._devices = dict((adapter, 0) for adapter in VMWARE.CONTROLLER_DEVICE)
+        self._controller_types = {}
+        self._adapters = {}
+
+        by_key = {}
+        attached = []
+        for device in devices:
+            adapter = controller_adapter(device)
+            if adapter is not None:
+                controller = _Controller(
+                    device.key,
+                    device.busNumber,
+                    VMWARE.CONTROLLER_DEVICE[adapter]["maxDevicesPerController"],
+                    self._reserved_unit(device),
+                )
+                self._controllers[adapter].append(controller)
+                self._controller_types.setdefault(adapter, type(device))
+                self._adapters[device.key] = adapter
+                by_key[device.key] = (adapter, controller)
+            elif device.controllerKey is not None and device.unitNumber is not None:
+                attached.append(device)
+        for device in attached:
+            adapter, controller = by_key.get(device.controllerKey, (None, None))
+            if controller is not None:
+                controller.take(device.unitNumber)
+                self._devices[adapter] += 1
+        for controllers in self._controllers.values():
+            # added controllers vCenter still has to place a bus for go last
+            controllers.sort(key=lambda c: (c.bus is None, c.bus or 0))
+
+    def adapter_of(self, controller_key):
+        """
+        Returns the adapter of a scanned or added controller
+        Args:
+            controller_key (int) : key of the controller
+        Returns:
+            (str) one of VMWARE.DISKADAPTER, None if the key is unknown
+        """
+        return self._adapters.get(controller_key)
+
+    @staticmethod
+    def _reserved_unit(device):
+        if not isinstance(device, vim.vm.device.VirtualSCSIController):
+            return None
+        # the SCSI controller takes a unit of its own bus
+        if device.scsiCtlrUnitNumber is not None:
+            return device.scsiCtlrUnitNumber
+        return VMWARE.SCSI_CONTROLLER_DEVICE_UNIT_NUMBER
+
+    def allocate(self, adapter=VMWARE.DISKADAPTER.SCSI):
+        """
+        Take the next free slot of an adapter, adding a controller if needed
+        Args:
+            adapter (str) : one of VMWARE.DISKADAPTER
+        Returns: (tuple) controller key, temporary for an added controller,
+            and unit number, None if the adapter has no slot left
+        """
+        limits = VMWARE.CONTROLLER_DEVICE[adapter]
+        if self._devices[adapter] >= limits["maxDevicesPerVm"]:
+            return None
+        for controller in self._controllers[adapter]:
+            unit = controller.take_free()
+            if unit is not None:
+                break
+        else:
+            controller = self._add_controller(adapter)
+            if controller is None:
+                return None
+            unit = controller.take_free()
+        self._devices[adapter] += 1
+        return controller.key, unit
+
+    def _add_controller(self, adapter):
+        """
+        Add a controller for adapter on its lowest free bus
+        Args:
+            adapter (str) : one of VMWARE.DISKADAPTER
+        Returns: (_Controller) the added controller, None if none can be added
+        """
+        limits = VMWARE.CONTROLLER_DEVICE[adapter]
+        controllers = self._controllers[adapter]
+        builder = _NEW_CONTROLLER_BUILDERS.get(adapter)
+        if builder is None or len(controllers) >= limits["maxController"]:
+            return None
+        buses = set(controller.bus for controller in controllers)
+        bus = min(set(range(limits["maxController"])) - buses)
+
+        existing = self._controller_types.get(adapter)
+        # keep the controller model the vm already uses
+        device = existing() if existing is not None else builder()
+        if isinstance(device, vim.vm.device.VirtualSCSIController):
+            device.sharedBus = vim.vm.device.VirtualSCSIController.Sharing.noSharing
+        device.key = next(self.new_keys)
+        device.busNumber = bus
+        self._adapters[device.key] = adapter
+        self.controller_specs.append(
+            vim.vm.device.VirtualDeviceSpec(
+                device=device, operation=vim.vm.device.VirtualDeviceSpec.Operation.add
+            )
+        )
+
+        controller = _Controller(
+            device.key,
+            bus,
+            limits["maxDevicesPerController"],
+            self._reserved_unit(device),
+        )
+        controllers.append(controller)
+        return controller
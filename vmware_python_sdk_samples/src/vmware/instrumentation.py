@@ -0,0 +1,573 @@
+# -*- coding: utf-8 -*-
+"""SOAP round trip instrumentation of the pyVmomi stub adapter"""
+
+import bisect
+import contextlib
+import functools
+import threading
+import time
+
+from .vmware import VMware
+from ..logger import CustomLogger
+from pyVmomi.SoapAdapter import SoapStubAdapter
+
+LOG = CustomLogger(__name__)
+
+# Upper bounds in seconds of the latency histogram buckets, slower calls land
+# in an extra overflow bucket.
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+# Scope of SOAP calls made outside of any public VMware method, e.g. by the
+# task watcher or vm index threads, or by direct use of pyVmomi objects.
+BACKGROUND_SCOPE = "(background)"
+
+_state = threading.local()
+_lock = threading.Lock()
+_sinks = []
+_originals = []
+
+
+class SoapCall(object):
+    """One SOAP round trip"""
+
+    __slots__ = (
+        "scope",
+        "method",
+        "seconds",
+        "bytes_out",
+        "bytes_in",
+        "failed",
+        "thread",
+    )
+
+    def __init__(self, scope, method):
+        self.scope = scope
+        self.method = method
+        self.seconds = 0.0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.failed = False
+        self.thread = threading.current_thread().ident
+
+    def __repr__(self):
+        return "SoapCall({0!r}, {1!r}, {2:.4f}s)".format(
+            self.scope, self.method, self.seconds
+        )
+
+
+class SoapScope(object):
+    """One call of a public VMware method and the round trips it made"""
+
+    __slots__ = (
+        "name",
+        "seconds",
+        "calls",
+        "bytes_out",
+        "bytes_in",
+        "failed",
+        "thread",
+    )
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.calls = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.failed = False
+        self.thread = threading.current_thread().ident
+
+    def __repr__(self):
+        return "SoapScope({0!r}, {1} calls, {2:.4f}s)".format(
+            self.name, self.calls, self.seconds
+        )
+
+
+class MetricsSink(object):
+    """
+    Receives instrumentation samples.
+
+    Sinks are called on the thread that made the call, so they have to be
+    thread safe and cheap. Override either hook, both do nothing by default.
+    """
+
+    def record_call(self, call):
+        """
+        Called after every SOAP round trip
+        Args:
+            call (SoapCall) : the finished round trip
+        Returns:
+            None
+        """
+        pass
+
+    def record_scope(self, scope):
+        """
+        Called after every outermost public VMware method call
+        Args:
+            scope (SoapScope) : the finished method call
+        Returns:
+            None
+        """
+        pass
+
+
+class LatencyHistogram(object):
+    """Fixed bucket latency histogram"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        Build an empty histogram
+        Args:
+            buckets (tuple) : ascending bucket upper bounds in seconds
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        """
+        Add a sample
+        Args:
+            seconds (float) : observed latency
+        Returns:
+            None
+        """
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percent):
+        """
+        Estimate a percentile
+        Args:
+            percent (float) : percentile, 0 - 100
+        Returns:
+            (float) upper bound of the bucket holding the percentile, the
+            largest sample for the overflow bucket, None without samples
+        """
+        if not self.count:
+            return None
+        rank = percent / 100.0 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                if index < len(self.buckets):
+                    return min(self.buckets[index], self.max)
+                break
+        return self.max
+
+    def as_dict(self):
+        """
+        Returns (dict) count, total, mean, max, p50, p95, p99 and the
+        non empty buckets as [upper bound, count] pairs
+        """
+        bounds = list(self.buckets) + [None]
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else None,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "buckets": [
+                [bound, count] for bound, count in zip(bounds, self.counts) if count
+            ],
+        }
+
+
+class _Totals(object):
+    __slots__ = ("calls", "bytes_out", "bytes_in", "errors", "latency", "methods")
+
+    def __init__(self):
+        self.calls = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.errors = 0
+        self.latency = LatencyHistogram()
+        self.methods = {}
+
+    def add(self, seconds, calls, bytes_out, bytes_in, failed):
+        self.calls += calls
+        self.bytes_out += bytes_out
+        self.bytes_in += bytes_in
+        self.errors += 1 if failed else 0
+        self.latency.observe(seconds)
+
+    def as_dict(self):
+        totals = {
+            "calls": self.calls,
+            "bytes_out": self.bytes_out,
+            "bytes_in": self.bytes_in,
+            "errors": self.errors,
+            "latency": self.latency.as_dict(),
+        }
+        if self.methods:
+            totals["methods"] = dict(self.methods)
+        return totals
+
+
+class InMemoryMetrics(MetricsSink):
+    """
+    Aggregates samples in memory.
+
+    stats() reports per vSphere method ("vsphere") the round trips, bytes
+    and their latency, and per public VMware method ("vmware") the number of
+    invocations, the round trips they made, which vSphere methods those were
+    and the latency of the whole method.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def record_call(self, call):
+        with self._lock:
+            totals = self._vsphere.get(call.method)
+            if totals is None:
+                totals = self._vsphere[call.method] = _Totals()
+            totals.add(call.seconds, 1, call.bytes_out, call.bytes_in, call.failed)
+            scope = self._scope_totals(call.scope or BACKGROUND_SCOPE)
+            scope.methods[call.method] = scope.methods.get(call.method, 0) + 1
+            if call.scope is None:
+                scope.add(call.seconds, 1, call.bytes_out, call.bytes_in, call.failed)
+
+    def record_scope(self, scope):
+        with self._lock:
+            self._scope_totals(scope.name).add(
+                scope.seconds,
+                scope.calls,
+                scope.bytes_out,
+                scope.bytes_in,
+                scope.failed,
+            )
+
+    def stats(self):
+        """
+        Returns aggregated metrics
+        Returns:
+            (dict) "vsphere" and "vmware" totals keyed by method name
+        """
+        with self._lock:
+            vmware = {}
+            for name, totals in self._vmware.items():
+                vmware[name] = totals.as_dict()
+                vmware[name]["invocations"] = totals.latency.count
+            return {
+                "vsphere": dict(
+                    (name, totals.as_dict()) for name, totals in self._vsphere.items()
+                ),
+                "vmware": vmware,
+            }
+
+    def reset(self):
+        """
+        Drop all samples
+        Returns:
+            None
+        """
+        with self._lock:
+            self._vsphere = {}
+            self._vmware = {}
+
+    def _scope_totals(self, name):
+        totals = self._vmware.get(name)
+        if totals is None:
+            totals = self._vmware[name] = _Totals()
+        return totals
+
+
+class SoapBudgetExceeded(AssertionError):
+    """A code path made more SOAP round trips than its budget allows"""
+
+    pass
+
+
+class SoapBudget(MetricsSink, contextlib.ContextDecorator):
+    """
+    Fails a code path that makes more than max_calls SOAP round trips.
+
+    Usable as context manager or decorator, see soap_budget(). Only round
+    trips of the entering thread count unless all_threads is set. The
+    budget is checked when the block exits without an exception of its own,
+    SoapBudgetExceeded then lists the vSphere methods that were called.
+    """
+
+    def __init__(self, max_calls, all_threads=False):
+        """
+        Build a budget, instrumentation is enabled while it is entered
+        Args:
+            max_calls (int) : round trips allowed
+            all_threads (bool) : count round trips of every thread, e.g.
+                        of the task watcher
+        """
+        self.max_calls = max_calls
+        self.all_threads = all_threads
+        self.calls = 0
+        self.methods = {}
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def record_call(self, call):
+        if not self.all_threads and call.thread != self._thread:
+            return
+        with self._lock:
+            self.calls += 1
+            self.methods[call.method] = self.methods.get(call.method, 0) + 1
+
+    def __enter__(self):
+        self.calls = 0
+        self.methods = {}
+        self._thread = threading.current_thread().ident
+        enable_instrumentation(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        disable_instrumentation(self)
+        if exc_type is None and self.calls > self.max_calls:
+            raise SoapBudgetExceeded(
+                "{0} SOAP round trips, budget is {1}: {2}".format(
+                    self.calls,
+                    self.max_calls,
+                    ", ".join(
+                        "{0} x{1}".format(method, count)
+                        for method, count in sorted(self.methods.items())
+                    ),
+                )
+            )
+        return False
+
+    def _recreate_cm(self):
+        # a decorated function gets a fresh budget per call, so concurrent
+        # calls do not share a counter
+        return type(self)(self.max_calls, self.all_threads)
+
+
+def soap_budget(max_calls, all_threads=False):
+    """
+    Limit the SOAP round trips of a block or function, e.g.
+
+        with soap_budget(max_calls=3):
+            vmware.get_vm_in_dc(datacenter_name, vm_id)
+
+        @soap_budget(max_calls=2)
+        def test_update_vcpu(self): ...
+
+    Args:
+        max_calls (int) : round trips allowed
+        all_threads (bool) : count round trips of every thread
+    Returns:
+        (SoapBudget) context manager and decorator, its calls and methods
+        attributes tell what was used
+    Raises: SoapBudgetExceeded on exit when the budget was exceeded
+    """
+    return SoapBudget(max_calls, all_threads)
+
+
+def enable_instrumentation(sink=None):
+    """
+    Start recording SOAP round trips into sink.
+
+    The first enabled sink patches the pyVmomi stub adapter and the public
+    VMware methods, the last disabled one restores them, so nothing is
+    wrapped while instrumentation is off.
+    Args:
+        sink (MetricsSink) : receiver of the samples, a new InMemoryMetrics
+                    if None
+    Returns:
+        (MetricsSink) the enabled sink
+    """
+    if sink is None:
+        sink = InMemoryMetrics()
+    with _lock:
+        if not _sinks:
+            _patch()
+        if sink not in _sinks:
+            _sinks.append(sink)
+    return sink
+
+
+def disable_instrumentation(sink=None):
+    """
+    Stop recording into sink
+    Args:
+        sink (MetricsSink) : sink to remove, every sink if None
+    Returns:
+        None
+    """
+    with _lock:
+        if sink is None:
+            del _sinks[:]
+        elif sink in _sinks:
+            _sinks.remove(sink)
+        if not _sinks and _originals:
+            _unpatch()
+
+
+def _publish(method_name, sample):
+    for sink in list(_sinks):
+        try:
+            getattr(sink, method_name)(sample)
+        except Exception as ex:
+            LOG.warning("Metrics sink %s failed: %s", sink, ex)
+
+
+def _vsphere_method(mo, info, args):
+    mo_type = getattr(type(mo), "_wsdlName", type(mo).__name__)
+    if info.wsdlName == "Fetch" and args:
+        # lazy property access, e.g. vm.config, name the property
+        return "{0}.{1}".format(mo_type, args[0])
+    return "{0}.{1}".format(mo_type, info.wsdlName)
+
+
+def _wrap_invoke_method(original):
+    @functools.wraps(original)
+    def InvokeMethod(stub, mo, info, args, *rest, **kwargs):
+        scope = getattr(_state, "scope", None)
+        call = SoapCall(scope.name if scope else None, _vsphere_method(mo, info, args))
+        outer_call = getattr(_state, "call", None)
+        outer_connections = getattr(_state, "connections", None)
+        _state.call = call
+        connections = _state.connections = []
+        start = time.time()
+        try:
+            return original(stub, mo, info, args, *rest, **kwargs)
+        except Exception:
+            call.failed = True
+            raise
+        finally:
+            call.seconds = time.time() - start
+            # a request failing before getresponse leaves the override on
+            # the connection, drop it so it does not outlive the call
+            for conn in connections:
+                vars(conn).pop("getresponse", None)
+            _state.call = outer_call
+            _state.connections = outer_connections
+            if scope is not None:
+                scope.calls += 1
+                scope.bytes_out += call.bytes_out
+                scope.bytes_in += call.bytes_in
+            _publish("record_call", call)
+
+    return InvokeMethod
+
+
+def _wrap_serialize_request(original):
+    @functools.wraps(original)
+    def SerializeRequest(stub, *args, **kwargs):
+        request = original(stub, *args, **kwargs)
+        call = getattr(_state, "call", None)
+        if call is not None:
+            call.bytes_out += len(request)
+        return request
+
+    return SerializeRequest
+
+
+class _CountingResponse(object):
+    """HTTP response proxy counting the bytes read from it"""
+
+    def __init__(self, response, call):
+        self._response = response
+        self._call = call
+
+    def read(self, *args):
+        data = self._response.read(*args)
+        self._call.bytes_in += len(data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+
+def _wrap_get_connection(original):
+    @functools.wraps(original)
+    def GetConnection(stub, *args, **kwargs):
+        conn = original(stub, *args, **kwargs)
+        call = getattr(_state, "call", None)
+        if call is None:
+            return conn
+
+        def getresponse(*args, **kwargs):
+            # one shot, pooled connections go back to the plain method
+            vars(conn).pop("getresponse", None)
+            return _CountingResponse(conn.getresponse(*args, **kwargs), call)
+
+        conn.getresponse = getresponse
+        _state.connections.append(conn)
+        return conn
+
+    return GetConnection
+
+
+def _wrap_vmware_method(name, original):
+    @functools.wraps(original)
+    def wrapper(*args, **kwargs):
+        if getattr(_state, "scope", None) is not None:
+            # nested public method, counted for the outermost one
+            return original(*args, **kwargs)
+        scope = _state.scope = SoapScope(name)
+        start = time.time()
+        try:
+            return original(*args, **kwargs)
+        except Exception:
+            scope.failed = True
+            raise
+        finally:
+            scope.seconds = time.time() - start
+            _state.scope = None
+            _publish("record_scope", scope)
+
+    return wrapper
+
+
+def _patch():
+    wrappers = [
+        ("InvokeMethod", _wrap_invoke_method),
+        ("SerializeRequest", _wrap_serialize_request),
+        ("GetConnection", _wrap_get_connection),
+    ]
+    for name, wrap in wrappers:
+        # SerializeRequest is inherited, the wrapper shadows it on the class
+        original = getattr(SoapStubAdapter, name, None)
+        if original is None:
+            LOG.debug("SoapStubAdapter has no %s, not instrumented", name)
+            continue
+        _originals.append((SoapStubAdapter, name, vars(SoapStubAdapter).get(name)))
+        setattr(SoapStubAdapter, name, wrap(original))
+
+    for name, original in list(vars(VMware).items()):
+        if name != "__init__" and name.startswith("_"):
+            continue
+        if not callable(original) or isinstance(original, type):
+            continue
+        _originals.append((VMware, name, original))
+        setattr(VMware, name, _wrap_vmware_method(name, original))
+
+
+def _unpatch():
+    while _originals:
+        cls, name, original = _originals.pop()
+        if original is None:
+            delattr(cls, name)
+        else:
+            setattr(cls, name, original)
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""Name -> network index covering standard, opaque and distributed networks"""
+
+import threading
+import time
+
+from . import vmware_utils
+from ..constants import VMWARE
+from pyVmomi import vim
+from pyVmomi import vmodl
+
+# Seconds the network index is trusted before it is rebuilt on lookup.
+DEFAULT_NETWORK_INDEX_TTL = 300
+
+# Seconds after a rebuild during which a missing name is reported as missing
+# instead of triggering yet another rebuild.
+MIN_REBUILD_INTERVAL = 1
+
+
+class NetworkInfo(object):
+    """Everything needed to back a virtual NIC with one network"""
+
+    __slots__ = (
+        "obj",
+        "name",
+        "kind",
+        "opaque_network_id",
+        "opaque_network_type",
+        "switch_uuid",
+        "portgroup_key",
+    )
+
+    def __init__(
+        self,
+        obj,
+        name,
+        kind,
+        opaque_network_id=None,
+        opaque_network_type=None,
+        switch_uuid=None,
+        portgroup_key=None,
+    ):
+        self.obj = obj
+        self.name = name
+        self.kind = kind
+        self.opaque_network_id = opaque_network_id
+        self.opaque_network_type = opaque_network_type
+        self.switch_uuid = switch_uuid
+        self.portgroup_key = portgroup_key
+
+    def __repr__(self):
+        return "NetworkInfo({0!r}, {1!r}, {2!r})".format(self.obj, self.name, self.kind)
+
+
+class NetworkIndex(object):
+    """
+    Resolves network names without touching lazy properties.
+
+    The whole index is filled by one property collector pass over a view of
+    networks and distributed switches: names of all networks, summary of
+    opaque networks, key and switch of distributed port groups and uuid of
+    the switches. It is rebuilt once older than ttl, or when a name is not
+    found, so networks created meanwhile are picked up.
+    """
+
+    def __init__(
+        self,
+        service_instance,
+        view_manager=None,
+        ttl=DEFAULT_NETWORK_INDEX_TTL,
+        content=None,
+    ):
+        """
+        Build an empty network index, it is filled on first lookup
+        Args:
+            service_instance (vim.ServiceInstance) : root object for inventory traversal
+            view_manager (ContainerViewManager) : reuse views from this manager
+            ttl (int) : seconds the index is trusted, None never expires it
+            content (vim.ServiceInstanceContent) : service content read at
+                        connect, read from service_instance if None
+        """
+        self.si = service_instance
+        self.content = content if content is not None else service_instance.content
+        self.view_manager = view_manager
+        self.ttl = ttl
+        self._networks = None
+        self._built_at = None
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        """
+        Return network info for the network called name
+        Args:
+            name (str) : name of the network
+        Returns:
+            (NetworkInfo) network info if found, else None
+        """
+        if not name:
+            return None
+        with self._lock:
+            fresh = self._networks is not None and (
+                self.ttl is None or time.time() - self._built_at < self.ttl
+            )
+            if fresh and name in self._networks:
+                return self._networks[name]
+            if fresh and time.time() - self._built_at < MIN_REBUILD_INTERVAL:
+                # just rebuilt, the network does not exist
+                return None
+            self._build()
+            return self._networks.get(name)
+
+    def invalidate(self):
+        """
+        Drop the index, it is rebuilt on next lookup
+        Returns:
+            None
+        """
+        with self._lock:
+            self._networks = None
+            self._built_at = None
+
+    def _build(self):
+        view = vmware_utils.get_container_view(
+            self.si,
+            obj_type=[vim.Network, vim.DistributedVirtualSwitch],
+            view_manager=self.view_manager,
+        )
+        try:
+            filter_spec = vmware_utils.build_view_filter_spec(
+                view, vim.Network, ["name"]
+            )
+            filter_spec.propSet.extend(
+                [
+                    vmodl.query.PropertyCollector.PropertySpec(
+                        type=vim.OpaqueNetwork, pathSet=["summary"]
+                    ),
+                    vmodl.query.PropertyCollector.PropertySpec(
+                        type=vim.dvs.DistributedVirtualPortgroup,
+                        pathSet=["key", "config.distributedVirtualSwitch"],
+                    ),
+                    vmodl.query.PropertyCollector.PropertySpec(
+                        type=vim.DistributedVirtualSwitch, pathSet=["uuid"]
+                    ),
+                ]
+            )
+
+            collector = self.content.propertyCollector
+            networks = {}
+            switch_uuids = {}
+            portgroups = []
+            for obj in vmware_utils.retrieve_properties_ex(collector, filter_spec):
+                props = dict((prop.name, prop.val) for prop in obj.propSet)
+                if isinstance(obj.obj, vim.DistributedVirtualSwitch):
+                    switch_uuids[str(obj.obj)] = props.get("uuid")
+                    continue
+
+                name = props.get("name")
+                if isinstance(obj.obj, vim.OpaqueNetwork):
+                    summary = props.get("summary")
+                    info = NetworkInfo(
+                        obj.obj,
+                        name,
+                        VMWARE.NETWORKKIND.OPAQUE,
+                        opaque_network_id=summary.opaqueNetworkId,
+                        opaque_network_type=summary.opaqueNetworkType,
+                    )
+                elif isinstance(obj.obj, vim.dvs.DistributedVirtualPortgroup):
+                    info = NetworkInfo(
+                        obj.obj,
+                        name,
+                        VMWARE.NETWORKKIND.PORTGROUP,
+                        portgroup_key=props.get("key"),
+                    )
+                    portgroups.append(
+                        (info, props.get("config.distributedVirtualSwitch"))
+                    )
+                else:
+                    info = NetworkInfo(obj.obj, name, VMWARE.NETWORKKIND.STANDARD)
+                # first network wins on duplicate names, like get_obj
+                networks.setdefault(name, info)
+
+            for info, switch in portgroups:
+                info.switch_uuid = switch_uuids.get(str(switch))
+        finally:
+            if self.view_manager is None:
+                view.Destroy()
+
+        self._networks = networks
+        self._built_at = time.time()
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""Thread safe pool of authenticated VMware sessions"""
+
+import contextlib
+import itertools
+import threading
+import time
+
+from .vmware import VMware, VMwareError
+from ..logger import CustomLogger
+from pyVmomi import vim
+
+LOG = CustomLogger(__name__)
+
+# Sessions kept per (host, user) unless told otherwise.
+DEFAULT_POOL_SIZE = 4
+
+# Seconds a session may sit idle before it is validated on checkout.
+DEFAULT_VALIDATE_AFTER = 60
+
+
+class VMwarePool(object):
+    """
+    Keeps up to size logged in VMware handles for one (host, user).
+
+    Handles are checked out for the duration of a request with connection()
+    or acquire()/release(), so every thread works on a session of its own.
+    A handle that sat idle for validate_after seconds is checked with a
+    CurrentTime() keepalive on checkout; an expired session (NotAuthenticated)
+    is replaced by a fresh login without the caller noticing.
+
+    With a session_cache every handle gets a session slot of its own, so the
+    members never reattach to one shared session.
+    """
+
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+    def __init__(
+        self,
+        hostname,
+        username,
+        password,
+        port=443,
+        size=DEFAULT_POOL_SIZE,
+        validate_after=DEFAULT_VALIDATE_AFTER,
+        **vmware_kwargs
+    ):
+        """
+        Build an empty pool, sessions are logged in on demand
+        Args:
+            hostname (str) : vshpere server name
+            username (str) : username for the vsphere account
+            password (str) : password for the vsphere account
+            port (int) : port to send api requests
+            size (int) : maximum number of sessions
+            validate_after (int) : idle seconds after which a session is
+                        validated on checkout
+            vmware_kwargs : further keyword arguments for VMware
+        """
+        self.hostname = hostname
+        self.username = username
+        self.port = port
+        self.size = size
+        self.validate_after = validate_after
+        self._password = password
+        self._vmware_kwargs = vmware_kwargs
+
+        self._idle = []
+        self._in_use = set()
+        # session cache slots of the logged in handles
+        self._session_slots = set()
+        self._cond = threading.Condition(threading.Lock())
+        self._closed = False
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "logins": 0,
+            "relogins": 0,
+            "validations": 0,
+        }
+
+    @classmethod
+    def get(cls, hostname, username, password, port=443, **kwargs):
+        """
+        Returns the shared pool for (host, user, port), creating it if needed
+        Args:
+            hostname (str) : vshpere server name
+            username (str) : username for the vsphere account
+            password (str) : password for the vsphere account
+            port (int) : port to send api requests
+            kwargs : further keyword arguments for a new pool
+        Returns:
+            (VMwarePool) shared pool
+        """
+        key = (hostname, username, port)
+        with cls._pools_lock:
+            pool = cls._pools.get(key)
+            if pool is None or pool._closed:
+                pool = cls._pools[key] = cls(
+                    hostname, username, password, port=port, **kwargs
+                )
+            return pool
+
+    def acquire(self, timeout=None):
+        """
+        Check out a logged in VMware handle
+        Args:
+            timeout (float) : seconds to wait for a free session, forever if None
+        Returns:
+            (VMware) handle for exclusive use until release()
+        Raises: VMwareError
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise VMwareError("VMware pool is closed")
+                if self._idle:
+                    vmware, idle_since = self._idle.pop()
+                    break
+                if len(self._in_use) < self.size:
+                    vmware, idle_since = None, None
+                    break
+                self._stats["waits"] += 1
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise VMwareError(
+                        "No VMware session for '{0}' available within {1} "
+                        "seconds".format(self.hostname, timeout)
+                    )
+                self._cond.wait(remaining)
+            # reserve the slot before logging in outside of the lock
+            placeholder = object()
+            self._in_use.add(placeholder)
+
+        try:
+            if vmware is None:
+                vmware = self._login()
+            elif time.time() - idle_since >= self.validate_after:
+                vmware = self._validate(vmware)
+        except Exception:
+            with self._cond:
+                self._in_use.discard(placeholder)
+                self._cond.notify()
+            raise
+
+        with self._cond:
+            self._in_use.discard(placeholder)
+            self._in_use.add(vmware)
+            self._stats["checkouts"] += 1
+        return vmware
+
+    def release(self, vmware, discard=False):
+        """
+        Return a checked out handle to the pool
+        Args:
+            vmware (VMware) : handle from acquire()
+            discard (bool) : log the session out instead of reusing it
+        Returns:
+            None
+        """
+        with self._cond:
+            self._in_use.discard(vmware)
+            if not discard and not self._closed:
+                self._idle.append((vmware, time.time()))
+            self._cond.notify()
+        if discard or self._closed:
+            self._logout(vmware)
+
+    @contextlib.contextmanager
+    def connection(self, timeout=None):
+        """
+        Check out a handle for the duration of a with block
+        Args:
+            timeout (float) : seconds to wait for a free session, forever if None
+        Yields:
+            (VMware) logged in handle
+        """
+        vmware = self.acquire(timeout)
+        discard = False
+        try:
+            yield vmware
+        except vim.fault.NotAuthenticated:
+            # the session expired under the caller, do not hand it out again
+            discard = True
+            raise
+        finally:
+            self.release(vmware, discard=discard)
+
+    def stats(self):
+        """
+        Returns pool utilization counters
+        Returns:
+            (dict) size, in_use, idle, utilization and checkout/login counters
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(
+                {
+                    "size": self.size,
+                    "in_use": len(self._in_use),
+                    "idle": len(self._idle),
+                    "utilization": float(len(self._in_use)) / self.size,
+                }
+            )
+            return stats
+
+    def close(self):
+        """
+        Log out idle sessions, sessions in use are logged out on release
+        Returns:
+            None
+        """
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for vmware, _ in idle:
+            self._logout(vmware)
+
+    def _login(self):
+        with self._cond:
+            slot = next(
+                slot for slot in itertools.count() if slot not in self._session_slots
+            )
+            self._session_slots.add(slot)
+        try:
+            vmware = VMware(
+                self.hostname,
+                self.username,
+                self._password,
+                port=self.port,
+                session_slot=slot,
+                **self._vmware_kwargs
+            )
+        except Exception:
+            with self._cond:
+                self._session_slots.discard(slot)
+            raise
+        with self._cond:
+            self._stats["logins"] += 1
+        return vmware
+
+    def _validate(self, vmware):
+        with self._cond:
+            self._stats["validations"] += 1
+        try:
+            vmware.si.CurrentTime()
+            return vmware
+        except vim.fault.NotAuthenticated:
+            LOG.info(
+                "VMware session for '%s' expired, logging in again", self.hostname
+            )
+        except Exception as ex:
+            LOG.warning("VMware session keepalive failed: %s", ex)
+        self._logout(vmware)
+        with self._cond:
+            self._stats["relogins"] += 1
+        return self._login()
+
+    def _logout(self, vmware):
+        try:
+            vmware.disconnect()
+        except Exception as ex:
+            LOG.warning("VMware logout failed: %s", ex)
+        with self._cond:
+            self._session_slots.discard(vmware.session_slot)
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""Hash index from a property value to the managed objects carrying it"""
+
+import threading
+
+from . import vmware_utils
+from pyVmomi import vmodl
+
+
+class PropertyIndex(object):
+    """
+    Maps the value of one property to the managed objects of one type.
+
+    The index is built from a single property collector pass over a container
+    view. With track_updates the pass is a WaitForUpdatesEx snapshot of a
+    filter on a private PropertyCollector, and refresh() then only fetches
+    the changes since the last seen version. Without it the pass is a paged
+    RetrievePropertiesEx and refresh() rebuilds the index.
+
+    Several objects may share a value, lookups therefore return lists. Array
+    valued properties index the object once under each element.
+    """
+
+    def __init__(
+        self,
+        service_instance,
+        obj_type,
+        prop,
+        container=None,
+        track_updates=True,
+        content=None,
+    ):
+        """
+        Build an empty index, call build() or refresh() to fill it
+        Args:
+            service_instance (vim.ServiceInstance) : root object for inventory traversal
+            obj_type (vim.*) : type of managed object to index
+            prop (str) : name of the property to index
+            container (vim.ManagedEntity) : The object that the view presents
+            track_updates (bool) : refresh incrementally with WaitForUpdatesEx
+            content (vim.ServiceInstanceContent) : service content read at
+                        connect, read from service_instance if None
+        """
+        self.si = service_instance
+        self.content = content if content is not None else service_instance.content
+        self.obj_type = obj_type
+        self.prop = prop
+        self.container = container
+        self.track_updates = track_updates
+        self.version = None
+
+        self._objs_by_value = {}
+        self._values_by_obj = {}
+        self._view = None
+        self._collector = None
+        self._filter = None
+        self._lock = threading.Lock()
+
+    def build(self):
+        """
+        (Re)build the whole index from the server
+        Returns:
+            None
+        """
+        with self._lock:
+            self._objs_by_value = {}
+            self._values_by_obj = {}
+            if self._view is None:
+                self._view = vmware_utils.get_container_view(
+                    self.si,
+                    obj_type=[self.obj_type],
+                    container=self.container,
+                    content=self.content,
+                )
+            filter_spec = vmware_utils.build_view_filter_spec(
+                self._view, self.obj_type, [self.prop]
+            )
+
+            if not self.track_updates:
+                collector = self.content.propertyCollector
+                for obj in vmware_utils.retrieve_properties_ex(collector, filter_spec):
+                    for prop in obj.propSet:
+                        self._set(obj.obj, prop.val)
+                self.version = None
+                return
+
+            if self._collector is None:
+                self._collector = (
+                    self.content.propertyCollector.CreatePropertyCollector()
+                )
+            if self._filter is not None:
+                self._filter.Destroy()
+            self._filter = self._collector.CreateFilter(filter_spec, True)
+            self.version = ""
+            self._poll()
+
+    def refresh(self):
+        """
+        Bring the index up to date, incrementally when updates are tracked
+        Returns:
+            None
+        """
+        if not self.track_updates or self.version is None:
+            return self.build()
+        with self._lock:
+            self._poll()
+
+    def get(self, value):
+        """
+        Return the managed objects whose property equals value
+        Args:
+            value (object) : property value to look up
+        Returns:
+            (list) matching managed objects, empty if none
+        """
+        with self._lock:
+            return list(self._objs_by_value.get(value, ()))
+
+    def close(self):
+        """
+        Destroy the server side filter, collector and view
+        Returns:
+            None
+        """
+        with self._lock:
+            for obj in (self._filter, self._collector, self._view):
+                if obj is None:
+                    continue
+                try:
+                    obj.Destroy()
+                except Exception:
+                    pass
+            self._filter = self._collector = self._view = None
+            self.version = None
+            self._objs_by_value = {}
+            self._values_by_obj = {}
+
+    def __len__(self):
+        return len(self._values_by_obj)
+
+    def _poll(self):
+        # maxWaitSeconds=0 returns right away, with None if nothing changed
+        options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=0)
+        while True:
+            update = self._collector.WaitForUpdatesEx(self.version, options)
+            if update is None:
+                return
+            for filter_set in update.filterSet:
+                for obj_update in filter_set.objectSet:
+                    if obj_update.kind == "leave":
+                        self._unset(obj_update.obj)
+                        continue
+                    for change in obj_update.changeSet:
+                        if change.name != self.prop:
+                            continue
+                        if change.op in ("remove", "indirectRemove"):
+                            self._unset(obj_update.obj)
+                        else:
+                            self._set(obj_update.obj, change.val)
+            self.version = update.version
+            if not update.truncated:
+                return
+
+    def _set(self, obj, value):
+        self._unset(obj)
+        values = value if isinstance(value, list) else [value]
+        key = str(obj)
+        keys = []
+        for val in values:
+            try:
+                self._objs_by_value.setdefault(val, []).append(obj)
+            except TypeError:
+                # unhashable values can not be looked up anyway
+                continue
+            keys.append(val)
+        self._values_by_obj[key] = keys
+
+    def _unset(self, obj):
+        key = str(obj)
+        for val in self._values_by_obj.pop(key, ()):
+            objs = [o for o in self._objs_by_value.get(val, ()) if str(o) != key]
+            if objs:
+                self._objs_by_value[val] = objs
+            else:
+                self._objs_by_value.pop(val, None)
+
+
+class PropertyIndexes(object):
+    """
+    The PropertyIndex of every (type, property, container) looked up through
+    one connection. An index is built on first use and refreshed on every
+    later one, close() destroys their server side objects, so the owner of
+    the connection closes them before it logs out.
+    """
+
+    def __init__(self, service_instance, content=None):
+        """
+        Build an empty set of indexes
+        Args:
+            service_instance (vim.ServiceInstance) : connection the indexes
+                        query
+            content (vim.ServiceInstanceContent) : service content read at
+                        connect, read from service_instance if None
+        """
+        self.si = service_instance
+        self.content = content if content is not None else service_instance.content
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def get(self, obj_type, prop, container=None):
+        """
+        Returns the up to date index of a property
+        Args:
+            obj_type (vim.*) : type of managed object
+            prop (str) : name of the property
+            container (vim.ManagedEntity) : The object that the view presents
+        Returns:
+            (PropertyIndex) the index
+        """
+        key = (obj_type, prop, str(container))
+        with self._lock:
+            index = self._indexes.get(key)
+            built = index is not None
+            if not built:
+                index = self._indexes[key] = PropertyIndex(
+                    self.si, obj_type, prop, container, content=self.content
+                )
+        if built:
+            index.refresh()
+        else:
+            index.build()
+        return index
+
+    def close(self):
+        """
+        Destroy every index
+        Returns:
+            None
+        """
+        with self._lock:
+            indexes, self._indexes = self._indexes, {}
+        for index in indexes.values():
+            index.close()
+
+    def __len__(self):
+        return len(self._indexes)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""On disk cache of vSphere session cookies"""
+
+import binascii
+import hashlib
+import hmac
+import json
+import os
+import stat
+import threading
+
+from ..logger import CustomLogger
+
+LOG = CustomLogger(__name__)
+
+DEFAULT_SESSION_CACHE_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "vmware_python_sdk_samples", "sessions.json"
+)
+
+# PBKDF2 rounds of the password check stored with a cookie
+PASSWORD_HASH_ITERATIONS = 100000
+
+
+class SessionCache(object):
+    """
+    Stores the vmware_soap_session cookie per (host, port, user, slot).
+
+    A cookie is only handed out for the password it was created with, checked
+    against a salted PBKDF2 hash stored next to it, passwords are never
+    written. Handles that must not share a session, e.g. the members of a
+    VMwarePool, use a slot each.
+
+    The cookie grants the same access as the password, the cache file is
+    therefore only ever readable and writable by its owner (0600, in a 0700
+    directory). A directory other users can access is refused, nothing is
+    read from or written to it.
+    """
+
+    def __init__(self, path=DEFAULT_SESSION_CACHE_PATH):
+        """
+        Build a session cache backed by path
+        Args:
+            path (str) : location of the cache file
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def get(self, hostname, port, username, password, slot=None):
+        """
+        Returns cached session cookie
+        Args:
+            hostname (str) : vshpere server name
+            port (int) : port to send api requests
+            username (str) : username for the vsphere account
+            password (str) : password for the vsphere account
+            slot (int) : slot of the session, None for a single session
+        Returns:
+            (str) cookie, None if not cached for this password
+        """
+        with self._lock:
+            entry = self._read().get(self._key(hostname, port, username, slot))
+        if not entry or "salt" not in entry or "password_hash" not in entry:
+            return None
+        password_hash = self._hash(password, entry["salt"])
+        if not hmac.compare_digest(password_hash, entry["password_hash"]):
+            return None
+        return entry.get("cookie")
+
+    def set(self, hostname, port, username, password, cookie, slot=None):
+        """
+        Cache a session cookie
+        Args:
+            hostname (str) : vshpere server name
+            port (int) : port to send api requests
+            username (str) : username for the vsphere account
+            password (str) : password the session was created with
+            cookie (str) : vmware_soap_session cookie of the session
+            slot (int) : slot of the session, None for a single session
+        Returns:
+            None
+        """
+        salt = binascii.hexlify(os.urandom(16)).decode("ascii")
+        entry = {
+            "cookie": cookie,
+            "salt": salt,
+            "password_hash": self._hash(password, salt),
+        }
+        with self._lock:
+            sessions = self._read()
+            sessions[self._key(hostname, port, username, slot)] = entry
+            self._write(sessions)
+
+    def invalidate(self, hostname, port, username, slot=None):
+        """
+        Forget a cached session cookie
+        Args:
+            hostname (str) : vshpere server name
+            port (int) : port to send api requests
+            username (str) : username for the vsphere account
+            slot (int) : slot of the session, None for a single session
+        Returns:
+            None
+        """
+        with self._lock:
+            sessions = self._read()
+            key = self._key(hostname, port, username, slot)
+            if sessions.pop(key, None) is not None:
+                self._write(sessions)
+
+    def _key(self, hostname, port, username, slot):
+        key = "{0}:{1}:{2}".format(hostname, port, username)
+        if slot is not None:
+            key = "{0}#{1}".format(key, slot)
+        return key
+
+    @staticmethod
+    def _hash(password, salt):
+        digest = hashlib.pbkdf2_hmac(
+            "sha256",
+            (password or "").encode("utf-8"),
+            salt.encode("ascii"),
+            PASSWORD_HASH_ITERATIONS,
+        )
+        return binascii.hexlify(digest).decode("ascii")
+
+    def _private_directory(self, create=False):
+        """
+        Returns (bool) whether the cache directory is only accessible by its
+        owner, with create a missing directory is made with mode 0700
+        """
+        directory = os.path.dirname(self.path) or "."
+        if not os.path.isdir(directory):
+            if not create:
+                return False
+            os.makedirs(directory, 0o700)
+        mode = os.stat(directory).st_mode
+        if stat.S_IMODE(mode) & 0o077:
+            LOG.warning(
+                "Ignoring VMware session cache in '%s', other users can access it",
+                directory,
+            )
+            return False
+        return True
+
+    def _read(self):
+        try:
+            if not self._private_directory():
+                return {}
+            with open(self.path) as fd:
+                return json.load(fd)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _write(self, sessions):
+        if not self._private_directory(create=True):
+            return
+        tmp_path = "{0}.{1}.tmp".format(self.path, os.getpid())
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            # umask or an existing file may have left wider permissions
+            os.fchmod(fd, 0o600)
+            os.write(fd, json.dumps(sessions).encode("utf-8"))
+        finally:
+            os.close(fd)
+        try:
+            os.rename(tmp_path, self.path)
+        except OSError as ex:
+            LOG.warning("Writing VMware session cache failed: %s", ex)
+            os.remove(tmp_path)
@@ -0,0 +1,495 @@
+# -*- coding: utf-8 -*-
+"""Shared task completion watcher, one property filter per connection"""
+
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from concurrent.futures import wait as futures_wait
+
+from .vmware_utils import TASK_INFO_PATHS
+from ..logger import CustomLogger
+from pyVmomi import vim
+from pyVmomi import vmodl
+
+LOG = CustomLogger(__name__)
+
+# Seconds a single WaitForUpdatesEx call may block, bounds how long stop()
+# has to wait for the watcher thread.
+DEFAULT_MAX_WAIT_SECONDS = 30
+
+# Seconds between the cancels stop() sends until the watcher thread exits.
+CANCEL_INTERVAL = 0.1
+
+
+class _WatchedTask(object):
+    __slots__ = ("task", "future", "state", "error", "result", "progress")
+
+    def __init__(self, task):
+        self.task = task
+        self.future = Future()
+        self.state = None
+        self.error = None
+        self.result = None
+        self.progress = None
+
+
+class TaskWatcher(object):
+    """
+    Resolves a future per vSphere task from a single update loop.
+
+    Instead of a filter per waiter, the watcher keeps every pending task in
+    one ListView that is followed by one filter on a private
+    PropertyCollector. Tasks are added to and removed from the list view as
+    callers start waiting and as tasks finish, and one daemon thread runs
+    WaitForUpdatesEx for all of them.
+    """
+
+    def __init__(
+        self,
+        service_instance,
+        max_wait_seconds=DEFAULT_MAX_WAIT_SECONDS,
+        content=None,
+    ):
+        """
+        Build an idle watcher, server side objects are created on first use
+        Args:
+            service_instance (vim.ServiceInstance) : root object for vcenter
+                        inventory traversal
+            max_wait_seconds (int) : seconds a single update poll may block
+            content (vim.ServiceInstanceContent) : service content read at
+                        connect, read from service_instance if None
+        """
+        self.si = service_instance
+        self.content = content if content is not None else service_instance.content
+        self.max_wait_seconds = max_wait_seconds
+        self._tasks = {}
+        self._collector = None
+        self._view = None
+        self._filter = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.RLock()
+
+    def watch(self, task):
+        """
+        Start watching a task
+        Args:
+            task (vim.Task) : task to watch
+        Returns:
+            (concurrent.futures.Future) resolved with info.result of the task,
+            or failed with info.error
+        """
+        return self.watch_all([task])[0]
+
+    def watch_all(self, tasks):
+        """
+        Start watching several tasks with a single list view update
+        Args:
+            tasks (list) : vim.Task objects to watch
+        Returns:
+            (list) a future per task, in the order of tasks
+        """
+        futures = []
+        added = []
+        with self._lock:
+            self._start()
+            for task in tasks:
+                key = str(task)
+                watched = self._tasks.get(key)
+                if watched is None:
+                    watched = self._tasks[key] = _WatchedTask(task)
+                    added.append(task)
+                futures.append(watched.future)
+            if added:
+                unresolved = self._view.ModifyListView(add=added) or []
+        if added:
+            # tasks vCenter already purged can not be followed, read them once
+            for task in unresolved:
+                self._resolve_from_info(task)
+        return futures
+
+    def wait(self, tasks, timeout=None):
+        """
+        Block until all tasks are complete
+        Args:
+            tasks (list) : vim.Task objects to wait for
+            timeout (float) : overall seconds to wait, forever if None
+        Returns:
+            (list) info.result of every task
+        Raises:
+            the info.error of the first task seen failing, without waiting
+            for the others, concurrent.futures.TimeoutError if the tasks
+            did not finish in time
+        """
+        futures = self.watch_all(tasks)
+        # returns once a task failed, all are done or timeout passed
+        pending = futures_wait(futures, timeout, FIRST_EXCEPTION).not_done
+        for future in futures:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+        if pending:
+            raise FuturesTimeoutError(
+                "{0} of {1} tasks did not complete within {2} seconds".format(
+                    len(pending), len(futures), timeout
+                )
+            )
+        return [future.result() for future in futures]
+
+    def progress(self, task):
+        """
+        Returns last reported progress of a watched task
+        Args:
+            task (vim.Task) : watched task
+        Returns:
+            (int) percentage done, None if unknown or the task is not watched
+        """
+        with self._lock:
+            watched = self._tasks.get(str(task))
+            return watched.progress if watched is not None else None
+
+    def forget(self, task):
+        """
+        Stop watching a task, its future is cancelled if still pending
+        Args:
+            task (vim.Task) : watched task
+        Returns:
+            None
+        """
+        with self._lock:
+            watched = self._tasks.pop(str(task), None)
+            if watched is not None and self._view is not None:
+                self._view.ModifyListView(remove=[task])
+        if watched is not None:
+            watched.future.cancel()
+
+    def stop(self):
+        """
+        Stop the watcher thread and destroy the server side objects, pending
+        futures are failed
+        Returns:
+            None
+        """
+        self._stop.set()
+        collector = self._collector
+        self._cancel_wait(collector)
+        if self._thread is not None:
+            # a cancel that arrives before the thread enters WaitForUpdatesEx
+            # is lost, repeat it until the thread is gone
+            deadline = time.time() + self.max_wait_seconds + 1
+            while self._thread.is_alive() and time.time() < deadline:
+                self._thread.join(CANCEL_INTERVAL)
+                if self._thread.is_alive():
+                    self._cancel_wait(collector)
+        self._reset(Exception("Task watcher stopped"))
+
+    @staticmethod
+    def _cancel_wait(collector):
+        if collector is None:
+            return
+        try:
+            collector.CancelWaitForUpdates()
+        except Exception:
+            pass
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def _start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        content = self.content
+        self._collector = content.propertyCollector.CreatePropertyCollector()
+        self._view = content.viewManager.CreateListView(obj=[])
+        traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(
+            name="traverseTasks", path="view", skip=False, type=vim.view.ListView
+        )
+        obj_spec = vmodl.query.PropertyCollector.ObjectSpec(
+            obj=self._view, skip=True, selectSet=[traversal_spec]
+        )
+        property_spec = vmodl.query.PropertyCollector.PropertySpec(
+            type=vim.Task, pathSet=TASK_INFO_PATHS
+        )
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec(
+            objectSet=[obj_spec], propSet=[property_spec]
+        )
+        self._filter = self._collector.CreateFilter(filter_spec, True)
+
+        self._thread = threading.Thread(
+            target=self._follow_updates, name="vmware-task-watcher"
+        )
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _reset(self, ex):
+        with self._lock:
+            pending = list(self._tasks.values())
+            self._tasks.clear()
+            for obj in (self._filter, self._view, self._collector):
+                if obj is None:
+                    continue
+                try:
+                    obj.Destroy()
+                except Exception:
+                    pass
+            self._filter = self._view = self._collector = None
+            self._thread = None
+        for watched in pending:
+            if not watched.future.done():
+                watched.future.set_exception(ex)
+
+    def _follow_updates(self):
+        version = ""
+        options = vmodl.query.PropertyCollector.WaitOptions(
+            maxWaitSeconds=self.max_wait_seconds
+        )
+        while not self._stop.is_set():
+            try:
+                update = self._collector.WaitForUpdatesEx(version, options)
+            except Exception as ex:
+                if not self._stop.is_set():
+                    LOG.error("Task watcher failed to fetch updates: %s", ex)
+                    # the next watch() starts over with fresh server objects
+                    self._reset(ex)
+                return
+            if update is None:
+                continue
+            self._apply(update)
+            version = update.version
+
+    def _apply(self, update):
+        finished = []
+        with self._lock:
+            for filter_set in update.filterSet:
+                for obj_update in filter_set.objectSet:
+                    watched = self._tasks.get(str(obj_update.obj))
+                    if watched is None or obj_update.kind == "leave":
+                        continue
+                    for change in obj_update.changeSet:
+                        if change.name == "info.state":
+                            watched.state = change.val
+                        elif change.name == "info.error":
+                            watched.error = change.val
+                        elif change.name == "info.result":
+                            watched.result = change.val
+                        elif change.name == "info.progress":
+                            watched.progress = change.val
+                    if watched.state in (
+                        vim.TaskInfo.State.success,
+                        vim.TaskInfo.State.error,
+                    ):
+                        del self._tasks[str(watched.task)]
+                        finished.append(watched)
+            if finished and self._view is not None:
+                self._view.ModifyListView(remove=[w.task for w in finished])
+
+        for watched in finished:
+            self._resolve(watched)
+
+    def _resolve(self, watched):
+        if watched.future.done():
+            return
+        if watched.state == vim.TaskInfo.State.success:
+            watched.future.set_result(watched.result)
+            return
+        error = watched.error or watched.task.info.error
+        LOG.info(error.msg)
+        watched.future.set_exception(error)
+
+    def _resolve_from_info(self, task):
+        with self._lock:
+            watched = self._tasks.pop(str(task), None)
+        if watched is None:
+            return
+        try:
+            info = watched.task.info
+        except Exception as ex:
+            watched.future.set_exception(ex)
+            return
+        watched.state = info.state
+        watched.error = info.error
+        watched.result = info.result
+        if info.state in (vim.TaskInfo.State.success, vim.TaskInfo.State.error):
+            self._resolve(watched)
+        else:
+            watched.future.set_exception(
+                Exception("Task {0} can not be watched".format(task))
+            )
+
+
+class TaskHandle(object):
+    """
+    Handle to a submitted vSphere task, or to a chain of tasks.
+
+    The handle resolves to True once the operation succeeded, like the
+    blocking VMware methods return True. Faults listed in tolerate count as
+    success, e.g. InvalidPowerState for power operations.
+    """
+
+    def __init__(self, watcher, task, tolerate=(), future=None):
+        """
+        Build a handle, the task is watched right away
+        Args:
+            watcher (TaskWatcher) : watcher following the task
+            task (vim.Task) : submitted task, None for operations without a task
+            tolerate (tuple) : fault types that count as success
+            future (Future) : future to expose instead of watching task
+        """
+        self._watcher = watcher
+        self.task = task
+        if future is None:
+            future = Future()
+            if task is None:
+                future.set_result(True)
+            else:
+                _chain(watcher.watch(task), future, tolerate)
+        self.future = future
+
+    @classmethod
+    def completed(cls, watcher, result=True):
+        """
+        Returns a handle that is already done
+        Args:
+            watcher (TaskWatcher) : watcher used by chained tasks
+            result (object) : result of the handle
+        Returns:
+            (TaskHandle) finished handle
+        """
+        future = Future()
+        future.set_result(result)
+        return cls(watcher, None, future=future)
+
+    def result(self, timeout=None):
+        """
+        Block until the operation is done
+        Args:
+            timeout (float) : seconds to wait, forever if None
+        Returns:
+            (bool) True
+        Raises:
+            the task fault, concurrent.futures.TimeoutError on timeout or
+            concurrent.futures.CancelledError if the handle was cancelled
+        """
+        return self.future.result(timeout)
+
+    def exception(self, timeout=None):
+        """
+        Block until the operation is done
+        Args:
+            timeout (float) : seconds to wait, forever if None
+        Returns:
+            task fault, None on success
+        """
+        return self.future.exception(timeout)
+
+    def done(self):
+        """
+        Returns (bool) whether the operation finished
+        """
+        return self.future.done()
+
+    def progress(self):
+        """
+        Returns (int) percentage done of the current task, None if unknown
+        """
+        if self.future.done():
+            return 100
+        if self.task is None:
+            return None
+        return self._watcher.progress(self.task)
+
+    def cancel(self):
+        """
+        Ask vCenter to cancel the current task
+        Returns:
+            (bool) True if cancellation was requested, False if the task is
+            already done or can not be cancelled
+        """
+        if self.future.done() or self.task is None:
+            return False
+        try:
+            self.task.CancelTask()
+        except (vim.fault.InvalidState, vmodl.fault.NotSupported):
+            return False
+        return True
+
+    def add_done_callback(self, fn):
+        """
+        Call fn(handle) once the operation is done
+        Args:
+            fn (callable) : callback, runs on the watcher thread
+        Returns:
+            None
+        """
+        self.future.add_done_callback(lambda _: fn(self))
+
+    def then(self, submit, tolerate=()):
+        """
+        Chain another task that is submitted once this one succeeded
+        Args:
+            submit (callable) : returns the next vim.Task, or None if there
+                        is nothing left to do
+            tolerate (tuple) : fault types of the next task that count as
+                        success
+        Returns:
+            (TaskHandle) handle of the whole chain
+        """
+        chained = Future()
+        handle = TaskHandle(self._watcher, self.task, future=chained)
+
+        def _submit_next(future):
+            if future.cancelled():
+                chained.cancel()
+                return
+            ex = future.exception()
+            if ex is not None:
+                chained.set_exception(ex)
+                return
+            try:
+                task = submit()
+            except Exception as ex:
+                chained.set_exception(ex)
+                return
+            if task is None:
+                chained.set_result(True)
+                return
+            handle.task = task
+            _chain(self._watcher.watch(task), chained, tolerate)
+
+        self.future.add_done_callback(_submit_next)
+        return handle
+
+
+def _chain(source, target, tolerate=()):
+    """Resolve target with True once source succeeded or failed with a
+    tolerated fault, with the fault of source otherwise"""
+
+    def _copy(future):
+        if target.done():
+            return
+        if future.cancelled():
+            target.cancel()
+            return
+        ex = future.exception()
+        if ex is None or (tolerate and isinstance(ex, tolerate)):
+            target.set_result(True)
+        else:
+            target.set_exception(ex)
+
+    source.add_done_callback(_copy)
+
+
+def wait_all(handles, timeout=None):
+    """
+    Block until every handle is done
+    Args:
+        handles (list) : TaskHandle objects
+        timeout (float) : overall seconds to wait, forever if None
+    Returns:
+        (tuple) lists of handles that are done and not done
+    """
+    futures = dict((handle.future, handle) for handle in handles)
+    done, not_done = futures_wait(list(futures), timeout)
+    return [futures[f] for f in done], [futures[f] for f in not_done]
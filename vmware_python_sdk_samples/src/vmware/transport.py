@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+"""Record and replay of the SOAP traffic of pyVmomi connections"""
+
+import base64
+import collections
+import gzip
+import hashlib
+import io
+import json
+import re
+import threading
+import time
+
+from ..logger import CustomLogger
+from pyVim import connect
+from pyVmomi import SoapAdapter
+
+LOG = CustomLogger(__name__)
+
+RECORDING_FORMAT = "vmware-soap-recording"
+RECORDING_VERSION = 1
+
+# Response headers pyVmomi reads, the others are not recorded.
+RECORDED_HEADERS = ("content-type", "content-encoding", "set-cookie")
+
+# Module attributes holding the connection classes pyVmomi connects with.
+# Stubs pick their class when they are created, so a transport has to be
+# started before connecting.
+_CONNECTION_ATTRS = [
+    (SoapAdapter, "HTTPSConnection"),
+    (SoapAdapter, "HTTPConnection"),
+    (connect, "HTTPSConnection"),
+    (connect, "HTTPConnection"),
+]
+
+# Login sends the password, it is neither recorded nor matched.
+_PASSWORD = re.compile(rb"<password[^>]*>.*?</password>", re.DOTALL)
+_SESSION_COOKIE = re.compile(r'(vmware_soap_session=)("[^"]*"|[^;]*)')
+_SOAP_METHOD = re.compile(rb"<soapenv:Body>\s*<([\w:]+)")
+
+_lock = threading.Lock()
+_active = []
+
+
+class ReplayError(Exception):
+    """A request was made that the recording has no response for"""
+
+    pass
+
+
+def request_key(method, url, body):
+    """
+    Returns the key a request is matched by on replay
+    Args:
+        method (str) : http method
+        url (str) : request path
+        body (bytes) : request body, None for GET
+    Returns:
+        (str) hex digest of the request without the Login password
+    """
+    digest = hashlib.sha1("{0} {1}\n".format(method, url).encode("utf-8"))
+    digest.update(_PASSWORD.sub(b"", body or b""))
+    return digest.hexdigest()
+
+
+def _soap_method(body):
+    match = _SOAP_METHOD.search(body or b"")
+    if match is None:
+        return None
+    return match.group(1).decode("utf-8").rpartition(":")[2]
+
+
+def _as_bytes(body):
+    if body is None or isinstance(body, bytes):
+        return body
+    return body.encode("utf-8")
+
+
+class _RecordedResponse(object):
+    """In memory HTTP response with the interface pyVmomi reads"""
+
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self._headers = headers
+        self._body = io.BytesIO(body)
+
+    def read(self, amt=None):
+        return self._body.read() if amt is None else self._body.read(amt)
+
+    def getheader(self, name, default=None):
+        name = name.lower()
+        for key, value in self._headers:
+            if key.lower() == name:
+                return value
+        return default
+
+    def getheaders(self):
+        return list(self._headers)
+
+    def close(self):
+        pass
+
+
+class _Transport(object):
+    """
+    Replaces the connection classes of pyVmomi while started, only one
+    transport can be started at a time
+    """
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        """
+        Route connections made from now on through this transport
+        Returns:
+            self
+        Raises: RuntimeError if a transport is started already
+        """
+        with _lock:
+            if _active:
+                raise RuntimeError("A SOAP transport is started already")
+            originals = []
+            for module, name in _CONNECTION_ATTRS:
+                original = getattr(module, name)
+                originals.append((module, name, original))
+                setattr(module, name, self._connection_class(original))
+            _active.extend(originals)
+            self._started = time.time()
+        return self
+
+    def stop(self):
+        """
+        Restore the connection classes, connections created while started
+        keep using this transport
+        Returns:
+            None
+        """
+        with _lock:
+            while _active:
+                module, name, original = _active.pop()
+                setattr(module, name, original)
+
+    def _connection_class(self, base):
+        raise NotImplementedError
+
+
+class SoapRecorder(_Transport):
+    """
+    Records the http exchanges of pyVmomi connections to a gzip compressed
+    file of JSON lines, the header first, then a line per exchange with the
+    key of the request, its latency and the response.
+
+    Requests are only kept as key, so the recording holds no passwords, and
+    the session cookie of responses is replaced. Responses still hold
+    whatever vCenter returned. Usage:
+
+        with SoapRecorder("run.soap.gz"):
+            vmware = VMware(host, user, password)
+            vmware.delete_vm(datacenter, vm_id)
+            vmware.disconnect()
+    """
+
+    def __init__(self, path, meta=None):
+        """
+        Build a recorder, it records once started
+        Args:
+            path (str) : file to write
+            meta (dict) : JSON serializable data kept in the header, e.g.
+                        the recorded call
+        """
+        self.path = path
+        self.meta = meta or {}
+        self.exchanges = 0
+        self._fd = None
+        self._write_lock = threading.Lock()
+
+    def start(self):
+        self._fd = gzip.open(self.path, "wt", encoding="utf-8")
+        self._write(
+            {
+                "format": RECORDING_FORMAT,
+                "version": RECORDING_VERSION,
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "meta": self.meta,
+            }
+        )
+        try:
+            return _Transport.start(self)
+        except Exception:
+            self._fd.close()
+            raise
+
+    def stop(self):
+        _Transport.stop(self)
+        with self._write_lock:
+            if self._fd is not None:
+                self._fd.close()
+                self._fd = None
+        LOG.debug("Recorded %s SOAP exchanges to %s", self.exchanges, self.path)
+
+    def record(self, method, url, body, start, response, data):
+        """
+        Write one exchange
+        Args:
+            method (str) : http method
+            url (str) : request path
+            body (bytes) : request body
+            start (float) : time the request was sent
+            response (http.client.HTTPResponse) : read response
+            data (bytes) : response body
+        Returns:
+            None
+        """
+        seconds = time.time() - start
+        headers = []
+        for name, value in response.getheaders():
+            if name.lower() not in RECORDED_HEADERS:
+                continue
+            if name.lower() == "set-cookie":
+                value = _SESSION_COOKIE.sub(r'\1"recorded"', value)
+            headers.append([name, value])
+        exchange = {
+            "key": request_key(method, url, body),
+            "method": method,
+            "url": url,
+            "action": _soap_method(body),
+            "offset": round(start - self._started, 6),
+            "seconds": round(seconds, 6),
+            "status": response.status,
+            "reason": response.reason,
+            "headers": headers,
+        }
+        try:
+            exchange["body"] = data.decode("utf-8")
+        except UnicodeDecodeError:
+            # compressed responses
+            exchange["body_b64"] = base64.b64encode(data).decode("ascii")
+        with self._write_lock:
+            if self._fd is not None:
+                self._write(exchange)
+                self.exchanges += 1
+
+    def _write(self, record):
+        self._fd.write(json.dumps(record, separators=(",", ":")))
+        self._fd.write("\n")
+
+    def _connection_class(self, base):
+        recorder = self
+
+        class RecordingConnection(base):
+            def request(self, method, url, body=None, headers={}, **kwargs):
+                self._recorded_request = (method, url, _as_bytes(body), time.time())
+                return base.request(self, method, url, body, headers, **kwargs)
+
+            def getresponse(self):
+                method, url, body, start = self._recorded_request
+                response = base.getresponse(self)
+                try:
+                    data = response.read()
+                finally:
+                    response.close()
+                recorder.record(method, url, body, start, response, data)
+                return _RecordedResponse(
+                    response.status, response.reason, response.getheaders(), data
+                )
+
+        RecordingConnection.__name__ = "Recording" + base.__name__
+        return RecordingConnection
+
+
+class SoapReplayer(_Transport):
+    """
+    Answers the requests of pyVmomi connections from a SoapRecorder file,
+    nothing is sent over the network.
+
+    A request gets the response recorded for the same request, requests
+    that were recorded several times get their responses in recorded order.
+    The client has to send the requests it sent while recording, e.g. run the
+    same VMware calls with the same arguments; the password is not checked.
+    Usage:
+
+        with SoapReplayer("run.soap.gz", latency_scale=0) as replayer:
+            vmware = VMware(host, user, "", port=port)
+            vmware.delete_vm(datacenter, vm_id)
+            vmware.disconnect()
+        replayer.stats()
+    """
+
+    def __init__(self, path, latency_scale=1.0, strict=False):
+        """
+        Load a recording
+        Args:
+            path (str) : file written by SoapRecorder
+            latency_scale (float) : responses are delayed by their recorded
+                        latency times this, 0 answers right away
+            strict (bool) : raise ReplayError once the responses of a request
+                        are used up, else its last response is repeated,
+                        e.g. for polls that ran more often than recorded
+        Raises: ValueError if path is no recording
+        """
+        self.path = path
+        self.latency_scale = latency_scale
+        self.strict = strict
+        self._lock = threading.Lock()
+        self._responses = collections.defaultdict(collections.deque)
+        self._last = {}
+        self.replayed = 0
+        self.repeated = 0
+        with gzip.open(path, "rt", encoding="utf-8") as fd:
+            header = json.loads(fd.readline() or "{}")
+            if header.get("format") != RECORDING_FORMAT:
+                raise ValueError("{0} is not a SOAP recording".format(path))
+            self.meta = header.get("meta", {})
+            self.exchanges = 0
+            for line in fd:
+                exchange = json.loads(line)
+                self._responses[exchange["key"]].append(exchange)
+                self.exchanges += 1
+
+    def stats(self):
+        """
+        Returns replay counters
+        Returns:
+            (dict) recorded exchanges, responses replayed, responses repeated
+            because their recorded ones were used up, and recorded
+            responses that were never asked for
+        """
+        with self._lock:
+            return {
+                "exchanges": self.exchanges,
+                "replayed": self.replayed,
+                "repeated": self.repeated,
+                "unused": sum(len(queue) for queue in self._responses.values()),
+            }
+
+    def respond(self, method, url, body):
+        """
+        Returns the recorded exchange answering a request
+        Args:
+            method (str) : http method
+            url (str) : request path
+            body (bytes) : request body
+        Returns:
+            (dict) recorded exchange
+        Raises: ReplayError if there is none
+        """
+        key = request_key(method, url, body)
+        with self._lock:
+            queue = self._responses.get(key)
+            if queue:
+                exchange = self._last[key] = queue.popleft()
+                self.replayed += 1
+                return exchange
+            exchange = self._last.get(key)
+            if exchange is not None and not self.strict:
+                self.repeated += 1
+                return exchange
+        raise ReplayError(
+            "No recorded response for {0} {1} {2}".format(
+                method, url, _soap_method(body) or ""
+            ).strip()
+        )
+
+    def _connection_class(self, base):
+        replayer = self
+
+        class ReplayConnection(object):
+            default_port = base.default_port
+
+            def __init__(self, host, port=None, **kwargs):
+                self.host = host
+                self.port = port
+                # pooled connections are kept while they have a socket
+                self.sock = True
+                self._exchange = None
+
+            def connect(self):
+                pass
+
+            def set_tunnel(self, *args, **kwargs):
+                pass
+
+            def request(self, method, url, body=None, headers=None, **kwargs):
+                self._exchange = replayer.respond(method, url, _as_bytes(body))
+
+            def getresponse(self):
+                exchange, self._exchange = self._exchange, None
+                delay = exchange["seconds"] * replayer.latency_scale
+                if delay > 0:
+                    time.sleep(delay)
+                if "body_b64" in exchange:
+                    data = base64.b64decode(exchange["body_b64"])
+                else:
+                    data = exchange["body"].encode("utf-8")
+                return _RecordedResponse(
+                    exchange["status"],
+                    exchange["reason"],
+                    exchange["headers"],
+                    data,
+                )
+
+            def close(self):
+                pass
+
+        ReplayConnection.__name__ = "Replay" + base.__name__
+        return ReplayConnection
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""Reuse and bounded lifetime of server side container views"""
+
+import collections
+import threading
+
+from ..logger import CustomLogger
+
+LOG = CustomLogger(__name__)
+
+# Container views kept open per connection before the least recently used
+# one is destroyed.
+DEFAULT_MAX_VIEWS = 32
+
+
+class ContainerViewManager(object):
+    """
+    Hands out container views keyed by (container, types, recursive).
+
+    vCenter keeps every container view alive, and keeps it up to date, until
+    it is destroyed or the session ends. The manager reuses an open view for
+    repeated requests, destroys the least recently used view once more than
+    max_views are open and destroys all of them on close().
+
+    An evicted view is destroyed on the server, callers should therefore not
+    hold on to a view longer than the call that requested it.
+    """
+
+    def __init__(self, service_instance, max_views=DEFAULT_MAX_VIEWS, content=None):
+        """
+        Build an empty view manager
+        Args:
+            service_instance (vim.ServiceInstance) : root object for inventory traversal
+            max_views (int) : number of views kept open
+            content (vim.ServiceInstanceContent) : service content read at
+                        connect, read from service_instance if None
+        """
+        self.si = service_instance
+        self.content = content if content is not None else service_instance.content
+        self.max_views = max_views
+        self.created = 0
+        self.reused = 0
+        self.destroyed = 0
+        self._views = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, obj_type, container=None, recursive=True):
+        """
+        Return an open container view, creating it if needed
+        Args:
+            obj_type (list): A list of managed object types
+            container (vim.ManagedEntity) : The object that the view presents
+            recursive (bool) : include objects below the direct children
+        Returns:
+            (vim.view.ContainerView) : A container view ref
+        """
+        if not container:
+            container = self.content.rootFolder
+        key = (
+            str(container),
+            tuple(sorted(t.__name__ for t in obj_type)),
+            bool(recursive),
+        )
+
+        with self._lock:
+            view = self._views.pop(key, None)
+            if view is not None:
+                self._views[key] = view
+                self.reused += 1
+                return view
+
+            view = self.content.viewManager.CreateContainerView(
+                container=container, type=obj_type, recursive=recursive
+            )
+            self._views[key] = view
+            self.created += 1
+
+            while len(self._views) > self.max_views:
+                _, evicted = self._views.popitem(last=False)
+                self._destroy(evicted)
+            return view
+
+    def close(self):
+        """
+        Destroy every view held by the manager
+        Returns:
+            None
+        """
+        with self._lock:
+            while self._views:
+                _, view = self._views.popitem(last=False)
+                self._destroy(view)
+
+    def stats(self):
+        """
+        Returns view usage counters
+        Returns:
+            (dict) open, created, reused and destroyed view counts
+        """
+        with self._lock:
+            return {
+                "open": len(self._views),
+                "created": self.created,
+                "reused": self.reused,
+                "destroyed": self.destroyed,
+            }
+
+    def __len__(self):
+        return len(self._views)
+
+    def _destroy(self, view):
+        try:
+            view.Destroy()
+            self.destroyed += 1
+        except Exception as ex:
+            LOG.warning("Destroying container view failed: %s", ex)
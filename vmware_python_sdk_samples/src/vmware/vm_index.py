@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""Live (datacenter, instance uuid) -> VirtualMachine index"""
+
+import threading
+import time
+
+from ..logger import CustomLogger
+from pyVmomi import vim
+from pyVmomi import vmodl
+
+LOG = CustomLogger(__name__)
+
+# Seconds a single WaitForUpdatesEx call may block, bounds how long stop()
+# has to wait for the watcher thread.
+DEFAULT_MAX_WAIT_SECONDS = 30
+
+# Seconds between the cancels stop() sends until the watcher thread exits.
+CANCEL_INTERVAL = 0.1
+
+# Seconds to back off after the watcher fails to fetch updates.
+RETRY_INTERVAL = 5
+
+INSTANCE_UUID_PROP = "config.instanceUuid"
+
+
+class VMIndex(object):
+    """
+    Index of virtual machines keyed by (datacenter, instance uuid).
+
+    Every watched datacenter gets a container view of its virtual machines
+    and a filter on a private PropertyCollector. A daemon thread follows the
+    filters with WaitForUpdatesEx so vms created in or removed from the
+    datacenter are reflected in the index without any lookup traffic. Vms
+    that left a datacenter are remembered, add() does not bring them back.
+    """
+
+    def __init__(
+        self,
+        service_instance,
+        max_wait_seconds=DEFAULT_MAX_WAIT_SECONDS,
+        content=None,
+    ):
+        """
+        Build an empty index, datacenters are watched on first lookup
+        Args:
+            service_instance (vim.ServiceInstance) : root object for vcenter
+                        inventory traversal
+            max_wait_seconds (int) : seconds a single update poll may block
+            content (vim.ServiceInstanceContent) : service content read at
+                        connect, read from service_instance if None
+        """
+        self.si = service_instance
+        self.content = content if content is not None else service_instance.content
+        self.max_wait_seconds = max_wait_seconds
+        self.hits = 0
+        self.misses = 0
+
+        self._collector = None
+        self._entries = {}
+        self._uuid_by_vm = {}
+        self._watched = {}
+        self._dc_by_filter = {}
+        # (dc key, vm) that left, and updates of filters not registered yet
+        self._removed = set()
+        self._unclaimed = {}
+        self._lock = threading.RLock()
+        # serializes the setup of watches, made without holding _lock
+        self._watch_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def lookup(self, datacenter, uuid):
+        """
+        Return the indexed vm for uuid in datacenter, watching the datacenter
+        if it is not watched yet
+        Args:
+            datacenter (vim.Datacenter) : datacenter the vm lives in
+            uuid (str) : instance uuid of the vm
+        Returns:
+            (vim.VirtualMachine) vm if indexed, else None
+        """
+        dc_key = self._watch(datacenter)
+        with self._lock:
+            vm = self._entries.get((dc_key, uuid.lower()))
+            if vm is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return vm
+
+    def add(self, datacenter, uuid, vm):
+        """
+        Record a vm that was resolved outside of the index, unless the
+        watcher has seen it leave the datacenter meanwhile
+        Args:
+            datacenter (vim.Datacenter) : datacenter the vm lives in
+            uuid (str) : instance uuid of the vm
+            vm (vim.VirtualMachine) : vm to record
+        Returns:
+            None
+        """
+        dc_key = self._watch(datacenter)
+        with self._lock:
+            if (dc_key, str(vm)) not in self._removed:
+                self._add(dc_key, uuid, vm)
+
+    def discard(self, datacenter, uuid):
+        """
+        Drop a single entry from the index
+        Args:
+            datacenter (vim.Datacenter) : datacenter the vm lives in
+            uuid (str) : instance uuid of the vm
+        Returns:
+            None
+        """
+        dc_key = str(datacenter)
+        with self._lock:
+            vm = self._entries.pop((dc_key, uuid.lower()), None)
+            if vm is not None:
+                self._uuid_by_vm.pop((dc_key, str(vm)), None)
+
+    def stats(self):
+        """
+        Returns hit/miss counters of the index
+        Returns:
+            (dict) hits, misses, hit_ratio, size and number of watched datacenters
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": float(self.hits) / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "datacenters": len(self._watched),
+            }
+
+    def stop(self):
+        """
+        Stop the watcher thread and destroy the server side filters and views
+        Returns:
+            None
+        """
+        self._stop.set()
+        # waits for a watch being set up, later ones see _stop
+        with self._watch_lock:
+            self._stop_watching()
+
+    def _stop_watching(self):
+        collector = self._collector
+        self._cancel_wait(collector)
+        if self._thread is not None:
+            # a cancel that arrives before the thread enters WaitForUpdatesEx
+            # is lost, repeat it until the thread is gone
+            deadline = time.time() + self.max_wait_seconds + 1
+            while self._thread.is_alive() and time.time() < deadline:
+                self._thread.join(CANCEL_INTERVAL)
+                if self._thread.is_alive():
+                    self._cancel_wait(collector)
+            self._thread = None
+
+        with self._lock:
+            for pcfilter, view in self._watched.values():
+                for obj in (pcfilter, view):
+                    try:
+                        obj.Destroy()
+                    except Exception:
+                        pass
+            if collector is not None:
+                try:
+                    collector.Destroy()
+                except Exception:
+                    pass
+            self._collector = None
+            self._watched.clear()
+            self._dc_by_filter.clear()
+            self._entries.clear()
+            self._uuid_by_vm.clear()
+            self._removed.clear()
+            self._unclaimed.clear()
+
+    @staticmethod
+    def _cancel_wait(collector):
+        if collector is None:
+            return
+        try:
+            collector.CancelWaitForUpdates()
+        except Exception:
+            pass
+
+    def _watch(self, datacenter):
+        dc_key = str(datacenter)
+        with self._lock:
+            if dc_key in self._watched or self._stop.is_set():
+                return dc_key
+
+        # the server calls are made outside _lock, lookups and the watcher
+        # thread keep going meanwhile
+        with self._watch_lock:
+            if dc_key in self._watched or self._stop.is_set():
+                return dc_key
+
+            content = self.content
+            if self._collector is None:
+                self._collector = content.propertyCollector.CreatePropertyCollector()
+
+            view = content.viewManager.CreateContainerView(
+                container=datacenter, type=[vim.VirtualMachine], recursive=True
+            )
+            traversal_spec = vmodl.query.PropertyCollector.TraversalSpec(
+                name="traverseEntities", path="view", skip=False, type=view.__class__
+            )
+            obj_spec = vmodl.query.PropertyCollector.ObjectSpec(
+                obj=view, skip=True, selectSet=[traversal_spec]
+            )
+            property_spec = vmodl.query.PropertyCollector.PropertySpec(
+                type=vim.VirtualMachine, pathSet=[INSTANCE_UUID_PROP]
+            )
+            filter_spec = vmodl.query.PropertyCollector.FilterSpec(
+                objectSet=[obj_spec], propSet=[property_spec]
+            )
+            pcfilter = self._collector.CreateFilter(filter_spec, True)
+
+            with self._lock:
+                self._watched[dc_key] = (pcfilter, view)
+                self._dc_by_filter[str(pcfilter)] = dc_key
+                # the snapshot may have come in before the filter was known
+                for filter_set in self._unclaimed.pop(str(pcfilter), []):
+                    self._apply_filter_set(dc_key, filter_set)
+
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._follow_updates, name="vmware-vm-index"
+                )
+                self._thread.daemon = True
+                self._thread.start()
+        return dc_key
+
+    def _add(self, dc_key, uuid, vm):
+        uuid = uuid.lower()
+        self._entries[(dc_key, uuid)] = vm
+        self._uuid_by_vm[(dc_key, str(vm))] = uuid
+
+    def _remove_vm(self, dc_key, vm):
+        uuid = self._uuid_by_vm.pop((dc_key, str(vm)), None)
+        if uuid is not None:
+            self._entries.pop((dc_key, uuid), None)
+
+    def _follow_updates(self):
+        version = ""
+        options = vmodl.query.PropertyCollector.WaitOptions(
+            maxWaitSeconds=self.max_wait_seconds
+        )
+        while not self._stop.is_set():
+            try:
+                update = self._collector.WaitForUpdatesEx(version, options)
+            except Exception as ex:
+                if self._stop.is_set():
+                    break
+                # updates may have been lost, start over from a full snapshot
+                LOG.warning("VM index lost track of inventory updates: %s", ex)
+                with self._lock:
+                    self._entries.clear()
+                    self._uuid_by_vm.clear()
+                    self._unclaimed.clear()
+                version = ""
+                self._stop.wait(RETRY_INTERVAL)
+                continue
+
+            if update is None:
+                continue
+            self._apply(update)
+            version = update.version
+
+    def _apply(self, update):
+        with self._lock:
+            for filter_set in update.filterSet:
+                dc_key = self._dc_by_filter.get(str(filter_set.filter))
+                if dc_key is None:
+                    # _watch registers the filter once CreateFilter returned
+                    self._unclaimed.setdefault(str(filter_set.filter), []).append(
+                        filter_set
+                    )
+                    continue
+                self._apply_filter_set(dc_key, filter_set)
+
+    def _apply_filter_set(self, dc_key, filter_set):
+        for obj_update in filter_set.objectSet:
+            vm = obj_update.obj
+            if obj_update.kind == "leave":
+                self._remove_vm(dc_key, vm)
+                self._removed.add((dc_key, str(vm)))
+                continue
+            if obj_update.kind == "enter":
+                self._removed.discard((dc_key, str(vm)))
+            for change in obj_update.changeSet:
+                if change.name != INSTANCE_UUID_PROP:
+                    continue
+                self._remove_vm(dc_key, vm)
+                if change.op != "remove" and change.val:
+                    self._add(dc_key, change.val, vm)
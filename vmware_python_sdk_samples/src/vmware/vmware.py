@@ -2,29 +2,111 @@
 """Interface for vmware sdk"""
 
 import atexit
+import itertools
 import ssl
+import threading
+import time
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from concurrent.futures import wait as futures_wait
 
-import vmware_utils
+from . import vmware_utils
+from .cache import TTLCache
+from .coalescer import DEFAULT_COALESCE_WINDOW
+from .coalescer import ReconfigCoalescer
+from .disk_slots import DiskSlots
+from .network_index import NetworkIndex
+from .property_index import PropertyIndexes
+from .session_cache import SessionCache
+from .task_watcher import TaskHandle
+from .task_watcher import TaskWatcher
+from .view_manager import ContainerViewManager
+from .vm_index import VMIndex
 from ..constants import VMWARE
 from ..logger import CustomLogger
 from pyVim import connect
 from pyVmomi import vmodl
 from pyVmomi import vim
 
-
 LOG = CustomLogger(__name__)
 
 
 # ESX data model related constants.
+#
+# pyVmomi creates vim types on first attribute access, the maps below are
+# therefore built on first use instead of at import. They stay available as
+# module attributes, e.g. vmware.ESX_VM_NIC_ADAPTER_MAP, through __getattr__.
 
-ESX_VM_NIC_ADAPTER_MAP = {
-    VMWARE.NETADAPTERS.E1000: vim.vm.device.VirtualE1000,
-    VMWARE.NETADAPTERS.E1000E: vim.vm.device.VirtualE1000e,
-    VMWARE.NETADAPTERS.PCNET: vim.vm.device.VirtualPCNet32,
-    VMWARE.NETADAPTERS.VMXNET: vim.vm.device.VirtualVmxnet,
-    VMWARE.NETADAPTERS.VMXNET2: vim.vm.device.VirtualVmxnet2,
-    VMWARE.NETADAPTERS.VMXNET3: vim.vm.device.VirtualVmxnet3,
+_VIM_TYPE_MAP_BUILDERS = {
+    "ESX_VM_NIC_ADAPTER_MAP": lambda: {
+        VMWARE.NETADAPTERS.E1000: vim.vm.device.VirtualE1000,
+        VMWARE.NETADAPTERS.E1000E: vim.vm.device.VirtualE1000e,
+        VMWARE.NETADAPTERS.PCNET: vim.vm.device.VirtualPCNet32,
+        VMWARE.NETADAPTERS.VMXNET: vim.vm.device.VirtualVmxnet,
+        VMWARE.NETADAPTERS.VMXNET2: vim.vm.device.VirtualVmxnet2,
+        VMWARE.NETADAPTERS.VMXNET3: vim.vm.device.VirtualVmxnet3,
+    },
+    # Faults of power operations that mean the vm already is in the
+    # requested state
+    "POWER_STATE_FAULTS": lambda: (
+        vim.fault.InvalidPowerState,
+        vim.fault.InvalidState,
+    ),
 }
+_VIM_TYPE_MAPS = {}
+
+
+def _vim_type_map(name):
+    """
+    Returns the vim type map called name, building it on first use
+    Args:
+        name (str) : key of _VIM_TYPE_MAP_BUILDERS
+    Returns:
+        map or tuple of vim types
+    """
+    value = _VIM_TYPE_MAPS.get(name)
+    if value is None:
+        # building twice from two threads is harmless, both results are equal
+        value = _VIM_TYPE_MAPS[name] = _VIM_TYPE_MAP_BUILDERS[name]()
+    return value
+
+
+def __getattr__(name):
+    if name in _VIM_TYPE_MAP_BUILDERS:
+        return _vim_type_map(name)
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
+
+
+# Seconds a resolved datacenter reference is reused before it is looked up
+# again. Datacenters are rarely renamed, so this can be generous.
+DEFAULT_DATACENTER_CACHE_TTL = 300
+
+
+# Power operations that run as a task, and guest operations that do not
+TASK_POWER_OPERATIONS = [
+    VMWARE.OPERATIONS.POWER_OFF,
+    VMWARE.OPERATIONS.POWER_ON,
+    VMWARE.OPERATIONS.RESET,
+    VMWARE.OPERATIONS.SUSPEND,
+]
+GUEST_POWER_OPERATIONS = [
+    VMWARE.OPERATIONS.REBOOT,
+    VMWARE.OPERATIONS.SHUTDOWN,
+    VMWARE.OPERATIONS.STANDBY,
+]
+
+# Fields accepted by VMware.update
+UPDATE_FIELDS = [
+    "num_vcpu",
+    "num_cores",
+    "memory",
+    "disks",
+    "add_disks",
+    "network",
+    "add_nics",
+]
+
+# Power tasks kept in flight by change_power_state_bulk
+DEFAULT_BULK_CONCURRENCY = 16
 
 
 DISK_ADAPTERS = [
@@ -40,40 +122,297 @@ class VMwareError(Exception):
     pass
 
 
+class TaskTimeoutError(VMwareError):
+    """A task did not complete within task_timeout"""
+
+    pass
+
+
 class VMware:
     """VMware Helpers to Update VM's"""
 
-    def __init__(self, hostname, username, password, port=443):
+    def __init__(
+        self,
+        hostname,
+        username,
+        password,
+        port=443,
+        datacenter_cache_ttl=DEFAULT_DATACENTER_CACHE_TTL,
+        vm_index=False,
+        property_index=False,
+        task_watcher=False,
+        task_timeout=None,
+        coalesce_window=None,
+        session_cache=None,
+        session_slot=None,
+    ):
         """Initialize vmware handle
         Args:
             hostname (str) : vshpere server name
             username (str) : username for the vsphere account
             password (str) : password for the vsphere account
             port (int) : port to send api requests
+            datacenter_cache_ttl (int) : seconds a datacenter lookup is cached,
+                        0 disables the cache and None never expires entries
+            vm_index (bool) : keep a live index of vms per datacenter so repeated
+                        lookups of the same vm skip FindByUuid
+            property_index (bool) : answer datacenter lookups by name from
+                        an index kept up to date with WaitForUpdatesEx
+            task_watcher (bool) : wait for tasks through one shared filter per
+                        connection instead of a filter per wait
+            task_timeout (float) : seconds blocking methods wait for their
+                        tasks, all together, before raising TaskTimeoutError,
+                        forever if None
+            coalesce_window (float) : seconds update_vm collects config spec
+                        fragments per vm to submit them as one task, None
+                        submits every update on its own
+            session_cache (SessionCache|str|bool) : reattach to the session
+                        cached for this host and user before logging in, a
+                        path or True selects a cache file. Sessions of a
+                        cached handle are kept alive on disconnect
+            session_slot (int) : slot of the cached session, handles with
+                        different slots never share a session
         Raises: VMwareError
         """
+        self._datacenter_cache = TTLCache(ttl=datacenter_cache_ttl)
+        self._vm_index = None
+        self._property_indexes = None
+        self._task_watcher = None
+        self.task_timeout = task_timeout
+        self._coalescer = None
+        self.views = None
+        self.networks = None
+        # service content, read once as every si.content access costs a
+        # round trip
+        self.content = None
+        if session_cache is True:
+            session_cache = SessionCache()
+        elif session_cache and not isinstance(session_cache, SessionCache):
+            session_cache = SessionCache(session_cache)
+        self._session_cache = session_cache or None
+        self.session_slot = session_slot
         try:
             sslcontext = ssl._create_unverified_context()
-            self.si = connect.SmartConnect(
-                host=hostname,
-                user=username,
-                pwd=password,
-                port=port,
-                sslContext=sslcontext,
-            )
+            self.si = None
+            if self._session_cache is not None:
+                self.si = self._reattach_session(
+                    hostname, port, username, password, sslcontext
+                )
+            if self.si is None:
+                self.si = connect.SmartConnect(
+                    host=hostname,
+                    user=username,
+                    pwd=password,
+                    port=port,
+                    sslContext=sslcontext,
+                )
+                if self.si and self._session_cache is not None:
+                    self._session_cache.set(
+                        hostname,
+                        port,
+                        username,
+                        password,
+                        self.si._stub.cookie,
+                        slot=session_slot,
+                    )
             if not self.si:
                 raise VMwareError(
                     "Could not connect to the specified"
                     "host using specified username and password"
                 )
-            atexit.register(connect.Disconnect, self.si)
+            self.content = self.si.content
+            self.views = ContainerViewManager(self.si, content=self.content)
+            self.networks = NetworkIndex(
+                self.si, view_manager=self.views, content=self.content
+            )
+            atexit.register(self.disconnect)
         except Exception as ex:
-            LOG.error("Unable to connect to vmware server: %s" % ex)
+            LOG.error("Unable to connect to vmware server: %s", ex)
             raise VMwareError(
                 "Unable to connect to vmware server: '{0}'".format(hostname)
             )
+        if vm_index:
+            self.enable_vm_index()
+        if property_index:
+            self.enable_property_index()
+        if task_watcher:
+            self.enable_task_watcher()
+        if coalesce_window is not None:
+            self.enable_reconfig_coalescing(coalesce_window)
+
+    def enable_vm_index(self):
+        """
+        Start indexing vms by (datacenter, instance uuid)
+        Returns:
+            (VMIndex) the active index
+        """
+        if self._vm_index is None:
+            self._vm_index = VMIndex(self.si, content=self.content)
+        return self._vm_index
+
+    def disable_vm_index(self):
+        """
+        Stop indexing vms and release the server side filters
+        Returns:
+            None
+        """
+        if self._vm_index is not None:
+            self._vm_index.stop()
+            self._vm_index = None
+
+    def enable_property_index(self):
+        """
+        Answer lookups by property value, e.g. datacenters by name, from
+        indexes of this connection instead of collecting the property of
+        every object on each call
+        Returns:
+            (PropertyIndexes) the indexes of this connection
+        """
+        if self._property_indexes is None:
+            self._property_indexes = PropertyIndexes(self.si, content=self.content)
+        return self._property_indexes
+
+    def disable_property_index(self):
+        """
+        Stop using property indexes and destroy their server side objects
+        Returns:
+            None
+        """
+        if self._property_indexes is not None:
+            self._property_indexes.close()
+            self._property_indexes = None
 
-    def add_vdisk(self, datacenter_name, vm_id, disk_size=1, disk_type="disk"):
+    def enable_task_watcher(self):
+        """
+        Wait for tasks through a single shared filter for this connection
+        Returns:
+            (TaskWatcher) the active watcher
+        """
+        if self._task_watcher is None:
+            self._task_watcher = TaskWatcher(self.si, content=self.content)
+        return self._task_watcher
+
+    def disable_task_watcher(self):
+        """
+        Go back to a filter per wait, tasks still being watched fail.
+        Reconfig coalescing submits through the watcher and is disabled too
+        Returns:
+            None
+        """
+        self.disable_reconfig_coalescing()
+        if self._task_watcher is not None:
+            self._task_watcher.stop()
+            self._task_watcher = None
+
+    def enable_reconfig_coalescing(self, window=DEFAULT_COALESCE_WINDOW):
+        """
+        Merge concurrent update_vm calls for the same vm into one task
+        Args:
+            window (float) : seconds config spec fragments are collected per vm
+        Returns:
+            (ReconfigCoalescer) the active coalescer
+        """
+        if self._coalescer is None:
+            self._coalescer = ReconfigCoalescer(
+                self.enable_task_watcher(),
+                window=window,
+                read_devices=self._vm_devices,
+            )
+        return self._coalescer
+
+    def disable_reconfig_coalescing(self):
+        """
+        Submit every update_vm call as its own task again. Pending batches
+        are submitted right away and waited for up to task_timeout
+        Returns:
+            None
+        """
+        coalescer, self._coalescer = self._coalescer, None
+        if coalescer is not None and not coalescer.close(self.task_timeout):
+            LOG.warning(
+                "Coalesced reconfigure tasks still running after %s seconds",
+                self.task_timeout,
+            )
+
+    def disconnect(self, logout=None):
+        """
+        Release server side views and filters and log out of the session
+        Args:
+            logout (bool) : end the session on vCenter, by default only when
+                        it is not kept in a session cache
+        Returns:
+            None
+        """
+        if logout is None:
+            logout = self._session_cache is None
+        # the exit hook holds the handle, drop it once there is nothing left
+        atexit.unregister(self.disconnect)
+        self.disable_vm_index()
+        self.disable_property_index()
+        self.disable_reconfig_coalescing()
+        self.disable_task_watcher()
+        if self.views is not None:
+            self.views.close()
+        if self.si is not None:
+            if logout:
+                connect.Disconnect(self.si)
+            self.si = None
+            self.content = None
+
+    def _reattach_session(self, hostname, port, username, password, sslcontext):
+        """
+        Reuse the cached session of hostname, username and session_slot
+        Args:
+            hostname (str) : vshpere server name
+            port (int) : port to send api requests
+            username (str) : username for the vsphere account
+            password (str) : password for the vsphere account
+            sslcontext (ssl.SSLContext) : ssl context of the connection
+        Returns:
+            (vim.ServiceInstance) service instance of the session, None if
+            there is no usable cached session
+        """
+        cookie = self._session_cache.get(
+            hostname, port, username, password, slot=self.session_slot
+        )
+        if not cookie:
+            return None
+        try:
+            stub = connect.SmartStubAdapter(
+                host=hostname, port=port, sslContext=sslcontext
+            )
+            stub.cookie = cookie
+            si = vim.ServiceInstance("ServiceInstance", stub)
+            session = si.RetrieveContent().sessionManager.currentSession
+        except Exception as ex:
+            LOG.debug("Reattaching cached VMware session failed: %s", ex)
+            session = None
+        if session is None:
+            self._session_cache.invalidate(
+                hostname, port, username, slot=self.session_slot
+            )
+            return None
+        return si
+
+    def vm_index_stats(self):
+        """
+        Returns hit/miss counters of the vm index
+        Returns:
+            (dict) index statistics, empty if the index is disabled
+        """
+        if self._vm_index is None:
+            return {}
+        return self._vm_index.stats()
+
+    def add_vdisk(
+        self,
+        datacenter_name,
+        vm_id,
+        disk_size=1,
+        disk_type="disk",
+        wait=True,
+        disk_adapter=VMWARE.DISKADAPTER.SCSI,
+    ):
         """
         Adds VDisk to vm
         Args:
@@ -81,17 +420,51 @@ class VMware:
             vm_id (str): name of vm
             disk_size (int): size of Disk
             disk_type (str): type of disk
-        Returns (bool): status of operation
+            wait (bool): block until the task is done, else return a
+                        TaskHandle right after submission
+            disk_adapter (str): controller type of the disk, one of
+                        VMWARE.DISKADAPTER
+        Returns (bool|TaskHandle): status of operation
+        Raises: VMwareError
+        """
+        try:
+            esx_vm = self.get_vm_in_dc(datacenter_name, vm_id)
+            return self._add_vdisk(
+                esx_vm, disk_size, disk_type, wait=wait, disk_adapter=disk_adapter
+            )
+        except Exception as ex:
+            LOG.error("Adding VDisk failed: %s", ex)
+            raise
+
+    def add_vdisks(self, datacenter_name, vm_id, disks, wait=True):
+        """
+        Adds several VDisks to vm with a single reconfigure task, controllers
+        are added when the existing ones are full
+        Args:
+            datacenter_name (str): name of the datacenter
+            vm_id (str): name of vm
+            disks (list): dicts with disk_size and optionally disk_type and
+                        disk_adapter, one of VMWARE.DISKADAPTER, SCSI if unset
+            wait (bool): block until the task is done, else return a
+                        TaskHandle right after submission
+        Returns (bool|str|TaskHandle): status of operation, "unchanged" if
+            disks is empty
         Raises: VMwareError
         """
         try:
             esx_vm = self.get_vm_in_dc(datacenter_name, vm_id)
-            return self._add_vdisk(esx_vm, self.si, disk_size, disk_type)
+            config_spec = self._build_update_spec(esx_vm, add_disks=disks)
+            if self._is_empty_spec(config_spec):
+                return self._unchanged(wait)
+
+            return self.update_vm(esx_vm, config_spec, wait=wait)
         except Exception as ex:
-            LOG.error("Adding VDisk failed: %s" % ex)
+            LOG.error("Adding VDisks failed: %s", ex)
             raise
 
-    def add_virtual_network(self, datacenter_name, vm_id, network_name, nic_type):
+    def add_virtual_network(
+        self, datacenter_name, vm_id, network_name, nic_type, wait=True
+    ):
         """
         Adds Virtual Network to vm
         Args:
@@ -99,57 +472,44 @@ class VMware:
             vm_id (str): name of vm
             network_name (str): network name
             nic_type (str): type of nic
-        Returns (bool): status of operation
+            wait (bool): block until the task is done, else return a
+                        TaskHandle right after submission
+        Returns (bool|TaskHandle): status of operation
         Raises: VMwareError
         """
         try:
             esx_vm = self.get_vm_in_dc(datacenter_name, vm_id)
-            return self._add_virtual_network(self.si, esx_vm, network_name, nic_type)
+            return self._add_virtual_network(
+                self.si, esx_vm, network_name, nic_type, wait=wait
+            )
         except Exception as ex:
-            LOG.error("Adding  VNIC failed: %s" % ex)
+            LOG.error("Adding  VNIC failed: %s", ex)
             raise
 
-    def update_vm_networks_in_nic(self, datacenter_name, vm_id, network):
+    def update_vm_networks_in_nic(self, datacenter_name, vm_id, network, wait=True):
         """
         Updates VM Network of NIC of vm
         Args:
             datacenter_name (str): name of the datacenter
             vm_id (str): name of vm
             network (str): vm network name
-        Returns (bool): status of operation
+            wait (bool): block until the task is done, else return a
+                        TaskHandle right after submission
+        Returns (bool|str|TaskHandle): status of operation, "unchanged" if the
+            vm already is in the requested state
         Raises: VMwareError
         """
         try:
             vm = self.get_vm_in_dc(datacenter_name, vm_id)
-            device_change = []
-            for device in vm.config.hardware.device:
-                if isinstance(device, vim.vm.device.VirtualEthernetCard):
-                    nicspec = vim.vm.device.VirtualDeviceSpec()
-                    nicspec.operation = vim.vm.device.VirtualDeviceSpec.Operation.edit
-                    nicspec.device = device
-                    nicspec.device.wakeOnLanEnabled = True
-
-                    nicspec.device.backing = (
-                        vim.vm.device.VirtualEthernetCard.NetworkBackingInfo()
-                    )
-                    nicspec.device.backing.network = vmware_utils.get_obj(
-                        self.si.content, [vim.Network], network
-                    )
-                    nicspec.device.backing.deviceName = network
+            nicspec = self._nic_edit_spec(self._vm_devices(vm), network)
+            if nicspec is None:
+                return self._unchanged(wait)
 
-                    nicspec.device.connectable = (
-                        vim.vm.device.VirtualDevice.ConnectInfo()
-                    )
-                    nicspec.device.connectable.startConnected = True
-                    nicspec.device.connectable.allowGuestControl = True
-                    device_change.append(nicspec)
-                    break
-
-            config_spec = vim.vm.ConfigSpec(deviceChange=device_change)
+            config_spec = vim.vm.ConfigSpec(deviceChange=[nicspec])
 
-            return self.update_vm(vm, config_spec)
+            return self.update_vm(vm, config_spec, wait=wait)
         except Exception as ex:
-            LOG.error("Updating VM Network of NIC of VM failed: %s" % ex)
+            LOG.error("Updating VM Network of NIC of VM failed: %s", ex)
             raise
 
     def update_vcpu(self, datacenter_name, vm_id, num_vcpu):
@@ -167,7 +527,7 @@ class VMware:
                 datacenter_name, vm_id, num_vcpu=num_vcpu
             )
         except Exception as ex:
-            LOG.error("Updating vCPUs failed: %s" % ex)
+            LOG.error("Updating vCPUs failed: %s", ex)
             raise
 
     def update_core(self, datacenter_name, vm_id, num_cores):
@@ -185,7 +545,7 @@ class VMware:
                 datacenter_name, vm_id, num_cores=num_cores
             )
         except Exception as ex:
-            LOG.error("Updating cores failed: %s" % ex)
+            LOG.error("Updating cores failed: %s", ex)
             raise
 
     def update_memory(self, datacenter_name, vm_id, memory):
@@ -201,11 +561,17 @@ class VMware:
         try:
             return self.update_vcpu_core_memory(datacenter_name, vm_id, memory=memory)
         except Exception as ex:
-            LOG.error("Updating memory failed: %s" % ex)
+            LOG.error("Updating memory failed: %s", ex)
             raise
 
     def update_vcpu_core_memory(
-        self, datacenter_name, vm_id, num_vcpu=None, num_cores=None, memory=None
+        self,
+        datacenter_name,
+        vm_id,
+        num_vcpu=None,
+        num_cores=None,
+        memory=None,
+        wait=True,
     ):
         """
         Update vcpu, core and memory of vm
@@ -215,21 +581,22 @@ class VMware:
             num_vcpu (int): number of vcpu
             num_cores (int): number of cores
             memory (int): memory of vm
-        Returns (bool): status of operation
+            wait (bool): block until the task is done, else return a
+                        TaskHandle right after submission
+        Returns (bool|str|TaskHandle): status of operation, "unchanged" if the
+            vm already is in the requested state
         Raises: VMwareError
         """
         try:
             esx_vm = self.get_vm_in_dc(datacenter_name, vm_id)
-            config_spec = vim.vm.ConfigSpec()
-            if num_vcpu:
-                config_spec.numCPUs = num_vcpu
-            if num_cores:
-                config_spec.numCoresPerSocket = num_cores
-            if memory:
-                config_spec.memoryMB = memory
-            return self.update_vm(esx_vm, config_spec)
+            config_spec = self._build_update_spec(
+                esx_vm, num_vcpu=num_vcpu, num_cores=num_cores, memory=memory
+            )
+            if self._is_empty_spec(config_spec):
+                return self._unchanged(wait)
+            return self.update_vm(esx_vm, config_spec, wait=wait)
         except Exception as ex:
-            LOG.error("Update of VM failed: %s" % ex)
+            LOG.error("Update of VM failed: %s", ex)
             raise
 
     def update_disk(
@@ -240,6 +607,7 @@ class VMware:
         disk_slot,
         disk_size=None,
         disk_mode=None,
+        wait=True,
     ):
         """
         Update disk of vm
@@ -250,68 +618,69 @@ class VMware:
             disk_slot (int): Slot for Disk
             disk_size (int): Size of Disk
             disk_mode (str): Mode of Disk
-        Returns (bool): status of operation
+            wait (bool): block until the task is done, else return a
+                        TaskHandle right after submission
+        Returns (bool|str|TaskHandle): status of operation, "unchanged" if the
+            vm already is in the requested state
         Raises: VMwareError
         """
         try:
             vm = self.get_vm_in_dc(datacenter_name, vm_id)
-            disk = None
-            for device in vm.config.hardware.device:
-                if isinstance(device, vim.vm.device.VirtualDisk):
-                    if (
-                        device.controllerKey == controller_key
-                        and device.unitNumber == disk_slot
-                    ):
-                        disk = device
-                        break
-            if disk is None:
-                raise Exception("Failed to find disk for VM")
-
-            if disk_size:
-                disk.capacityInKB = int(1048576 * disk_size)
-            if disk_mode:
-                disk.backing.diskMode = disk_mode
+            devSpec = self._disk_edit_spec(
+                self._vm_devices(vm),
+                controller_key,
+                disk_slot,
+                disk_size=disk_size,
+                disk_mode=disk_mode,
+            )
+            if devSpec is None:
+                return self._unchanged(wait)
 
             spec = vim.vm.ConfigSpec()
-            devSpec = vim.vm.device.VirtualDeviceSpec(device=disk, operation="edit")
             spec.deviceChange.append(devSpec)
 
-            return self.update_vm(vm, spec)
+            return self.update_vm(vm, spec, wait=wait)
         except Exception as ex:
-            LOG.error("Updating Disk failed: %s" % ex)
+            LOG.error("Updating Disk failed: %s", ex)
             raise
 
-    # TODO: Update VM based on Values Given in kwargs
-    '''
-    def update(self, datacenter_name, vm_id, **kwargs):
+    def update(self, datacenter_name, vm_id, wait=True, **kwargs):
         """
-        Update fields of VM specified in kwargs
+        Update fields of VM specified in kwargs with a single reconfigure task
         Args:
             datacenter_name (str): name of the datacenter
             vm_id (str): name of vm
-            controller_key (int): Key of Controller
-            disk_slot (int): Slot for Disk
-            disk_size (int): Size of Disk
-            disk_mode (str): Mode of Disk
-        Returns (bool): status of operation
+            wait (bool): block until the task is done, else return a
+                        TaskHandle right after submission
+            num_vcpu (int): number of vcpu
+            num_cores (int): number of cores
+            memory (int): memory of vm
+            disks (list): disk edits, dicts with controller_key, disk_slot
+                        and optionally disk_size and disk_mode
+            add_disks (list): disks to add, dicts with disk_size and
+                        optionally disk_type and disk_adapter
+            network (str): vm network name for the first NIC
+            add_nics (list): NICs to add, dicts with network_name and nic_type
+        Returns (bool|str|TaskHandle): status of operation, "unchanged" if the
+            vm already is in the requested state
         Raises: VMwareError
         """
 
         try:
+            unknown = sorted(set(kwargs) - set(UPDATE_FIELDS))
+            if unknown:
+                raise VMwareError(
+                    "Unsupported fields for update: {0}".format(", ".join(unknown))
+                )
             esx_vm = self.get_vm_in_dc(datacenter_name, vm_id)
-            config_spec = vim.vm.ConfigSpec()
-            if kwargs.get("num_vcpu", None):
-                config_spec.numCPUs = kwargs.get("num_vcpu")
-            if kwargs.get("num_cores", None):
-                config_spec.numCoresPerSocket = kwargs.get("num_cores")
-            if kwargs.get("memory", None):
-                config_spec.memoryMB = kwargs.get("memory")
-
-            return self.update_vm(esx_vm, config_spec)
+            config_spec = self._build_update_spec(esx_vm, **kwargs)
+            if self._is_empty_spec(config_spec):
+                return self._unchanged(wait)
+
+            return self.update_vm(esx_vm, config_spec, wait=wait)
         except Exception as ex:
-            LOG.error("Updating vCPUs failed: %s" % ex)
+            LOG.error("Updating VM failed: %s", ex)
             raise
-    '''
 
     def poweron_vm(self, datacenter_name, vm_id):
         """
@@ -325,7 +694,7 @@ class VMware:
         try:
             return self.change_vm_power_state(datacenter_name, vm_id, "poweron")
         except Exception as ex:
-            LOG.error("VM power on failed: %s" % ex)
+            LOG.error("VM power on failed: %s", ex)
             raise
 
     def poweroff_vm(self, datacenter_name, vm_id):
@@ -342,7 +711,7 @@ class VMware:
                 datacenter_name, vm_id, VMWARE.OPERATIONS.POWER_OFF
             )
         except Exception as ex:
-            LOG.error("VM power off failed: %s" % ex)
+            LOG.error("VM power off failed: %s", ex)
             raise
 
     def reboot_vm(self, datacenter_name, vmname):
@@ -357,7 +726,7 @@ class VMware:
         try:
             return self.change_vm_power_state(datacenter_name, vmname, "reboot")
         except Exception as ex:
-            LOG.error("VM reboot failed: %s" % ex)
+            LOG.error("VM reboot failed: %s", ex)
             raise
 
     def suspend_vm(self, datacenter_name, vmname):
@@ -372,47 +741,33 @@ class VMware:
         try:
             return self.change_vm_power_state(datacenter_name, vmname, "suspend")
         except Exception as ex:
-            LOG.error("VM suspend failed: %s" % ex)
+            LOG.error("VM suspend failed: %s", ex)
             raise
 
     # operation, one of:
     # [poweron | poweroff | reset | suspend | reboot | shutdown | standby]
-    def change_vm_power_state(self, datacenter_name, vm_id, operation):
+    def change_vm_power_state(self, datacenter_name, vm_id, operation, wait=True):
         """
         Do power operation on VM
         Args:
             datacenter_name (str): name of the datacenter
             vm_id (str): unique identifier of the vm
             operation (str): operation to be performed
-        Returns (bool): status of operation
+            wait (bool): block until the task is done, else return a
+                        TaskHandle right after submission
+        Returns (bool|TaskHandle): status of operation
         Raises: VMwareError
         """
         vm = self.get_vm_in_dc(datacenter_name, vm_id)
 
-        operation_task_map = {
-            VMWARE.OPERATIONS.POWER_OFF: vm.PowerOffVM_Task,
-            VMWARE.OPERATIONS.POWER_ON: vm.PowerOnVM_Task,
-            VMWARE.OPERATIONS.RESET: vm.ResetVM_Task,
-            VMWARE.OPERATIONS.SUSPEND: vm.SuspendVM_Task,
-            VMWARE.OPERATIONS.REBOOT: vm.RebootGuest,
-            VMWARE.OPERATIONS.SHUTDOWN: vm.ShutdownGuest,
-            VMWARE.OPERATIONS.STANDBY: vm.StandbyGuest,
-        }
+        operation_task_map = self._power_operation_map(vm)
+        power_state_faults = _vim_type_map("POWER_STATE_FAULTS")
 
         try:
-            if operation in [
-                VMWARE.OPERATIONS.POWER_OFF,
-                VMWARE.OPERATIONS.POWER_ON,
-                VMWARE.OPERATIONS.RESET,
-                VMWARE.OPERATIONS.SUSPEND,
-            ]:
+            if operation in TASK_POWER_OPERATIONS:
                 task = operation_task_map[operation]()
-                vmware_utils.wait_for_tasks(self.si, [task])
-            elif operation in [
-                VMWARE.OPERATIONS.REBOOT,
-                VMWARE.OPERATIONS.SHUTDOWN,
-                VMWARE.OPERATIONS.STANDBY,
-            ]:
+                return self._submit_task(task, wait, tolerate=power_state_faults)
+            elif operation in GUEST_POWER_OPERATIONS:
                 operation_task_map[operation]()
             else:
                 raise VMwareError(
@@ -422,33 +777,159 @@ class VMware:
                     "shutdown and suspend" % operation
                 )
 
-        except (vim.fault.InvalidPowerState, vim.fault.InvalidState) as e:
+        except power_state_faults:
             pass
 
         except Exception as ex:
-            LOG.error("VMware power_op failed: %s" % ex)
+            LOG.error("VMware power_op failed: %s", ex)
             raise
+        if not wait:
+            return TaskHandle.completed(self.enable_task_watcher())
         return True
 
-    def delete_vm(self, datacenter_name, vm_id):
+    def change_power_state_bulk(
+        self,
+        datacenter_name,
+        vm_ids,
+        operation,
+        concurrency=DEFAULT_BULK_CONCURRENCY,
+    ):
+        """
+        Do power operation on many VMs, resolving them in one property
+        collector pass and keeping at most concurrency tasks in flight
+        Args:
+            datacenter_name (str): name of the datacenter
+            vm_ids (list): unique identifiers of the vms
+            operation (str): operation to be performed
+            concurrency (int): number of tasks running at the same time
+        Returns (dict): vm id -> {"status": VMWARE.TASKSTATUS, "error": str},
+            vms already in the requested power state are reported unchanged.
+            task_timeout bounds the whole call, vms whose task was not
+            submitted or did not complete by then are reported failed
+        Raises: VMwareError
+        """
+        if operation not in TASK_POWER_OPERATIONS + GUEST_POWER_OPERATIONS:
+            raise VMwareError(
+                "Invalid Operation name '%s', Valid "
+                "operations are poweron, poweroff, "
+                "reset, standby, reboot, "
+                "shutdown and suspend" % operation
+            )
+
+        deadline = None
+        if self.task_timeout is not None:
+            deadline = time.time() + self.task_timeout
+
+        def _remaining():
+            if deadline is None:
+                return None
+            return max(deadline - time.time(), 0)
+
+        vms = self.get_vms_in_dc(datacenter_name, vm_ids)
+        power_state_faults = _vim_type_map("POWER_STATE_FAULTS")
+        report = {}
+        lock = threading.Lock()
+        slots = threading.BoundedSemaphore(concurrency)
+        futures = []
+
+        def _record(vm_id, status, error=None):
+            with lock:
+                report[vm_id] = {"status": status, "error": error}
+
+        def _on_done(vm_id, future):
+            slots.release()
+            ex = future.exception()
+            if ex is None:
+                _record(vm_id, VMWARE.TASKSTATUS.SUCCESS)
+            elif isinstance(ex, power_state_faults):
+                _record(vm_id, VMWARE.TASKSTATUS.UNCHANGED)
+            else:
+                _record(vm_id, VMWARE.TASKSTATUS.FAILED, getattr(ex, "msg", str(ex)))
+
+        watcher = self.enable_task_watcher()
+        for vm_id in vm_ids:
+            vm = vms.get(vm_id)
+            if vm is None:
+                _record(
+                    vm_id,
+                    VMWARE.TASKSTATUS.NOT_FOUND,
+                    "VM with id: {0} not found".format(vm_id),
+                )
+                continue
+
+            if not slots.acquire(timeout=_remaining()):
+                _record(
+                    vm_id,
+                    VMWARE.TASKSTATUS.FAILED,
+                    "Task not submitted within task_timeout",
+                )
+                continue
+            try:
+                result = self._power_operation_map(vm)[operation]()
+            except power_state_faults:
+                slots.release()
+                _record(vm_id, VMWARE.TASKSTATUS.UNCHANGED)
+                continue
+            except Exception as ex:
+                slots.release()
+                LOG.error("VMware power_op of VM %s failed: %s", vm_id, ex)
+                _record(vm_id, VMWARE.TASKSTATUS.FAILED, getattr(ex, "msg", str(ex)))
+                continue
+
+            if operation in GUEST_POWER_OPERATIONS:
+                slots.release()
+                _record(vm_id, VMWARE.TASKSTATUS.SUCCESS)
+                continue
+            future = watcher.watch(result)
+            future.add_done_callback(lambda f, vm_id=vm_id: _on_done(vm_id, f))
+            futures.append(future)
+
+        not_done = futures_wait(futures, _remaining()).not_done
+        if not_done:
+            LOG.error("%s power tasks did not complete in time", len(not_done))
+        # a copy, tasks finishing late still report into report
+        with lock:
+            snapshot = dict((vm_id, dict(entry)) for vm_id, entry in report.items())
+        for vm_id in vm_ids:
+            snapshot.setdefault(
+                vm_id,
+                {
+                    "status": VMWARE.TASKSTATUS.FAILED,
+                    "error": "Task did not complete in time",
+                },
+            )
+        return snapshot
+
+    def delete_vm(self, datacenter_name, vm_id, wait=True):
         """
         Delete vm in the given datacenter
         Args:
             datacenter_name (str): datacenter name
             vm_id (str): instance id of vm to be deleted
-        Returns (bool): status of operation
+            wait (bool): block until the task is done, else return a
+                        TaskHandle right after submission
+        Returns (bool|TaskHandle): status of operation
         Raises: VMwareError
         """
         try:
             vm = self.get_vm_in_dc(datacenter_name, vm_id)
             if not vm:
                 raise VMwareError("VM with id: {0} not found".format(vm_id))
-            if format(vm.runtime.powerState) == VMWARE.STATE.RUNNING:
+            running = self._is_running(vm)
+            if not wait:
+                watcher = self.enable_task_watcher()
+                if running:
+                    handle = TaskHandle(watcher, vm.PowerOffVM_Task())
+                else:
+                    handle = TaskHandle.completed(watcher)
+                return handle.then(vm.Destroy_Task)
+
+            if running:
                 task = vm.PowerOffVM_Task()
-                vmware_utils.wait_for_tasks(self.si, [task])
+                self._wait_for_tasks([task])
 
             task = vm.Destroy_Task()
-            vmware_utils.wait_for_tasks(self.si, [task])
+            self._wait_for_tasks([task])
             return True
         except vmodl.fault.ManagedObjectNotFound:
             raise VMwareError(
@@ -456,14 +937,15 @@ class VMware:
                 "'{1}'".format(datacenter_name, vm_id)
             )
         except Exception as ex:
-            LOG.error("VMware delete_vm failed: %s" % ex)
+            LOG.error("VMware delete_vm failed: %s", ex)
             raise
 
-    def get_datacenter(self, dc_name):
+    def get_datacenter(self, dc_name, use_cache=True):
         """
         Returns datacenter object given the datacenter name
         Args:
             dc_name (str) : datacenter name
+            use_cache (bool) : reuse a previously resolved datacenter reference
         Returns:
             (vim.Datacenter) datacenter object
         Raises: VMwareError
@@ -471,14 +953,34 @@ class VMware:
         try:
             datacenter = None
             if dc_name:
-                datacenter = vmware_utils.get_objects_by_prop(
-                    self.si, prop="name", obj_type=vim.Datacenter, obj_value=dc_name
-                )
+                if use_cache:
+                    datacenter = self._datacenter_cache.get(dc_name)
+                if datacenter is None:
+                    datacenter = vmware_utils.get_objects_by_prop(
+                        self.si,
+                        prop="name",
+                        obj_type=vim.Datacenter,
+                        obj_value=dc_name,
+                        view_manager=self.views,
+                        property_indexes=self._property_indexes,
+                        content=self.content,
+                    )
+                    self._datacenter_cache.set(dc_name, datacenter)
             return datacenter
         except Exception as ex:
-            LOG.error("VMware get datacenter failed: %s" % ex)
+            LOG.error("VMware get datacenter failed: %s", ex)
             raise
 
+    def invalidate_datacenter_cache(self, dc_name=None):
+        """
+        Forget cached datacenter references
+        Args:
+            dc_name (str) : datacenter name to forget, all datacenters if None
+        Returns:
+            None
+        """
+        self._datacenter_cache.invalidate(dc_name)
+
     def get_vm_in_dc(self, datacenter_name, vm_id):
         """
         Get vm in a given datacenter
@@ -494,26 +996,102 @@ class VMware:
             raise VMwareError(
                 "Datacenter with name: '{0}' not found".format(datacenter_name)
             )
-        vm = self.si.content.searchIndex.FindByUuid(datacenter, vm_id, True, True)
+        try:
+            if self._vm_index is not None:
+                vm = self._vm_index.lookup(datacenter, vm_id)
+                if vm is not None:
+                    return vm
+            vm = self.content.searchIndex.FindByUuid(datacenter, vm_id, True, True)
+        except vmodl.fault.ManagedObjectNotFound:
+            # cached datacenter reference went stale (deleted or re-created),
+            # resolve it again and retry once
+            self.invalidate_datacenter_cache(datacenter_name)
+            datacenter = self.get_datacenter(datacenter_name, use_cache=False)
+            vm = self.content.searchIndex.FindByUuid(datacenter, vm_id, True, True)
         if not vm:
             raise VMwareError("VM with id: {0} not found".format(vm_id))
+        if self._vm_index is not None:
+            self._vm_index.add(datacenter, vm_id, vm)
         return vm
 
-    def update_vm(self, esx_vm, esx_config_spec):
+    def get_network(self, network_name):
+        """
+        Get network details given the network name
+        Args:
+            network_name (str) : name of a standard, opaque or distributed
+                        port group network
+        Returns:
+            (NetworkInfo) network details
+        Raises: VMwareError
+        """
+        network = self.networks.get(network_name)
+        if network is None:
+            raise VMwareError("Network with name: '{0}' not found".format(network_name))
+        return network
+
+    def get_vms_in_dc(self, datacenter_name, vm_ids):
+        """
+        Get several vms in a given datacenter with one property collector pass
+        Args:
+            datacenter_name (str) : datacenter name
+            vm_ids (list) : unique ids of the esx vms
+        Returns:
+            (dict) vm id -> vim.VirtualMachine, vms that were not found are left out
+        Raises: VMwareError
+        """
+        datacenter = self.get_datacenter(datacenter_name)
+        if not datacenter:
+            raise VMwareError(
+                "Datacenter with name: '{0}' not found".format(datacenter_name)
+            )
+        wanted = dict((vm_id.lower(), vm_id) for vm_id in vm_ids)
+        view = vmware_utils.get_container_view(
+            self.si,
+            obj_type=[vim.VirtualMachine],
+            container=datacenter,
+            view_manager=self.views,
+            content=self.content,
+        )
+        vms = {}
+        for record in vmware_utils.iter_properties(
+            self.si,
+            view,
+            vim.VirtualMachine,
+            path_set=["config.instanceUuid"],
+            content=self.content,
+        ):
+            uuid = record.values[0]
+            if uuid and uuid.lower() in wanted:
+                vms[wanted[uuid.lower()]] = record.obj
+        return vms
+
+    def update_vm(self, esx_vm, esx_config_spec, wait=True):
         """
         Update vm properties
         Args:
             esx_vm (vim.VirtualMachine) : esx vm to update
             esx_config_spec (vim.VirtualMachineConfigSpec)) : config spec for the vm
-        Returns (bool): status of operation
+            wait (bool): block until the task is done, else return a
+                        TaskHandle right after submission
+        Returns (bool|TaskHandle): status of operation
         Raises: VMwareError
         """
         if esx_vm:
+            if self._coalescer is not None:
+                future = self._coalescer.submit(esx_vm, esx_config_spec)
+                if not wait:
+                    return TaskHandle(self._task_watcher, None, future=future)
+                try:
+                    return future.result(self.task_timeout)
+                except FuturesTimeoutError:
+                    raise TaskTimeoutError(
+                        "Reconfigure of {0} did not complete within {1} "
+                        "seconds".format(esx_vm, self.task_timeout)
+                    )
             task = esx_vm.ReconfigVM_Task(esx_config_spec)
-            vmware_utils.wait_for_tasks(self.si, [task])
-            return True
+            return self._submit_task(task, wait)
 
-    def _add_virtual_network(self, si, vm, network_name, nic_type):
+    def _add_virtual_network(self, si, vm, network_name, nic_type, wait=True):
         """
         Update vm properties
         Args:
@@ -521,94 +1099,433 @@ class VMware:
             vm: Virtual Machine Object
             network_name: Name of the Virtual Network
             nic_type: Type of the Virtual Network
+            wait: block until the task is done, else return a TaskHandle
         Returns: status of operation
         Raises: VMwareError
         """
         spec = vim.vm.ConfigSpec()
         nic_changes = []
 
-        nic_spec = vim.vm.device.VirtualDeviceSpec()
-        nic_spec.operation = vim.vm.device.VirtualDeviceSpec.Operation.add
-
-        nic_spec.device = ESX_VM_NIC_ADAPTER_MAP[nic_type]()
+        nic_changes.append(self._nic_add_spec(network_name, nic_type))
+        spec.deviceChange = nic_changes
 
-        nic_spec.device.deviceInfo = vim.Description()
-        nic_spec.device.deviceInfo.summary = "vCenter API to add vnic"
+        return self.update_vm(vm, spec, wait=wait)
 
-        content = si.RetrieveContent()
-        network = vmware_utils.get_obj(content, [vim.Network], network_name)
-        if isinstance(network, vim.OpaqueNetwork):
-            nic_spec.device.backing = (
-                vim.vm.device.VirtualEthernetCard.OpaqueNetworkBackingInfo()
+    def _nic_uses_network(self, device, network):
+        """
+        Check whether a NIC is connected to a network the way _nic_edit_spec
+        would set it up
+        Args:
+            device: virtual ethernet card of the vm
+            network: NetworkInfo of the network
+        Returns: (bool) True if editing the NIC would change nothing
+        """
+        backing = device.backing
+        nic_backing = vim.vm.device.VirtualEthernetCard
+        if network.kind == VMWARE.NETWORKKIND.OPAQUE:
+            same_network = (
+                isinstance(backing, nic_backing.OpaqueNetworkBackingInfo)
+                and backing.opaqueNetworkId == network.opaque_network_id
             )
-            nic_spec.device.backing.opaqueNetworkType = (
-                network.summary.opaqueNetworkType
+        elif network.kind == VMWARE.NETWORKKIND.PORTGROUP:
+            same_network = (
+                isinstance(backing, nic_backing.DistributedVirtualPortBackingInfo)
+                and backing.port.portgroupKey == network.portgroup_key
+                and backing.port.switchUuid == network.switch_uuid
             )
-            nic_spec.device.backing.opaqueNetworkId = network.summary.opaqueNetworkId
         else:
-            nic_spec.device.backing = (
-                vim.vm.device.VirtualEthernetCard.NetworkBackingInfo()
+            same_network = isinstance(backing, nic_backing.NetworkBackingInfo) and str(
+                backing.network
+            ) == str(network.obj)
+        connectable = device.connectable
+        return bool(
+            same_network
+            and device.wakeOnLanEnabled
+            and connectable is not None
+            and connectable.startConnected
+            and connectable.allowGuestControl
+        )
+
+    def _is_empty_spec(self, spec):
+        """
+        Check whether a config spec changes anything
+        Args:
+            spec: vim.vm.ConfigSpec
+        Returns: (bool) True if no field of the spec is set
+        """
+        for prop in spec._GetPropertyList():
+            value = getattr(spec, prop.name)
+            if value is not None and not (isinstance(value, list) and not value):
+                return False
+        return True
+
+    def _vm_properties(self, vm, paths):
+        """
+        Fetch property paths of a vm in one round trip, without the rest of
+        the objects they belong to, e.g. config.hardware.device without
+        extraConfig
+        Args:
+            vm: Virtual Machine Object
+            paths: property paths
+        Returns: (PropertyRecord) the values, None for the ones not set
+        Raises: vmodl.fault.ManagedObjectNotFound if the vm is gone
+        """
+        return vmware_utils.get_properties(self.content.propertyCollector, vm, paths)
+
+    def _vm_property(self, vm, path):
+        """
+        Fetch one property path of a vm, see _vm_properties()
+        Args:
+            vm: Virtual Machine Object
+            path: property path
+        Returns: property value, None if not set
+        Raises: vmodl.fault.ManagedObjectNotFound if the vm is gone
+        """
+        return self._vm_properties(vm, [path])[path]
+
+    def _vm_devices(self, vm):
+        """
+        Returns (list) the virtual devices of a vm
+        """
+        return self._vm_property(vm, "config.hardware.device") or []
+
+    def _is_running(self, vm):
+        """
+        Returns (bool) whether a vm is powered on
+        """
+        power_state = self._vm_property(vm, "runtime.powerState")
+        return format(power_state) == VMWARE.STATE.RUNNING
+
+    def _unchanged(self, wait):
+        """
+        Result of an update that was skipped as the vm already matches it
+        Args:
+            wait: whether the caller asked to block
+        Returns (str|TaskHandle): "unchanged", or a finished handle with it
+        """
+        if not wait:
+            return TaskHandle.completed(
+                self.enable_task_watcher(), VMWARE.TASKSTATUS.UNCHANGED
             )
-            nic_spec.device.backing.useAutoDetect = False
-            nic_spec.device.backing.network = network
-            # nic_spec.device.backing.deviceName = network
-            nic_spec.device.backing.deviceName = network_name
+        return VMWARE.TASKSTATUS.UNCHANGED
 
-        nic_spec.device.connectable = vim.vm.device.VirtualDevice.ConnectInfo()
-        nic_spec.device.connectable.startConnected = True
-        nic_spec.device.connectable.allowGuestControl = True
-        nic_spec.device.connectable.connected = False
-        nic_spec.device.connectable.status = "untried"
-        nic_spec.device.wakeOnLanEnabled = True
-        nic_spec.device.addressType = "assigned"
+    def _submit_task(self, task, wait, tolerate=()):
+        """
+        Wait for a submitted task or hand out a handle to it
+        Args:
+            task (vim.Task): submitted task
+            wait (bool): block until the task is done
+            tolerate (tuple): fault types that count as success of the handle
+        Returns (bool|TaskHandle): True once done, or a handle if wait is False
+        """
+        if not wait:
+            return TaskHandle(self.enable_task_watcher(), task, tolerate=tolerate)
+        self._wait_for_tasks([task])
+        return True
 
-        nic_changes.append(nic_spec)
-        spec.deviceChange = nic_changes
+    def _wait_for_tasks(self, tasks):
+        """
+        Wait for tasks, through the shared task watcher if enabled. Either
+        way task_timeout bounds the wait for all tasks together
+        Args:
+            tasks (list): vim.Task objects to wait for
+        Returns: None
+        Raises: info.error of the first failed task, TaskTimeoutError if the
+            tasks did not complete within task_timeout
+        """
+        try:
+            if self._task_watcher is not None:
+                self._task_watcher.wait(tasks, timeout=self.task_timeout)
+            else:
+                vmware_utils.wait_for_tasks(
+                    self.si, tasks, timeout=self.task_timeout, content=self.content
+                )
+        except (TimeoutError, FuturesTimeoutError) as ex:
+            raise TaskTimeoutError(str(ex))
+
+    def _power_operation_map(self, vm):
+        """
+        Map power operations to the vm methods performing them
+        Args:
+            vm (vim.VirtualMachine): vm to operate on
+        Returns (dict): operation name -> bound method
+        """
+        return {
+            VMWARE.OPERATIONS.POWER_OFF: vm.PowerOffVM_Task,
+            VMWARE.OPERATIONS.POWER_ON: vm.PowerOnVM_Task,
+            VMWARE.OPERATIONS.RESET: vm.ResetVM_Task,
+            VMWARE.OPERATIONS.SUSPEND: vm.SuspendVM_Task,
+            VMWARE.OPERATIONS.REBOOT: vm.RebootGuest,
+            VMWARE.OPERATIONS.SHUTDOWN: vm.ShutdownGuest,
+            VMWARE.OPERATIONS.STANDBY: vm.StandbyGuest,
+        }
 
-        return self.update_vm(vm, spec)
+    def _network_backing(self, network):
+        """
+        Build NIC backing for a network
+        Args:
+            network (NetworkInfo): network to back the NIC with
+        Returns: (vim.vm.device.VirtualDevice.BackingInfo) NIC backing
+        """
+        if network.kind == VMWARE.NETWORKKIND.OPAQUE:
+            backing = vim.vm.device.VirtualEthernetCard.OpaqueNetworkBackingInfo()
+            backing.opaqueNetworkType = network.opaque_network_type
+            backing.opaqueNetworkId = network.opaque_network_id
+        elif network.kind == VMWARE.NETWORKKIND.PORTGROUP:
+            backing = (
+                vim.vm.device.VirtualEthernetCard.DistributedVirtualPortBackingInfo()
+            )
+            backing.port = vim.dvs.PortConnection()
+            backing.port.switchUuid = network.switch_uuid
+            backing.port.portgroupKey = network.portgroup_key
+        else:
+            backing = vim.vm.device.VirtualEthernetCard.NetworkBackingInfo()
+            backing.useAutoDetect = False
+            backing.network = network.obj
+            backing.deviceName = network.name
+        return backing
 
-    def _add_vdisk(self, vm, disk_size, disk_type):
+    def _add_vdisk(
+        self,
+        vm,
+        disk_size,
+        disk_type,
+        wait=True,
+        disk_adapter=VMWARE.DISKADAPTER.SCSI,
+    ):
         """
         Update vm properties
         Args:
             vm: Virtual Machine Object
             disk_size: Size of Disk
             disk_type: Type of Disk
+            wait: block until the task is done, else return a TaskHandle
+            disk_adapter: controller type of the disk
         Returns: status of operation
         Raises: VMwareError
         """
         spec = vim.vm.ConfigSpec()
-        # get all disks on a VM, set unit_number to the next available
-        unit_number = 0
-        for dev in vm.config.hardware.device:
-            if hasattr(dev.backing, "fileName"):
-                unit_number = int(dev.unitNumber) + 1
-                # unit_number 7 reserved for scsi controller
-                if unit_number == 7:
-                    unit_number += 1
-                if unit_number >= 16:
-                    LOG.error("we don't support this many disks")
-                    return
-            if isinstance(dev, vim.vm.device.VirtualSCSIController):
-                controller = dev
-
-        # add disk here
-        dev_changes = []
-        new_disk_kb = int(disk_size) * 1024 * 1024
-        disk_spec = vim.vm.device.VirtualDeviceSpec()
-        disk_spec.fileOperation = "create"
-        disk_spec.operation = vim.vm.device.VirtualDeviceSpec.Operation.add
-        disk_spec.device = vim.vm.device.VirtualDisk()
-        disk_spec.device.backing = vim.vm.device.VirtualDisk.FlatVer2BackingInfo()
-
-        if disk_type == "thin":
-            disk_spec.device.backing.thinProvisioned = True
-
-        disk_spec.device.backing.diskMode = "persistent"
-        disk_spec.device.unitNumber = unit_number
-        disk_spec.device.capacityInKB = new_disk_kb
-        disk_spec.device.controllerKey = controller.key
-        dev_changes.append(disk_spec)
+        dev_changes = self._disk_add_specs(
+            self._vm_devices(vm),
+            [
+                {
+                    "disk_size": disk_size,
+                    "disk_type": disk_type,
+                    "disk_adapter": disk_adapter,
+                }
+            ],
+        )
+        if dev_changes is None:
+            raise VMwareError("Not enough free disk slots on the VM")
         spec.deviceChange = dev_changes
 
-        return self.update_vm(vm, spec)
+        return self.update_vm(vm, spec, wait=wait)
+
+    def _build_update_spec(
+        self,
+        vm,
+        num_vcpu=None,
+        num_cores=None,
+        memory=None,
+        disks=None,
+        add_disks=None,
+        network=None,
+        add_nics=None,
+    ):
+        """
+        Merge all requested changes that differ from the current config of
+        the vm into one config spec
+        Args:
+            vm: Virtual Machine Object
+            num_vcpu: number of vcpu
+            num_cores: number of cores
+            memory: memory of vm
+            disks: disk edits, see update()
+            add_disks: disks to add, see update()
+            network: vm network name for the first NIC
+            add_nics: NICs to add, see update()
+        Returns: (vim.vm.ConfigSpec) config spec with a single deviceChange list
+        Raises: VMwareError
+        """
+        config_spec = vim.vm.ConfigSpec()
+        # a single fetch serves every comparison, the device list only when
+        # devices change
+        paths = [
+            "config.hardware.numCPU",
+            "config.hardware.numCoresPerSocket",
+            "config.hardware.memoryMB",
+        ]
+        if disks or add_disks or network or add_nics:
+            paths.append("config.hardware.device")
+        hardware = self._vm_properties(vm, paths)
+        if num_vcpu and num_vcpu != hardware["config.hardware.numCPU"]:
+            config_spec.numCPUs = num_vcpu
+        if num_cores and num_cores != hardware["config.hardware.numCoresPerSocket"]:
+            config_spec.numCoresPerSocket = num_cores
+        if memory and memory != hardware["config.hardware.memoryMB"]:
+            config_spec.memoryMB = memory
+
+        devices = hardware.get("config.hardware.device") or []
+        # devices added by the same spec need distinct temporary keys
+        new_keys = itertools.count(-1, -1)
+
+        for disk in disks or []:
+            disk_spec = self._disk_edit_spec(devices, **disk)
+            if disk_spec is not None:
+                config_spec.deviceChange.append(disk_spec)
+        if add_disks:
+            disk_specs = self._disk_add_specs(devices, add_disks, new_keys)
+            if disk_specs is None:
+                raise VMwareError("Not enough free disk slots on the VM")
+            config_spec.deviceChange.extend(disk_specs)
+        if network:
+            nic_spec = self._nic_edit_spec(devices, network)
+            if nic_spec is not None:
+                config_spec.deviceChange.append(nic_spec)
+        for nic in add_nics or []:
+            config_spec.deviceChange.append(
+                self._nic_add_spec(nic["network_name"], nic["nic_type"], next(new_keys))
+            )
+        return config_spec
+
+    def _disk_edit_spec(
+        self, devices, controller_key, disk_slot, disk_size=None, disk_mode=None
+    ):
+        """
+        Build device spec editing an existing disk
+        Args:
+            devices: current devices of the vm
+            controller_key: Key of Controller
+            disk_slot: Slot for Disk
+            disk_size: Size of Disk
+            disk_mode: Mode of Disk
+        Returns: (vim.vm.device.VirtualDeviceSpec) device spec, None if the
+            disk already has the requested size and mode
+        Raises: Exception if the disk does not exist
+        """
+        disk = None
+        for device in devices:
+            if isinstance(device, vim.vm.device.VirtualDisk):
+                if (
+                    device.controllerKey == controller_key
+                    and device.unitNumber == disk_slot
+                ):
+                    disk = device
+                    break
+        if disk is None:
+            raise Exception("Failed to find disk for VM")
+
+        changed = False
+        if disk_size and disk.capacityInKB != int(1048576 * disk_size):
+            disk.capacityInKB = int(1048576 * disk_size)
+            changed = True
+        if disk_mode and disk.backing.diskMode != disk_mode:
+            disk.backing.diskMode = disk_mode
+            changed = True
+        if not changed:
+            return None
+
+        return vim.vm.device.VirtualDeviceSpec(device=disk, operation="edit")
+
+    def _disk_add_specs(self, devices, disks, new_keys=None):
+        """
+        Build device specs adding disks to the free slots of the vm, and
+        specs adding the controllers they need
+        Args:
+            devices: current devices of the vm
+            disks: dicts with disk_size and optionally disk_type and
+                disk_adapter
+            new_keys: iterator of temporary device keys
+        Returns: (list) device specs, None if the slots run out
+        Raises: VMwareError for an unsupported disk_adapter
+        """
+        if new_keys is None:
+            new_keys = itertools.count(-1, -1)
+        slots = DiskSlots(devices, new_keys)
+        dev_changes = []
+        for disk in disks:
+            adapter = disk.get("disk_adapter") or VMWARE.DISKADAPTER.SCSI
+            if adapter not in DISK_ADAPTERS:
+                raise VMwareError("Unsupported disk adapter: {0}".format(adapter))
+            slot = slots.allocate(adapter)
+            if slot is None:
+                LOG.error("No free %s slot left for disk", adapter)
+                return None
+
+            new_disk_kb = int(disk.get("disk_size", 1)) * 1024 * 1024
+            disk_spec = vim.vm.device.VirtualDeviceSpec()
+            disk_spec.fileOperation = "create"
+            disk_spec.operation = vim.vm.device.VirtualDeviceSpec.Operation.add
+            disk_spec.device = vim.vm.device.VirtualDisk()
+            disk_spec.device.key = next(new_keys)
+            disk_spec.device.backing = vim.vm.device.VirtualDisk.FlatVer2BackingInfo()
+
+            if disk.get("disk_type", "disk") == "thin":
+                disk_spec.device.backing.thinProvisioned = True
+
+            disk_spec.device.backing.diskMode = "persistent"
+            disk_spec.device.controllerKey, disk_spec.device.unitNumber = slot
+            disk_spec.device.capacityInKB = new_disk_kb
+            dev_changes.append(disk_spec)
+        # added controllers go first, the disks refer to their keys
+        return slots.controller_specs + dev_changes
+
+    def _nic_add_spec(self, network_name, nic_type, key=None):
+        """
+        Build device spec adding a NIC
+        Args:
+            network_name: Name of the Virtual Network
+            nic_type: Type of the Virtual Network
+            key: temporary device key
+        Returns: (vim.vm.device.VirtualDeviceSpec) device spec
+        Raises: VMwareError
+        """
+        nic_spec = vim.vm.device.VirtualDeviceSpec()
+        nic_spec.operation = vim.vm.device.VirtualDeviceSpec.Operation.add
+
+        nic_spec.device = _vim_type_map("ESX_VM_NIC_ADAPTER_MAP")[nic_type]()
+        if key is not None:
+            nic_spec.device.key = key
+
+        nic_spec.device.deviceInfo = vim.Description()
+        nic_spec.device.deviceInfo.summary = "vCenter API to add vnic"
+
+        network = self.get_network(network_name)
+        nic_spec.device.backing = self._network_backing(network)
+
+        nic_spec.device.connectable = vim.vm.device.VirtualDevice.ConnectInfo()
+        nic_spec.device.connectable.startConnected = True
+        nic_spec.device.connectable.allowGuestControl = True
+        nic_spec.device.connectable.connected = False
+        nic_spec.device.connectable.status = "untried"
+        nic_spec.device.wakeOnLanEnabled = True
+        nic_spec.device.addressType = "assigned"
+        return nic_spec
+
+    def _nic_edit_spec(self, devices, network_name):
+        """
+        Build device spec moving the first NIC to another network
+        Args:
+            devices: current devices of the vm
+            network_name: vm network name
+        Returns: (vim.vm.device.VirtualDeviceSpec) device spec, None if the
+            vm has no NIC or the NIC already is set up for the network
+        Raises: VMwareError
+        """
+        network = self.get_network(network_name)
+        for device in devices:
+            if isinstance(device, vim.vm.device.VirtualEthernetCard):
+                if self._nic_uses_network(device, network):
+                    return None
+                nicspec = vim.vm.device.VirtualDeviceSpec()
+                nicspec.operation = vim.vm.device.VirtualDeviceSpec.Operation.edit
+                nicspec.device = device
+                nicspec.device.wakeOnLanEnabled = True
+
+                nicspec.device.backing = self._network_backing(network)
+
+                nicspec.device.connectable = vim.vm.device.VirtualDevice.ConnectInfo()
+                nicspec.device.connectable.startConnected = True
+                nicspec.device.connectable.allowGuestControl = True
+                return nicspec
+        return None
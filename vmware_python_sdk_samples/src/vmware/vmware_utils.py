@@ -1,67 +1,253 @@
 # -*- coding: utf-8 -*-
 """ Common utils for vmware"""
 
+import math
+import time
+
 from ..logger import CustomLogger
 from pyVmomi import vim
 from pyVmomi import vmodl
 
 LOG = CustomLogger(__name__)
 
+# Objects per RetrievePropertiesEx page used by iter_properties
+DEFAULT_PAGE_SIZE = 1000
+
+# Seconds a single WaitForUpdatesEx call of wait_for_tasks_ex may block
+DEFAULT_MAX_WAIT_SECONDS = 30
+
+# Task properties followed while waiting for tasks
+TASK_INFO_PATHS = ["info.state", "info.error", "info.result", "info.progress"]
+
+
+class PropertyRecord(object):
+    """
+    Properties of one managed object as yielded by iter_properties.
+
+    Values are kept in a tuple aligned with names. When a path set is given
+    every record of a collection shares the same names tuple, so a record
+    costs three slots and one tuple rather than a dict.
+    """
+
+    __slots__ = ("obj", "names", "values")
+
+    def __init__(self, obj, names, values):
+        self.obj = obj
+        self.names = names
+        self.values = values
+
+    def get(self, name, default=None):
+        """
+        Return value of property name
+        Args:
+            name (str): property path, e.g. "runtime.powerState"
+            default (object): value returned when the property is not set
+        Returns:
+            property value or default
+        """
+        try:
+            return self.values[self.names.index(name)]
+        except ValueError:
+            return default
+
+    def __getitem__(self, name):
+        try:
+            return self.values[self.names.index(name)]
+        except ValueError:
+            raise KeyError(name)
+
+    def __iter__(self):
+        return iter(zip(self.names, self.values))
 
-def wait_for_tasks(service_instance, tasks):
+    def __repr__(self):
+        return "PropertyRecord({0!r}, {1!r})".format(self.obj, dict(self))
+
+
+class TaskOutcome(object):
+    """State, result or fault and progress of one task as seen by a waiter"""
+
+    __slots__ = ("task", "state", "result", "error", "progress", "timed_out")
+
+    def __init__(self, task):
+        self.task = task
+        self.state = None
+        self.result = None
+        self.error = None
+        self.progress = None
+        self.timed_out = False
+
+    @property
+    def done(self):
+        """(bool) whether the task finished, successfully or not"""
+        return self.state in (vim.TaskInfo.State.success, vim.TaskInfo.State.error)
+
+    @property
+    def succeeded(self):
+        """(bool) whether the task finished successfully"""
+        return self.state == vim.TaskInfo.State.success
+
+    def apply(self, change_set):
+        """
+        Apply property changes of the task
+        Args:
+            change_set (list): vmodl.query.PropertyCollector.Change objects
+        Returns:
+            None
+        """
+        for change in change_set:
+            if change.name == "info":
+                self.state = change.val.state
+                self.result = change.val.result
+                self.error = change.val.error
+                self.progress = change.val.progress
+            elif change.name == "info.state":
+                self.state = change.val
+            elif change.name == "info.result":
+                self.result = change.val
+            elif change.name == "info.error":
+                self.error = change.val
+            elif change.name == "info.progress":
+                self.progress = change.val
+
+    def __repr__(self):
+        return "TaskOutcome({0!r}, {1!r})".format(self.task, self.state)
+
+
+def wait_for_tasks(
+    service_instance, tasks, timeout=None, progress_callback=None, content=None
+):
     """Given the service instance si and tasks, it returns after all the
        tasks are complete
     Args:
         service_instance (vim.ServiceInstance) : root object for vcenter
                     inventory traversal
         tasks (vim.Task) : (create/ update/ delete etc) tasks to wait for completion
+        timeout (float) : overall seconds to wait, forever if None
+        progress_callback (callable) : called as fn(task, progress) whenever
+                    the progress of a task changes
+        content (vim.ServiceInstanceContent) : service content read at
+                    connect, read from service_instance if None
     Returns:
     Raises:
+        info.error of the first failed task, as soon as it fails without
+        waiting for the other tasks, TimeoutError if a task did not finish
+        within timeout
    """
-    property_collector = service_instance.content.propertyCollector
-    task_list = [str(task) for task in tasks]
-
-    # Create filter
-    obj_specs = [vmodl.query.PropertyCollector.ObjectSpec(obj=task) for task in tasks]
-    property_spec = vmodl.query.PropertyCollector.PropertySpec(
-        type=vim.Task, pathSet=[], all=True
+    outcomes = wait_for_tasks_ex(
+        service_instance,
+        tasks,
+        timeout=timeout,
+        progress_callback=progress_callback,
+        fail_fast=True,
+        content=content,
     )
-    filter_spec = vmodl.query.PropertyCollector.FilterSpec()
-    filter_spec.objectSet = obj_specs
-    filter_spec.propSet = [property_spec]
-    pcfilter = property_collector.CreateFilter(filter_spec, True)
+    for task in tasks:
+        outcome = outcomes[str(task)]
+        if outcome.state == vim.TaskInfo.State.error:
+            error = outcome.error or task.info.error
+            LOG.info(error.msg)
+            raise error
+    for task in tasks:
+        if outcomes[str(task)].timed_out:
+            raise TimeoutError(
+                "Task {0} did not complete within {1} seconds".format(task, timeout)
+            )
+
+
+def wait_for_tasks_ex(
+    service_instance,
+    tasks,
+    timeout=None,
+    max_wait_seconds=DEFAULT_MAX_WAIT_SECONDS,
+    progress_callback=None,
+    fail_fast=False,
+    content=None,
+):
+    """
+    Wait for tasks to complete and report the outcome of every task, unless
+    fail_fast is set a failed task does not stop waiting for the others
+    Args:
+        service_instance (vim.ServiceInstance) : root object for vcenter
+                    inventory traversal
+        tasks (list) : vim.Task objects to wait for
+        timeout (float) : overall seconds to wait, forever if None
+        max_wait_seconds (int) : seconds a single WaitForUpdatesEx call may block
+        progress_callback (callable) : called as fn(task, progress) whenever
+                    the progress of a task changes
+        fail_fast (bool) : return once a task failed, the outcomes of tasks
+                    still running then have neither a final state nor
+                    timed_out set
+        content (vim.ServiceInstanceContent) : service content read at
+                    connect, read from service_instance if None
+    Returns:
+        (dict) str(task) -> TaskOutcome, tasks that did not finish within
+        timeout have timed_out set
+    """
+    outcomes = dict((str(task), TaskOutcome(task)) for task in tasks)
+    pending = set(outcomes)
+    deadline = None if timeout is None else time.time() + timeout
+    timed_out = False
+
+    if content is None:
+        content = service_instance.content
+    # a private collector, WaitForUpdatesEx on the shared session collector
+    # would hand the updates of concurrent waiters to whichever call returns
+    collector = content.propertyCollector.CreatePropertyCollector()
     try:
-        version, state = None, None
+        obj_specs = [
+            vmodl.query.PropertyCollector.ObjectSpec(obj=task) for task in tasks
+        ]
+        property_spec = vmodl.query.PropertyCollector.PropertySpec(
+            type=vim.Task, pathSet=TASK_INFO_PATHS
+        )
+        filter_spec = vmodl.query.PropertyCollector.FilterSpec()
+        filter_spec.objectSet = obj_specs
+        filter_spec.propSet = [property_spec]
+        collector.CreateFilter(filter_spec, True)
 
-        # Loop looking for updates till the state moves to a completed state.
-        while len(task_list):
-            update = property_collector.WaitForUpdates(version)
+        version = ""
+        failed = False
+        while pending:
+            wait_seconds = max_wait_seconds
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    timed_out = True
+                    break
+                wait_seconds = min(wait_seconds, int(math.ceil(remaining)))
+            options = vmodl.query.PropertyCollector.WaitOptions(
+                maxWaitSeconds=wait_seconds
+            )
+            update = collector.WaitForUpdatesEx(version, options)
+            if update is None:
+                continue
             for filter_set in update.filterSet:
                 for obj_set in filter_set.objectSet:
-                    task = obj_set.obj
-                    for change in obj_set.changeSet:
-                        if change.name == "info":
-                            state = change.val.state
-                        elif change.name == "info.state":
-                            state = change.val
-                        else:
-                            continue
-                        if state == vim.TaskInfo.State.success:
-
-                            # Remove task from taskList
-                            task_list.remove(str(task))
-                        elif state == vim.TaskInfo.State.error:
-                            LOG.info(task.info.error.msg)
-                            raise task.info.error
-
-            # Move to next version
+                    outcome = outcomes.get(str(obj_set.obj))
+                    if outcome is None:
+                        continue
+                    progress = outcome.progress
+                    outcome.apply(obj_set.changeSet)
+                    if progress_callback and outcome.progress != progress:
+                        progress_callback(outcome.task, outcome.progress)
+                    if outcome.done:
+                        pending.discard(str(outcome.task))
+                        if fail_fast and not outcome.succeeded:
+                            failed = True
             version = update.version
+            if failed:
+                break
     finally:
-        if pcfilter:
-            pcfilter.Destroy()
+        # destroying the collector destroys its filter as well
+        collector.Destroy()
+
+    if timed_out:
+        for key in pending:
+            outcomes[key].timed_out = True
+    return outcomes
 
 
-def get_obj(content, vimtype, name, _in=None):
+def get_obj(content, vimtype, name, _in=None, view_manager=None):
     """
     Return an object by name, if name is None the
     first found object is returned
@@ -70,6 +256,8 @@ def get_obj(content, vimtype, name, _in=None):
         vimtype (str) : type of managed object to be retrieved
         name (str) : name of the managed object to be retrieved
         _in (vim.ManagedEntity) : Instance where the object is to be searched
+        view_manager (ContainerViewManager) : reuse views from this manager,
+                    else a temporary view is created and destroyed
     Returns:
         if found, managed object of type vimtype is returned, else none
     """
@@ -79,15 +267,27 @@ def get_obj(content, vimtype, name, _in=None):
     if not _in:
         _in = content.rootFolder
 
-    container = content.viewManager.CreateContainerView(_in, vimtype, True)
-    for c in container.view:
-        if c.name == name:
-            return c
-    return None
+    if view_manager is not None:
+        container = view_manager.get(vimtype, container=_in)
+    else:
+        container = content.viewManager.CreateContainerView(_in, vimtype, True)
+    try:
+        for c in container.view:
+            if c.name == name:
+                return c
+        return None
+    finally:
+        if view_manager is None:
+            container.Destroy()
 
 
 def collect_properties(
-    service_instance, view_ref, obj_type, path_set=None, include_mors=False
+    service_instance,
+    view_ref,
+    obj_type,
+    path_set=None,
+    include_mors=False,
+    content=None,
 ):
     """
     Collect properties for managed objects from a view ref
@@ -98,11 +298,117 @@ def collect_properties(
         path_set (list): List of properties to retrieve
         include_mors (bool): If True include the managed objects
                                        refs in the result
+        content (vim.ServiceInstanceContent): service content read at
+                                       connect, read from service_instance
+                                       if None
     Returns:
         A list of properties for the managed objects
     """
-    collector = service_instance.content.propertyCollector
+    data = []
+    for record in iter_properties(
+        service_instance, view_ref, obj_type, path_set=path_set, content=content
+    ):
+        # unset properties are left out, as RetrieveContents used to do
+        properties = dict((k, v) for k, v in record if v is not None)
 
+        if include_mors:
+            properties["obj"] = record.obj
+
+        data.append(properties)
+    return data
+
+
+def iter_properties(
+    service_instance,
+    view_ref,
+    obj_type,
+    path_set=None,
+    max_objects=DEFAULT_PAGE_SIZE,
+    content=None,
+):
+    """
+    Stream properties for managed objects from a view ref, one
+    RetrievePropertiesEx page at a time so memory stays bounded by the
+    page size instead of the inventory size
+    Args:
+        service_instance (vim.ServiceInstance): ServiceInstance connection
+        view_ref (vim.view.*): Starting point of inventory navigation
+        obj_type (vim.*): Type of managed object
+        path_set (list): List of properties to retrieve, all if empty
+        max_objects (int): upper bound of objects fetched per page
+        content (vim.ServiceInstanceContent): service content read at
+                    connect, read from service_instance if None
+    Yields:
+        (PropertyRecord) properties of one managed object, properties that are
+        not set on the object are None
+    """
+    if content is None:
+        content = service_instance.content
+    collector = content.propertyCollector
+    filter_spec = build_view_filter_spec(view_ref, obj_type, path_set)
+    names = tuple(path_set) if path_set else None
+
+    for obj in retrieve_properties_ex(collector, filter_spec, max_objects):
+        if names is None:
+            yield PropertyRecord(
+                obj.obj,
+                tuple(prop.name for prop in obj.propSet),
+                tuple(prop.val for prop in obj.propSet),
+            )
+            continue
+        values = [None] * len(names)
+        for prop in obj.propSet:
+            values[names.index(prop.name)] = prop.val
+        yield PropertyRecord(obj.obj, names, tuple(values))
+
+
+def get_properties(collector, obj, path_set):
+    """
+    Fetch only the given properties of one managed object, with a single
+    RetrievePropertiesEx call. Reading e.g. vm.config.hardware.device instead
+    makes pyVmomi fetch the whole config, extraConfig included.
+    Args:
+        collector (vmodl.query.PropertyCollector): property collector to query
+        obj (vim.ManagedEntity): managed object to read
+        path_set (list): property paths, e.g. ["runtime.powerState"]
+    Returns:
+        (PropertyRecord) the properties, None for the ones not set
+    Raises: vmodl.fault.ManagedObjectNotFound if obj does not exist, the
+        fault of a property the server could not return, e.g. NoPermission
+    """
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec(
+        objectSet=[vmodl.query.PropertyCollector.ObjectSpec(obj=obj, skip=False)],
+        propSet=[
+            vmodl.query.PropertyCollector.PropertySpec(
+                type=obj.__class__, pathSet=path_set
+            )
+        ],
+    )
+    names = tuple(path_set)
+    values = [None] * len(names)
+    found = False
+    for content in retrieve_properties_ex(collector, filter_spec):
+        found = True
+        if content.missingSet:
+            # not returning the value is no proof it is unset
+            raise content.missingSet[0].fault
+        for prop in content.propSet:
+            values[names.index(prop.name)] = prop.val
+    if not found:
+        raise vmodl.fault.ManagedObjectNotFound(obj=obj)
+    return PropertyRecord(obj, names, tuple(values))
+
+
+def build_view_filter_spec(view_ref, obj_type, path_set=None):
+    """
+    Build a filter spec that selects properties of every object in a view
+    Args:
+        view_ref (vim.view.*): Starting point of inventory navigation
+        obj_type (vim.*): Type of managed object
+        path_set (list): List of properties to retrieve, all if empty
+    Returns:
+        (vmodl.query.PropertyCollector.FilterSpec) filter spec
+    """
     # Create object specification to define the starting point of
     # inventory navigation
     obj_spec = vmodl.query.PropertyCollector.ObjectSpec()
@@ -131,45 +437,82 @@ def collect_properties(
     filter_spec = vmodl.query.PropertyCollector.FilterSpec()
     filter_spec.objectSet = [obj_spec]
     filter_spec.propSet = [property_spec]
+    return filter_spec
 
-    # Retrieve properties
-    props = collector.RetrieveContents([filter_spec])
-
-    data = []
-    for obj in props:
-        properties = {}
-        for prop in obj.propSet:
-            properties[prop.name] = prop.val
-
-        if include_mors:
-            properties["obj"] = obj.obj
 
-        data.append(properties)
-    return data
+def retrieve_properties_ex(collector, filter_spec, max_objects=None):
+    """
+    Retrieve properties page by page with RetrievePropertiesEx
+    Args:
+        collector (vmodl.query.PropertyCollector): property collector to query
+        filter_spec (vmodl.query.PropertyCollector.FilterSpec): what to retrieve
+        max_objects (int): upper bound of objects returned per page, server
+                    default if None
+    Yields:
+        (vmodl.query.PropertyCollector.ObjectContent) one per managed object
+    """
+    options = vmodl.query.PropertyCollector.RetrieveOptions(maxObjects=max_objects)
+    result = collector.RetrievePropertiesEx([filter_spec], options)
+    token = None
+    try:
+        while result:
+            token = result.token
+            for obj in result.objects:
+                yield obj
+            if not token:
+                break
+            result = collector.ContinueRetrievePropertiesEx(token)
+            token = None
+    finally:
+        # release the server side result set if the caller stopped early
+        if token:
+            try:
+                collector.CancelRetrievePropertiesEx(token)
+            except Exception:
+                pass
 
 
-def get_container_view(service_instance, obj_type, container=None):
+def get_container_view(
+    service_instance, obj_type, container=None, view_manager=None, content=None
+):
     """
     Get a vSphere Container View reference to all objects of type 'obj_type'
     It is up to the caller to take care of destroying the View when no longer
-    needed.
+    needed, unless it was handed out by a view manager.
     Args:
         service_instance (vim.ServiceInstance) : root object for invenory traversal
         obj_type (list): A list of managed object types
         container (vim.ManagedEntity) : The object that the view presents
+        view_manager (ContainerViewManager) : reuse views from this manager
+        content (vim.ServiceInstanceContent) : service content read at
+                    connect, read from service_instance if None
     Returns:
         (vim.view.ContainerView) : A container view ref to the discovered managed objects
     """
+    if view_manager is not None:
+        return view_manager.get(obj_type, container=container)
+
+    if content is None:
+        content = service_instance.content
     if not container:
-        container = service_instance.content.rootFolder
+        container = content.rootFolder
 
-    view_ref = service_instance.content.viewManager.CreateContainerView(
+    view_ref = content.viewManager.CreateContainerView(
         container=container, type=obj_type, recursive=True
     )
     return view_ref
 
 
-def get_objects_by_prop(service_instance, prop, obj_type, obj_value, container=None):
+def get_objects_by_prop(
+    service_instance,
+    prop,
+    obj_type,
+    obj_value,
+    container=None,
+    view_manager=None,
+    property_indexes=None,
+    content=None,
+):
     """
     Get the vSphere object with the specified property
     Args:
@@ -178,23 +521,44 @@ def get_objects_by_prop(service_instance, prop, obj_type, obj_value, container=N
         obj_type (str): type of a managed object
         obj_value (str): value of a managed object that needs to be matched
         container (vim.ManagedEntity): The object that the view presents
+        view_manager (ContainerViewManager) : reuse views from this manager,
+                    else a temporary view is created and destroyed
+        property_indexes (PropertyIndexes) : answer from the index of
+                    (obj_type, prop, container) of this connection instead
+                    of collecting the property of every object
+        content (vim.ServiceInstanceContent) : service content read at
+                    connect, read from service_instance if None
     Returns:
         (vim.ManagedEntity) ; First Object that match the value
     """
 
-    view = get_container_view(
-        service_instance, obj_type=[obj_type], container=container
-    )
-    props = [prop]
-    obj_details = collect_properties(
-        service_instance,
-        view_ref=view,
-        obj_type=obj_type,
-        path_set=props,
-        include_mors=True,
-    )
+    if property_indexes is not None:
+        objs = property_indexes.get(obj_type, prop, container).get(obj_value)
+    else:
+        view = get_container_view(
+            service_instance,
+            obj_type=[obj_type],
+            container=container,
+            view_manager=view_manager,
+            content=content,
+        )
+        try:
+            objs = [
+                record.obj
+                for record in iter_properties(
+                    service_instance,
+                    view_ref=view,
+                    obj_type=obj_type,
+                    path_set=[prop],
+                    content=content,
+                )
+                if record.values[0] == obj_value
+            ]
+        finally:
+            if view_manager is None:
+                view.Destroy()
     try:
-        obj = [ob.pop("obj") for ob in obj_details if ob.get(prop) == obj_value][0]
+        obj = objs[0]
     except IndexError:
         raise Exception(
             "Failed to fetch VMware object: '{0}' with {1}: '{2}'".format(
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""Fixtures running VMware against the fake vCenter"""
+
+import pytest
+
+from ..fake_vcenter import FakeVCenter, generate_inventory
+from ..fake_vcenter.inventory import VirtualMachineEntry
+from ..fake_vcenter.server import _self_signed_certificate
+from ..src.vmware import VMware
+
+DATACENTER = "Datacenter-1"
+POWERED_ON = "poweredOn"
+POWERED_OFF = "poweredOff"
+
+
+@pytest.fixture(scope="session")
+def certificate(tmp_path_factory):
+    # creating a certificate takes most of the start up of a fake vCenter
+    return _self_signed_certificate(str(tmp_path_factory.mktemp("cert")), "127.0.0.1")
+
+
+@pytest.fixture
+def fake_vcenter(certificate):
+    certfile, keyfile = certificate
+    fake = FakeVCenter(
+        generate_inventory(vms=20, datacenters=1), certfile=certfile, keyfile=keyfile
+    )
+    with fake:
+        yield fake
+
+
+@pytest.fixture
+def vmware(fake_vcenter):
+    handle = VMware(fake_vcenter.host, "user", "pass", port=fake_vcenter.port)
+    yield handle
+    handle.disconnect()
+
+
+def vm_ids(fake_vcenter, power_state=None):
+    """
+    Returns instance uuids of the vms of DATACENTER, sorted
+    Args:
+        fake_vcenter (FakeVCenter) : fake serving the vms
+        power_state (str) : only vms in this power state, any if None
+    """
+    return sorted(
+        vm.instance_uuid
+        for vm in fake_vcenter.inventory.entries(VirtualMachineEntry)
+        if vm.datacenter.props["name"] == DATACENTER
+        and (power_state is None or vm.power_state == power_state)
+    )
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Tests of TTLCache"""
+
+from ..src.vmware import cache
+from ..src.vmware.cache import TTLCache
+
+
+class _Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def _frozen(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(cache.time, "time", clock.time)
+    return clock
+
+
+def test_entry_expires_after_ttl(monkeypatch):
+    clock = _frozen(monkeypatch)
+    ttl_cache = TTLCache(ttl=10)
+    ttl_cache.set("dc", "datacenter-1")
+
+    clock.now += 9.9
+    assert ttl_cache.get("dc") == "datacenter-1"
+    clock.now += 0.1
+    assert ttl_cache.get("dc") is None
+    # the expired entry is dropped on read
+    assert len(ttl_cache) == 0
+
+
+def test_expired_entry_returns_default(monkeypatch):
+    clock = _frozen(monkeypatch)
+    ttl_cache = TTLCache(ttl=1)
+    ttl_cache.set("dc", "datacenter-1")
+    clock.now += 5
+    assert ttl_cache.get("dc", "missing") == "missing"
+    assert "dc" not in ttl_cache
+
+
+def test_set_restarts_ttl(monkeypatch):
+    clock = _frozen(monkeypatch)
+    ttl_cache = TTLCache(ttl=10)
+    ttl_cache.set("dc", 1)
+    clock.now += 8
+    ttl_cache.set("dc", 2)
+    clock.now += 8
+    assert ttl_cache.get("dc") == 2
+
+
+def test_no_ttl_keeps_entries(monkeypatch):
+    clock = _frozen(monkeypatch)
+    ttl_cache = TTLCache(ttl=None)
+    ttl_cache.set("dc", 1)
+    clock.now += 10**9
+    assert ttl_cache.get("dc") == 1
+
+
+def test_zero_ttl_disables_caching():
+    ttl_cache = TTLCache(ttl=0)
+    ttl_cache.set("dc", 1)
+    assert ttl_cache.get("dc") is None
+    assert len(ttl_cache) == 0
+
+
+def test_invalidate():
+    ttl_cache = TTLCache()
+    ttl_cache.set("a", 1)
+    ttl_cache.set("b", 2)
+    ttl_cache.invalidate("a")
+    assert "a" not in ttl_cache
+    assert "b" in ttl_cache
+    ttl_cache.invalidate()
+    assert len(ttl_cache) == 0
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""Tests of the config spec merging of ReconfigCoalescer"""
+
+import threading
+import time
+
+import pytest
+from pyVmomi import vim
+
+from .conftest import DATACENTER, vm_ids
+from ..src.vmware.coalescer import ReconfigConflictError, _SpecMerger
+
+
+def _scsi_controller(key=1000, bus=0):
+    return vim.vm.device.ParaVirtualSCSIController(
+        key=key, busNumber=bus, sharedBus="noSharing"
+    )
+
+
+def _disk(key, controller_key, unit):
+    return vim.vm.device.VirtualDisk(
+        key=key, controllerKey=controller_key, unitNumber=unit, capacityInKB=1024
+    )
+
+
+def _add(device):
+    return vim.vm.device.VirtualDeviceSpec(operation="add", device=device)
+
+
+def _devices():
+    return [_scsi_controller(), _disk(2000, 1000, 0)]
+
+
+def _merger(read_devices=_devices):
+    merged = vim.vm.ConfigSpec()
+    return merged, _SpecMerger(merged, read_devices)
+
+
+def _slots(merged):
+    return [
+        (change.device.controllerKey, change.device.unitNumber)
+        for change in merged.deviceChange
+        if isinstance(change.device, vim.vm.device.VirtualDisk)
+    ]
+
+
+def test_merges_scalars_and_rejects_conflicts():
+    merged, merger = _merger()
+    merger.merge(vim.vm.ConfigSpec(numCPUs=4))
+    merger.merge(vim.vm.ConfigSpec(numCPUs=4, memoryMB=4096))
+    with pytest.raises(ReconfigConflictError):
+        merger.merge(vim.vm.ConfigSpec(numCPUs=2, numCoresPerSocket=2))
+    # a rejected fragment leaves no trace
+    assert (merged.numCPUs, merged.memoryMB, merged.numCoresPerSocket) == (
+        4,
+        4096,
+        None,
+    )
+
+
+def test_rejects_second_edit_of_a_device():
+    merged, merger = _merger()
+    edit = vim.vm.device.VirtualDeviceSpec(
+        operation="edit", device=_disk(2000, 1000, 0)
+    )
+    merger.merge(vim.vm.ConfigSpec(deviceChange=[edit]))
+    with pytest.raises(ReconfigConflictError):
+        merger.merge(
+            vim.vm.ConfigSpec(
+                deviceChange=[
+                    vim.vm.device.VirtualDeviceSpec(
+                        operation="remove", device=_disk(2000, 1000, 0)
+                    )
+                ]
+            )
+        )
+    assert len(merged.deviceChange) == 1
+
+
+def test_temporary_keys_are_unique():
+    merged, merger = _merger()
+    for _ in range(3):
+        merger.merge(vim.vm.ConfigSpec(deviceChange=[_add(_disk(-1, 1000, None))]))
+    keys = [change.device.key for change in merged.deviceChange]
+    assert len(set(keys)) == 3
+    assert all(key < 0 for key in keys)
+
+
+def test_moves_disks_added_to_the_same_unit():
+    merged, merger = _merger()
+    merger.merge(vim.vm.ConfigSpec(deviceChange=[_add(_disk(-1, 1000, 1))]))
+    merger.merge(vim.vm.ConfigSpec(deviceChange=[_add(_disk(-1, 1000, 1))]))
+    merger.merge(vim.vm.ConfigSpec(deviceChange=[_add(_disk(-1, 1000, 1))]))
+    assert _slots(merged) == [(1000, 1), (1000, 2), (1000, 3)]
+
+
+def test_rejects_colliding_disks_without_read_devices():
+    merged, merger = _merger(read_devices=None)
+    merger.merge(vim.vm.ConfigSpec(deviceChange=[_add(_disk(-1, 1000, 1))]))
+    with pytest.raises(ReconfigConflictError):
+        merger.merge(vim.vm.ConfigSpec(deviceChange=[_add(_disk(-1, 1000, 1))]))
+    assert _slots(merged) == [(1000, 1)]
+
+
+def test_moves_controllers_added_on_the_same_bus():
+    merged, merger = _merger()
+    for _ in range(2):
+        merger.merge(
+            vim.vm.ConfigSpec(
+                deviceChange=[
+                    _add(_scsi_controller(key=-1, bus=1)),
+                    _add(_disk(-2, -1, 0)),
+                ]
+            )
+        )
+    controllers = [
+        change.device
+        for change in merged.deviceChange
+        if isinstance(change.device, vim.vm.device.VirtualSCSIController)
+    ]
+    assert [controller.busNumber for controller in controllers] == [1]
+    disks = _slots(merged)
+    assert disks[0] == (controllers[0].key, 0)
+    # the disk of the dropped controller moved to a free slot
+    assert disks[1] == (1000, 1)
+
+
+def test_rejects_colliding_disk_without_free_slot():
+    full_ide = [
+        vim.vm.device.VirtualIDEController(key=200, busNumber=0),
+        vim.vm.device.VirtualIDEController(key=201, busNumber=1),
+        vim.vm.device.VirtualCdrom(key=3000, controllerKey=201, unitNumber=0),
+        vim.vm.device.VirtualCdrom(key=3001, controllerKey=201, unitNumber=1),
+        vim.vm.device.VirtualCdrom(key=3002, controllerKey=200, unitNumber=1),
+    ]
+    merged, merger = _merger(read_devices=lambda: full_ide)
+    merger.merge(vim.vm.ConfigSpec(deviceChange=[_add(_disk(-1, 200, 0))]))
+    with pytest.raises(ReconfigConflictError):
+        merger.merge(vim.vm.ConfigSpec(deviceChange=[_add(_disk(-1, 200, 0))]))
+    assert _slots(merged) == [(200, 0)]
+
+
+def test_rejected_fragment_is_unchanged():
+    ide = [
+        vim.vm.device.VirtualIDEController(key=200, busNumber=0),
+        vim.vm.device.VirtualIDEController(key=201, busNumber=1),
+        vim.vm.device.VirtualCdrom(key=3000, controllerKey=201, unitNumber=0),
+        vim.vm.device.VirtualCdrom(key=3001, controllerKey=201, unitNumber=1),
+    ]
+    merged, merger = _merger(read_devices=lambda: ide)
+    merger.merge(vim.vm.ConfigSpec(deviceChange=[_add(_disk(-1, 200, 0))]))
+    # the first disk fits on the last free unit, the second one does not
+    disks = [_disk(-1, 200, 0), _disk(-2, 200, 0)]
+    with pytest.raises(ReconfigConflictError):
+        merger.merge(vim.vm.ConfigSpec(deviceChange=[_add(disk) for disk in disks]))
+    assert [(d.key, d.controllerKey, d.unitNumber) for d in disks] == [
+        (-1, 200, 0),
+        (-2, 200, 0),
+    ]
+    assert _slots(merged) == [(200, 0)]
+
+
+def test_concurrent_disk_adds_share_one_task(vmware, fake_vcenter):
+    vm_id = vm_ids(fake_vcenter)[0]
+    vmware.enable_reconfig_coalescing(window=0.3)
+    results = []
+
+    def _add_disk():
+        results.append(vmware.add_vdisk(DATACENTER, vm_id, disk_size=1))
+
+    fake_vcenter.reset_stats()
+    threads = [threading.Thread(target=_add_disk) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert results == [True] * 3
+    assert fake_vcenter.stats()["methods"]["VirtualMachine.ReconfigVM_Task"] == 1
+    vm = vmware.get_vm_in_dc(DATACENTER, vm_id)
+    disks = [
+        (device.controllerKey, device.unitNumber)
+        for device in vm.config.hardware.device
+        if isinstance(device, vim.vm.device.VirtualDisk)
+    ]
+    assert sorted(disks) == [(1000, 0), (1000, 1), (1000, 2), (1000, 3)]
+
+
+def test_disable_submits_pending_batches(vmware, fake_vcenter):
+    vm_id = vm_ids(fake_vcenter)[0]
+    coalescer = vmware.enable_reconfig_coalescing(window=60)
+    handle = vmware.update_vcpu_core_memory(DATACENTER, vm_id, num_vcpu=4, wait=False)
+    assert not handle.done()
+    started = time.time()
+    vmware.disable_reconfig_coalescing()
+    assert time.time() - started < 10
+    assert handle.result(0) is True
+    assert coalescer.stats() == {"fragments": 1, "tasks": 1, "vms": 0}
+    with pytest.raises(RuntimeError):
+        coalescer.submit(vmware.get_vm_in_dc(DATACENTER, vm_id), vim.vm.ConfigSpec())
+    assert vmware.get_vm_in_dc(DATACENTER, vm_id).config.hardware.numCPU == 4
+
+
+def test_disconnect_submits_pending_batches(vmware, fake_vcenter):
+    vm_id = vm_ids(fake_vcenter)[0]
+    memory = vmware.get_vm_in_dc(DATACENTER, vm_id).config.hardware.memoryMB * 2
+    coalescer = vmware.enable_reconfig_coalescing(window=60)
+    handle = vmware.update_vcpu_core_memory(
+        DATACENTER, vm_id, memory=memory, wait=False
+    )
+    vmware.disconnect()
+    assert handle.result(0) is True
+    assert coalescer.stats()["vms"] == 0
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""Tests of the disk slot allocation of DiskSlots"""
+
+from pyVmomi import vim
+
+from ..src.constants import VMWARE
+from ..src.vmware.disk_slots import DiskSlots
+
+SCSI = VMWARE.DISKADAPTER.SCSI
+SATA = VMWARE.DISKADAPTER.SATA
+IDE = VMWARE.DISKADAPTER.IDE
+
+
+def _disks(controller_key, units, first_key=2000):
+    return [
+        vim.vm.device.VirtualDisk(
+            key=first_key + index, controllerKey=controller_key, unitNumber=unit
+        )
+        for index, unit in enumerate(units)
+    ]
+
+
+def _scsi(key=1000, bus=0, **kwargs):
+    return vim.vm.device.VirtualLsiLogicController(key=key, busNumber=bus, **kwargs)
+
+
+def _full_scsi(key=1000, bus=0):
+    units = [unit for unit in range(16) if unit != 7]
+    return [_scsi(key, bus)] + _disks(key, units, first_key=2000 + 100 * bus)
+
+
+def test_skips_the_unit_of_the_scsi_controller():
+    slots = DiskSlots([_scsi()] + _disks(1000, range(7)))
+    assert slots.allocate(SCSI) == (1000, 8)
+    assert slots.controller_specs == []
+
+
+def test_honours_scsi_controller_unit_number():
+    slots = DiskSlots([_scsi(scsiCtlrUnitNumber=0)])
+    assert slots.allocate(SCSI) == (1000, 1)
+
+
+def test_counts_pending_devices():
+    pending = _disks(1000, [0, 1], first_key=-10)
+    slots = DiskSlots([_scsi()] + pending)
+    assert slots.allocate(SCSI) == (1000, 2)
+
+
+def test_adds_controller_when_full():
+    slots = DiskSlots(_full_scsi())
+    key, unit = slots.allocate(SCSI)
+    assert key < 0 and unit == 0
+    (spec,) = slots.controller_specs
+    assert spec.operation == "add"
+    # the model of the existing controller is kept
+    assert isinstance(spec.device, vim.vm.device.VirtualLsiLogicController)
+    assert (spec.device.key, spec.device.busNumber) == (key, 1)
+    assert slots.adapter_of(key) == SCSI
+    assert slots.allocate(SCSI) == (key, 1)
+    assert len(slots.controller_specs) == 1
+
+
+def test_no_slot_once_every_controller_is_full():
+    devices = []
+    for bus in range(VMWARE.MAX_SCSI_CONTROLLER):
+        devices += _full_scsi(1000 + bus, bus)
+    slots = DiskSlots(devices)
+    assert slots.allocate(SCSI) is None
+    assert slots.controller_specs == []
+
+
+def test_sata():
+    slots = DiskSlots(
+        [vim.vm.device.VirtualAHCIController(key=15000, busNumber=0)]
+        + _disks(15000, [0])
+    )
+    assert slots.allocate(SATA) == (15000, 1)
+
+
+def test_adds_first_sata_controller():
+    slots = DiskSlots([_scsi()])
+    key, unit = slots.allocate(SATA)
+    (spec,) = slots.controller_specs
+    assert isinstance(spec.device, vim.vm.device.VirtualAHCIController)
+    assert (spec.device.key, spec.device.busNumber, unit) == (key, 0, 0)
+
+
+def test_ide_controllers_are_not_added():
+    devices = [
+        vim.vm.device.VirtualIDEController(key=200, busNumber=0),
+        vim.vm.device.VirtualIDEController(key=201, busNumber=1),
+    ]
+    devices += _disks(200, [0, 1]) + _disks(201, [0], first_key=3000)
+    slots = DiskSlots(devices)
+    assert slots.allocate(IDE) == (201, 1)
+    assert slots.allocate(IDE) is None
+    assert slots.controller_specs == []
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""Tests of the SOAP round trip instrumentation"""
+
+import socket
+
+import pytest
+from pyVmomi import vim
+from pyVmomi.SoapAdapter import SoapStubAdapter
+
+from ..src.vmware.instrumentation import (
+    disable_instrumentation,
+    enable_instrumentation,
+)
+
+
+class _FailingConnection(object):
+    """Pooled connection whose request fails before a response is read"""
+
+    def request(self, *args, **kwargs):
+        raise socket.error("Connection reset by peer")
+
+    def getresponse(self):
+        raise AssertionError("no response after a failed request")
+
+    def close(self):
+        pass
+
+
+def test_failed_request_leaves_connection_unpatched(monkeypatch):
+    conn = _FailingConnection()
+    monkeypatch.setattr(SoapStubAdapter, "GetConnection", lambda stub: conn)
+    sink = enable_instrumentation()
+    try:
+        stub = SoapStubAdapter(host="127.0.0.1", port=1)
+        si = vim.ServiceInstance("ServiceInstance", stub)
+        with pytest.raises(socket.error):
+            si.CurrentTime()
+    finally:
+        disable_instrumentation(sink)
+    assert "getresponse" not in vars(conn)
+    assert sink.stats()["vsphere"]["ServiceInstance.CurrentTime"]["errors"] == 1
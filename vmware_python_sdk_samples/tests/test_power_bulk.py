@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Tests of VMware.change_power_state_bulk"""
+
+import copy
+import time
+
+from .conftest import DATACENTER, POWERED_OFF, POWERED_ON, vm_ids
+from ..src.constants import VMWARE
+from ..src.vmware import VMware
+
+
+def test_bulk_reports_every_vm(vmware, fake_vcenter):
+    off = vm_ids(fake_vcenter, POWERED_OFF)[:3]
+    on = vm_ids(fake_vcenter, POWERED_ON)[:2]
+    report = vmware.change_power_state_bulk(
+        DATACENTER, off + on + ["missing"], VMWARE.OPERATIONS.POWER_ON
+    )
+    assert [report[vm_id]["status"] for vm_id in off] == [VMWARE.TASKSTATUS.SUCCESS] * 3
+    assert [report[vm_id]["status"] for vm_id in on] == [
+        VMWARE.TASKSTATUS.UNCHANGED
+    ] * 2
+    assert report["missing"]["status"] == VMWARE.TASKSTATUS.NOT_FOUND
+
+
+def test_bulk_respects_task_timeout(fake_vcenter):
+    vmware = VMware(
+        fake_vcenter.host,
+        "user",
+        "pass",
+        port=fake_vcenter.port,
+        task_timeout=0.5,
+    )
+    try:
+        fake_vcenter.service.task_duration = 1
+        off = vm_ids(fake_vcenter, POWERED_OFF)[:3]
+        start = time.time()
+        report = vmware.change_power_state_bulk(
+            DATACENTER, off, VMWARE.OPERATIONS.POWER_ON, concurrency=1
+        )
+        assert time.time() - start < 1
+        assert [entry["status"] for entry in report.values()] == [
+            VMWARE.TASKSTATUS.FAILED
+        ] * 3
+        returned = copy.deepcopy(report)
+        # the submitted task completes after the call returned
+        time.sleep(1)
+        assert report == returned
+    finally:
+        vmware.disconnect()
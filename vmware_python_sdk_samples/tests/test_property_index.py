@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""Tests of the property indexes of a VMware handle"""
+
+from .conftest import DATACENTER
+from ..src.vmware import VMware
+
+
+def _server_objects(fake_vcenter):
+    stats = fake_vcenter.stats()
+    return stats["views"], stats["collectors"], stats["filters"]
+
+
+def test_indexes_belong_to_the_handle(fake_vcenter):
+    before = _server_objects(fake_vcenter)
+    vmware = VMware(
+        fake_vcenter.host, "user", "pass", port=fake_vcenter.port, property_index=True
+    )
+    other = VMware(fake_vcenter.host, "user", "pass", port=fake_vcenter.port)
+    for _ in range(2):
+        datacenter = vmware.get_datacenter(DATACENTER, use_cache=False)
+        assert datacenter.name == DATACENTER
+    assert len(vmware.enable_property_index()) == 1
+    # another handle does not share, nor answer from, the index
+    assert other.get_datacenter(DATACENTER).name == DATACENTER
+    other.disconnect(logout=False)
+
+    # without a logout only destroying them frees the server side objects
+    vmware.disconnect(logout=False)
+    assert _server_objects(fake_vcenter) == before
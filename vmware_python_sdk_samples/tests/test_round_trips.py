@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""SOAP round trips of the VMware methods against the fake vCenter"""
+
+from .conftest import DATACENTER, vm_ids
+from ..src.vmware import vmware_utils
+from ..src.vmware.instrumentation import soap_budget
+
+# a blocking wait on a private property collector
+TASK_WAIT = {
+    "PropertyCollector.CreatePropertyCollector": 1,
+    "PropertyCollector.CreateFilter": 1,
+    "PropertyCollector.WaitForUpdatesEx": 1,
+    "PropertyCollector.DestroyPropertyCollector": 1,
+}
+
+
+def _expected(**methods):
+    expected = dict(TASK_WAIT)
+    expected.update(methods)
+    return expected
+
+
+def test_get_vm_in_dc(vmware, fake_vcenter):
+    ids = vm_ids(fake_vcenter)
+    with soap_budget(max_calls=3) as budget:
+        vmware.get_vm_in_dc(DATACENTER, ids[0])
+    # the datacenter is looked up through a container view once, with the
+    # service content read at connect
+    assert budget.methods == {
+        "ViewManager.CreateContainerView": 1,
+        "PropertyCollector.RetrievePropertiesEx": 1,
+        "SearchIndex.FindByUuid": 1,
+    }
+    with soap_budget(max_calls=1) as budget:
+        vmware.get_vm_in_dc(DATACENTER, ids[1])
+    assert budget.methods == {"SearchIndex.FindByUuid": 1}
+
+
+def test_get_vm_in_dc_indexed(vmware, fake_vcenter):
+    vm_id = vm_ids(fake_vcenter)[0]
+    vmware.enable_vm_index()
+    vmware.get_vm_in_dc(DATACENTER, vm_id)
+    with soap_budget(max_calls=0):
+        vmware.get_vm_in_dc(DATACENTER, vm_id)
+
+
+def test_update_vcpu(vmware, fake_vcenter):
+    vm_id = vm_ids(fake_vcenter)[0]
+    vmware.get_datacenter(DATACENTER)
+    with soap_budget(max_calls=7) as budget:
+        assert vmware.update_vcpu(DATACENTER, vm_id, 4)
+    assert budget.methods == _expected(
+        **{
+            "SearchIndex.FindByUuid": 1,
+            "PropertyCollector.RetrievePropertiesEx": 1,
+            "VirtualMachine.ReconfigVM_Task": 1,
+        }
+    )
+
+
+def test_add_vdisk(vmware, fake_vcenter):
+    vm_id = vm_ids(fake_vcenter)[0]
+    vmware.get_datacenter(DATACENTER)
+    with soap_budget(max_calls=7) as budget:
+        assert vmware.add_vdisk(DATACENTER, vm_id, disk_size=1)
+    # only config.hardware.device is fetched to place the disk
+    assert budget.methods == _expected(
+        **{
+            "SearchIndex.FindByUuid": 1,
+            "PropertyCollector.RetrievePropertiesEx": 1,
+            "VirtualMachine.ReconfigVM_Task": 1,
+        }
+    )
+
+
+def _fetched_paths(monkeypatch):
+    fetched = []
+    get_properties = vmware_utils.get_properties
+
+    def _get_properties(collector, obj, path_set):
+        fetched.append(list(path_set))
+        return get_properties(collector, obj, path_set)
+
+    monkeypatch.setattr(vmware_utils, "get_properties", _get_properties)
+    return fetched
+
+
+def test_update_fetches_devices_only_when_needed(vmware, fake_vcenter, monkeypatch):
+    vm_id = vm_ids(fake_vcenter)[0]
+    fetched = _fetched_paths(monkeypatch)
+    hardware = [
+        "config.hardware.numCPU",
+        "config.hardware.numCoresPerSocket",
+        "config.hardware.memoryMB",
+    ]
+    assert vmware.update(DATACENTER, vm_id, num_vcpu=4, memory=8192)
+    assert fetched == [hardware]
+    del fetched[:]
+    assert vmware.update(DATACENTER, vm_id, num_vcpu=2, add_disks=[{"disk_size": 1}])
+    assert fetched == [hardware + ["config.hardware.device"]]
+    vm = vmware.get_vm_in_dc(DATACENTER, vm_id)
+    assert (vm.config.hardware.numCPU, vm.config.hardware.memoryMB) == (2, 8192)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Tests of SessionCache and of VMware handles sharing it"""
+
+import os
+import stat
+
+import pytest
+
+from ..src.vmware import VMware, VMwareError
+from ..src.vmware.pool import VMwarePool
+from ..src.vmware.session_cache import SessionCache
+
+HOST = "vcenter.example.com"
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SessionCache(str(tmp_path / "sessions" / "sessions.json"))
+
+
+def _mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+
+def test_cookie_needs_the_password(cache):
+    cache.set(HOST, 443, "user", "secret", "cookie-1")
+    assert cache.get(HOST, 443, "user", "secret") == "cookie-1"
+    assert cache.get(HOST, 443, "user", "wrong") is None
+    assert cache.get(HOST, 443, "other", "secret") is None
+    with open(cache.path) as fd:
+        assert "secret" not in fd.read()
+
+
+def test_slots_hold_a_session_each(cache):
+    cache.set(HOST, 443, "user", "secret", "cookie-0", slot=0)
+    cache.set(HOST, 443, "user", "secret", "cookie-1", slot=1)
+    assert cache.get(HOST, 443, "user", "secret") is None
+    assert cache.get(HOST, 443, "user", "secret", slot=0) == "cookie-0"
+    assert cache.get(HOST, 443, "user", "secret", slot=1) == "cookie-1"
+    cache.invalidate(HOST, 443, "user", slot=0)
+    assert cache.get(HOST, 443, "user", "secret", slot=0) is None
+    assert cache.get(HOST, 443, "user", "secret", slot=1) == "cookie-1"
+
+
+def test_files_are_private(cache):
+    cache.set(HOST, 443, "user", "secret", "cookie-1")
+    assert _mode(os.path.dirname(cache.path)) == 0o700
+    assert _mode(cache.path) == 0o600
+
+
+def test_refuses_shared_directory(cache):
+    cache.set(HOST, 443, "user", "secret", "cookie-1")
+    os.chmod(os.path.dirname(cache.path), 0o755)
+    assert cache.get(HOST, 443, "user", "secret") is None
+    cache.set(HOST, 443, "user", "secret", "cookie-2")
+    os.chmod(os.path.dirname(cache.path), 0o700)
+    assert cache.get(HOST, 443, "user", "secret") == "cookie-1"
+
+
+def _connect(fake_vcenter, cache, password="pass", **kwargs):
+    return VMware(
+        fake_vcenter.host,
+        "user",
+        password,
+        port=fake_vcenter.port,
+        session_cache=cache,
+        **kwargs
+    )
+
+
+def test_reattach_checks_the_password(fake_vcenter, cache):
+    fake_vcenter.service.password = "pass"
+    first = _connect(fake_vcenter, cache)
+    second = _connect(fake_vcenter, cache)
+    assert second.si._stub.cookie == first.si._stub.cookie
+    with pytest.raises(VMwareError):
+        _connect(fake_vcenter, cache, password="wrong")
+    for handle in (first, second):
+        handle.disconnect(logout=True)
+
+
+def test_pool_members_get_a_session_each(fake_vcenter, cache):
+    pool = VMwarePool(
+        fake_vcenter.host, "user", "pass", port=fake_vcenter.port, session_cache=cache
+    )
+    with pool.connection() as first:
+        with pool.connection() as second:
+            cookies = {first.si._stub.cookie, second.si._stub.cookie}
+            assert {first.session_slot, second.session_slot} == {0, 1}
+    assert len(cookies) == 2
+    pool.close()
+
+    # a new pool reattaches every member to the session of its slot
+    pool = VMwarePool(
+        fake_vcenter.host, "user", "pass", port=fake_vcenter.port, session_cache=cache
+    )
+    with pool.connection() as first:
+        with pool.connection() as second:
+            assert {first.si._stub.cookie, second.si._stub.cookie} == cookies
+    pool.close()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""Tests of TaskWatcher and of task_timeout"""
+
+import time
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+
+import pytest
+from pyVmomi import vim
+
+from .conftest import DATACENTER, POWERED_OFF, POWERED_ON, vm_ids
+from ..src.vmware import VMware
+from ..src.vmware.task_watcher import TaskWatcher
+from ..src.vmware.vmware import TaskTimeoutError, VMwareError
+
+
+def _vms(vmware, fake_vcenter, power_state, count):
+    ids = vm_ids(fake_vcenter, power_state)[:count]
+    assert len(ids) == count
+    return [vmware.get_vm_in_dc(DATACENTER, vm_id) for vm_id in ids]
+
+
+@pytest.fixture
+def watcher(vmware):
+    task_watcher = TaskWatcher(vmware.si, max_wait_seconds=1)
+    yield task_watcher
+    task_watcher.stop()
+
+
+def test_wait_returns_results(vmware, fake_vcenter, watcher):
+    vms = _vms(vmware, fake_vcenter, POWERED_ON, 3)
+    tasks = [vm.PowerOffVM_Task() for vm in vms]
+    assert watcher.wait(tasks, timeout=10) == [None, None, None]
+    assert len(watcher) == 0
+    assert [vm.runtime.powerState for vm in vms] == [POWERED_OFF] * 3
+
+
+def test_wait_raises_task_fault(vmware, fake_vcenter, watcher):
+    (on,) = _vms(vmware, fake_vcenter, POWERED_ON, 1)
+    (off,) = _vms(vmware, fake_vcenter, POWERED_OFF, 1)
+    tasks = [off.PowerOnVM_Task(), on.PowerOnVM_Task()]
+    with pytest.raises(vim.fault.InvalidPowerState):
+        watcher.wait(tasks, timeout=10)
+
+
+def test_wait_applies_one_deadline(vmware, fake_vcenter, watcher):
+    fake_vcenter.service.task_duration = 2
+    vms = _vms(vmware, fake_vcenter, POWERED_ON, 3)
+    tasks = [vm.PowerOffVM_Task() for vm in vms]
+    start = time.time()
+    with pytest.raises(FuturesTimeoutError):
+        watcher.wait(tasks, timeout=0.3)
+    assert time.time() - start < 1.5
+
+
+def test_wait_fails_fast(vmware, fake_vcenter, watcher):
+    (on,) = _vms(vmware, fake_vcenter, POWERED_ON, 1)
+    failing = on.PowerOnVM_Task()
+    fake_vcenter.service.task_duration = 5
+    (off,) = _vms(vmware, fake_vcenter, POWERED_OFF, 1)
+    slow = off.PowerOnVM_Task()
+    start = time.time()
+    with pytest.raises(vim.fault.InvalidPowerState):
+        watcher.wait([slow, failing], timeout=10)
+    assert time.time() - start < 2
+
+
+def test_stop_fails_pending_futures(vmware, fake_vcenter, watcher):
+    fake_vcenter.service.task_duration = 5
+    (vm,) = _vms(vmware, fake_vcenter, POWERED_ON, 1)
+    future = watcher.watch(vm.PowerOffVM_Task())
+    watcher.stop()
+    with pytest.raises(Exception, match="stopped"):
+        future.result(timeout=1)
+
+
+@pytest.mark.parametrize("task_watcher", [False, True])
+def test_task_timeout_raises_task_timeout_error(fake_vcenter, task_watcher):
+    vmware = VMware(
+        fake_vcenter.host,
+        "user",
+        "pass",
+        port=fake_vcenter.port,
+        task_watcher=task_watcher,
+        task_timeout=0.3,
+    )
+    try:
+        fake_vcenter.service.task_duration = 3
+        (vm,) = _vms(vmware, fake_vcenter, POWERED_ON, 1)
+        start = time.time()
+        with pytest.raises(TaskTimeoutError) as raised:
+            vmware.update_vm(vm, vim.vm.ConfigSpec(numCPUs=4))
+        assert isinstance(raised.value, VMwareError)
+        assert time.time() - start < 2.5
+    finally:
+        vmware.disconnect()
+
+
+def test_stop_returns_promptly(vmware, fake_vcenter):
+    task_watcher = TaskWatcher(vmware.si)
+    (vm,) = _vms(vmware, fake_vcenter, POWERED_ON, 1)
+    # stop while the watcher thread is starting up
+    task_watcher.watch(vm.PowerOffVM_Task())
+    started = time.time()
+    task_watcher.stop()
+    # well below the 30 seconds a lost cancel leaves the poll blocked
+    assert time.time() - started < 5
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Tests of VMware against the fake vCenter"""
+
+import gc
+import time
+import weakref
+
+import pytest
+from pyVmomi import vim
+
+from .conftest import DATACENTER, POWERED_OFF, POWERED_ON, vm_ids
+from ..src.constants import VMWARE
+from ..src.vmware import VMware, VMwareError
+
+
+def test_get_vm_in_dc_reuses_service_content(vmware, fake_vcenter):
+    ids = vm_ids(fake_vcenter)
+    vmware.get_vm_in_dc(DATACENTER, ids[0])
+    fake_vcenter.reset_stats()
+    for vm_id in ids[1:4]:
+        vmware.get_vm_in_dc(DATACENTER, vm_id)
+    methods = fake_vcenter.stats()["methods"]
+    assert "ServiceInstance.content" not in methods
+    assert methods["SearchIndex.FindByUuid"] == 3
+
+
+def test_disable_vm_index_returns_promptly(vmware, fake_vcenter):
+    vm_id = vm_ids(fake_vcenter)[0]
+    vmware.enable_vm_index()
+    for _ in range(2):
+        vmware.get_vm_in_dc(DATACENTER, vm_id)
+    started = time.time()
+    vmware.disable_vm_index()
+    # well below the 30 seconds a lost cancel leaves the poll blocked
+    assert time.time() - started < 5
+
+
+def test_vm_index_does_not_bring_back_a_removed_vm(vmware, fake_vcenter):
+    vm_id = vm_ids(fake_vcenter, POWERED_OFF)[0]
+    index = vmware.enable_vm_index()
+    datacenter = vmware.get_datacenter(DATACENTER)
+    vm = vmware.get_vm_in_dc(DATACENTER, vm_id)
+    assert vmware.delete_vm(DATACENTER, vm_id)
+    deadline = time.time() + 5
+    while index.lookup(datacenter, vm_id) is not None and time.time() < deadline:
+        time.sleep(0.05)
+    # a lookup that resolved the vm before it was removed records it late
+    index.add(datacenter, vm_id, vm)
+    assert index.lookup(datacenter, vm_id) is None
+
+
+@pytest.mark.parametrize(
+    "path, operation",
+    [
+        (
+            "config.hardware.device",
+            lambda vmware, vm_id: vmware.update_vm_networks_in_nic(
+                DATACENTER, vm_id, "VM Network 1"
+            ),
+        ),
+        (
+            "config.hardware.device",
+            lambda vmware, vm_id: vmware.add_vdisk(DATACENTER, vm_id, disk_size=1),
+        ),
+        (
+            "runtime.powerState",
+            lambda vmware, vm_id: vmware.delete_vm(DATACENTER, vm_id),
+        ),
+    ],
+)
+def test_property_fault_is_raised(vmware, fake_vcenter, path, operation):
+    vm_id = vm_ids(fake_vcenter, POWERED_ON)[0]
+    fake_vcenter.service.property_faults[path] = vim.fault.NoPermission(
+        privilegeId="System.Read"
+    )
+    fake_vcenter.reset_stats()
+    # a property that could not be read must not pass for an unset one
+    with pytest.raises(vim.fault.NoPermission):
+        operation(vmware, vm_id)
+    methods = fake_vcenter.stats()["methods"]
+    assert "VirtualMachine.ReconfigVM_Task" not in methods
+    assert "VirtualMachine.Destroy_Task" not in methods
+
+
+def test_add_vdisk_without_free_slot(vmware, fake_vcenter):
+    vm_id = vm_ids(fake_vcenter)[0]
+    ide = VMWARE.DISKADAPTER.IDE
+    # both IDE controllers of the vm are full and none can be added
+    disks = [{"disk_size": 1, "disk_adapter": ide}] * 4
+    assert vmware.add_vdisks(DATACENTER, vm_id, disks)
+    fake_vcenter.reset_stats()
+    with pytest.raises(VMwareError):
+        vmware.add_vdisk(DATACENTER, vm_id, disk_size=1, disk_adapter=ide)
+    assert "VirtualMachine.ReconfigVM_Task" not in fake_vcenter.stats()["methods"]
+
+
+def test_disconnected_handle_is_released(fake_vcenter):
+    handle = VMware(fake_vcenter.host, "user", "pass", port=fake_vcenter.port)
+    handle.disconnect()
+    ref = weakref.ref(handle)
+    del handle
+    gc.collect()
+    # the exit hook registered at connect must not keep it alive
+    assert ref() is None
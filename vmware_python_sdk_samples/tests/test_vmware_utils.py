@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""Tests of the task waiting helpers of vmware_utils"""
+
+import time
+
+import pytest
+from pyVmomi import vim
+
+from .conftest import DATACENTER, POWERED_OFF, POWERED_ON, vm_ids
+from ..src.vmware import vmware_utils
+
+
+def _vm(vmware, fake_vcenter, power_state, index=0):
+    return vmware.get_vm_in_dc(DATACENTER, vm_ids(fake_vcenter, power_state)[index])
+
+
+def test_wait_for_tasks_fails_fast(vmware, fake_vcenter):
+    failing = _vm(vmware, fake_vcenter, POWERED_ON).PowerOnVM_Task()
+    fake_vcenter.service.task_duration = 5
+    slow = _vm(vmware, fake_vcenter, POWERED_OFF).PowerOnVM_Task()
+    start = time.time()
+    with pytest.raises(vim.fault.InvalidPowerState):
+        vmware_utils.wait_for_tasks(vmware.si, [slow, failing], timeout=10)
+    assert time.time() - start < 2
+
+
+def test_wait_for_tasks_times_out(vmware, fake_vcenter):
+    fake_vcenter.service.task_duration = 5
+    task = _vm(vmware, fake_vcenter, POWERED_OFF).PowerOnVM_Task()
+    with pytest.raises(TimeoutError):
+        vmware_utils.wait_for_tasks(vmware.si, [task], timeout=1)
+
+
+def test_wait_for_tasks_ex_reports_every_outcome(vmware, fake_vcenter):
+    failing = _vm(vmware, fake_vcenter, POWERED_ON).PowerOnVM_Task()
+    fake_vcenter.service.task_duration = 0.5
+    slow = _vm(vmware, fake_vcenter, POWERED_OFF).PowerOnVM_Task()
+    outcomes = vmware_utils.wait_for_tasks_ex(vmware.si, [slow, failing], timeout=10)
+    assert outcomes[str(slow)].succeeded
+    assert outcomes[str(failing)].state == vim.TaskInfo.State.error
+    assert isinstance(outcomes[str(failing)].error, vim.fault.InvalidPowerState)
+    assert not any(outcome.timed_out for outcome in outcomes.values())